@@ -0,0 +1,65 @@
+import importlib.util
+import ssl
+from typing import Any, Dict, Optional
+
+import httpx
+
+class AIClientPool:
+    """按AI服务地址复用长连接的httpx客户端池
+
+    客户端在首次请求该服务地址时才创建，所有客户端共用一个SSL上下文（创建SSL上下文需要加载CA证书，耗时数十毫秒）
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30, http2: bool = False):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # HTTP/2需要安装h2（pip install httpx[http2]），未安装时回退到HTTP/1.1
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            print("未安装h2，AI客户端池回退到HTTP/1.1")
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    def _create_client(self, api_base: str) -> httpx.AsyncClient:
+        if self._ssl_context is None:
+            self._ssl_context = httpx.create_ssl_context()
+        return httpx.AsyncClient(base_url=api_base, limits=self.limits, http2=self.http2, verify=self._ssl_context)
+
+    def get(self, api_base: str) -> httpx.AsyncClient:
+        """获取指定服务地址的客户端，首次请求该地址时创建"""
+        key = api_base.rstrip("/")
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._create_client(key)
+            self._clients[key] = client
+        return client
+
+    async def close(self) -> None:
+        """关闭所有客户端及其连接"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取客户端池信息"""
+        return {
+            "providers": sorted(self._clients.keys()),
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections
+        }
+
+def create_ai_client_pool(config: Optional[Dict[str, Any]]) -> AIClientPool:
+    """根据ai.http_pool配置创建客户端池"""
+    config = config or {}
+    return AIClientPool(
+        max_connections=config.get("max_connections", 100),
+        max_keepalive_connections=config.get("max_keepalive_connections", 20),
+        keepalive_expiry=config.get("keepalive_expiry", 30),
+        http2=config.get("http2", False)
+    )
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+class ProviderStats:
+    """单个AI服务的滚动延迟和错误率统计"""
+
+    __slots__ = ("latencies", "outcomes", "consecutive_failures", "last_failure_at", "requests")
+
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.last_failure_at = 0.0
+        self.requests = 0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+class AIRouter:
+    """按滚动延迟和错误率为AI服务排序，连续失败的服务暂时降级"""
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown: float = 30,
+                 error_penalty: float = 4.0):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.error_penalty = error_penalty
+        self._stats: Dict[str, ProviderStats] = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, name: str) -> ProviderStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = ProviderStats(self.window)
+        return stats
+
+    def record(self, name: str, latency: float, success: bool) -> None:
+        """记录一次请求结果"""
+        with self._lock:
+            stats = self._get_stats(name)
+            stats.requests += 1
+            stats.outcomes.append(success)
+            if success:
+                stats.latencies.append(latency)
+                stats.consecutive_failures = 0
+            else:
+                stats.consecutive_failures += 1
+                stats.last_failure_at = time.monotonic()
+
+    def is_tripped(self, name: str) -> bool:
+        """连续失败达到阈值且仍在冷却期内"""
+        stats = self._stats.get(name)
+        return (stats is not None and stats.consecutive_failures >= self.failure_threshold
+                and time.monotonic() - stats.last_failure_at < self.cooldown)
+
+    def score(self, name: str) -> float:
+        """健康度评分，越小越好；没有数据的服务优先尝试"""
+        stats = self._stats.get(name)
+        if stats is None or not stats.outcomes:
+            return 0.0
+        median = stats.percentile(0.5)
+        latency = median if median is not None else 1.0
+        return latency * (1 + self.error_penalty * stats.error_rate)
+
+    def rank(self, providers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按健康度排序服务列表，冷却中的服务排在最后；分数相同时保持原有顺序"""
+        with self._lock:
+            keyed = [(self.is_tripped(provider["name"]), self.score(provider["name"]), index, provider)
+                     for index, provider in enumerate(providers)]
+        keyed.sort(key=lambda item: item[:3])
+        return [item[3] for item in keyed]
+
+    def hedge_delay(self, name: str, min_delay: float) -> float:
+        """对冲请求的等待时间：该服务的p95延迟，不低于min_delay"""
+        with self._lock:
+            stats = self._stats.get(name)
+            p95 = stats.percentile(0.95) if stats is not None else None
+        return max(min_delay, p95 if p95 is not None else min_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取各服务的统计信息"""
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                p50 = stats.percentile(0.5)
+                p95 = stats.percentile(0.95)
+                result[name] = {
+                    "requests": stats.requests,
+                    "error_rate": round(stats.error_rate, 4),
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "consecutive_failures": stats.consecutive_failures,
+                    "tripped": self.is_tripped(name)
+                }
+            return result
+
+def create_ai_router(config: Optional[Dict[str, Any]]) -> AIRouter:
+    """根据ai.routing配置创建路由器"""
+    config = config or {}
+    return AIRouter(
+        window=config.get("window", 50),
+        failure_threshold=config.get("failure_threshold", 3),
+        cooldown=config.get("cooldown", 30),
+        error_penalty=config.get("error_penalty", 4.0)
+    )
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from fast_eval import normalize_expression
+from lru_cache import LRUCache
+
+def make_analysis_key(question: Dict[str, Any], language: str, detail_level: str,
+                      model: str, prompt_version: str) -> str:
+    """根据题目内容、语言、详细程度、模型和提示词版本生成缓存键"""
+    payload = {
+        "expression": normalize_expression(question.get("expression") or ""),
+        "answer": question.get("answer"),
+        "operation": question.get("operation"),
+        "knowledge_point": question.get("knowledge_point"),
+        "language": language,
+        "detail_level": detail_level,
+        "model": model,
+        "prompt_version": prompt_version,
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class AnalysisCache:
+    """AI分析结果缓存：内存LRU + SQLite持久化，重启后仍然有效"""
+
+    def __init__(self, max_size: int = 2000, db_path: Optional[str] = None):
+        self.memory = LRUCache(max_size)
+        self.db_path = db_path
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open(db_path)
+
+    def _open(self, db_path: str) -> None:
+        path = Path(db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"AI分析缓存数据库打开失败，仅使用内存缓存: {e}")
+            self._conn = None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的分析结果，内存未命中时查询磁盘并回填内存"""
+        value = self.memory.get(key)
+        if value is not None or self._conn is None:
+            return value
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT value FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"读取AI分析缓存失败: {e}")
+                return None
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        self.disk_hits += 1
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, analysis: Dict[str, Any]) -> None:
+        """写入分析结果"""
+        self.memory.set(key, analysis)
+        if self._conn is None:
+            return
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(analysis, ensure_ascii=False), time.time())
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"写入AI分析缓存失败: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["persistent"] = self._conn is not None
+        if self._conn is not None:
+            with self._lock:
+                stats["disk_size"] = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        return stats
+
+def create_analysis_cache(config: Optional[Dict[str, Any]], base_dir: Path) -> Optional[AnalysisCache]:
+    """根据ai.analysis_cache配置创建缓存，未启用时返回None"""
+    config = config or {}
+    if not config.get("enabled", True):
+        return None
+    db_path = config.get("db_path", "data/ai_analysis_cache.sqlite3")
+    if db_path and not Path(db_path).is_absolute():
+        db_path = str(base_dir / db_path)
+    return AnalysisCache(max_size=config.get("max_size", 2000), db_path=db_path)
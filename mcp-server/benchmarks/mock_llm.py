@@ -0,0 +1,128 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+RECORDED_RESPONSES = Path(__file__).parent / "recorded_responses.json"
+
+def load_recorded_responses(path: Path = RECORDED_RESPONSES) -> Dict[str, List[str]]:
+    """录制的大模型输出：text为按章节的文本格式，json为结构化输出"""
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有5，并发测试时会拒绝连接
+    request_queue_size = 256
+
+class MockLLMServer:
+    """本地OpenAI兼容的chat completions桩服务，按配置的延迟返回录制的输出"""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 responses: Optional[Dict[str, List[str]]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.responses = responses or load_recorded_responses()
+        self._counter = itertools.count()
+        self.requests = 0
+        self._server = MockHTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def pick_response(self, payload: Dict[str, Any]) -> str:
+        """JSON模式的请求返回结构化输出，否则返回文本输出，依次轮换"""
+        structured = (payload.get("response_format") or {}).get("type") == "json_object"
+        candidates = self.responses["json" if structured else "text"]
+        return candidates[next(self._counter) % len(candidates)]
+
+    def delay(self) -> None:
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+                content = server.pick_response(payload)
+                usage = {"prompt_tokens": 300, "completion_tokens": len(content) // 2,
+                         "total_tokens": 300 + len(content) // 2}
+                server.delay()
+                if payload.get("stream"):
+                    self._send_stream(payload.get("model", "mock"), content, usage)
+                else:
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "model": payload.get("model", "mock"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                        "usage": usage
+                    })
+
+            def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, model: str, content: str, usage: Dict[str, int]) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for start in range(0, len(content), 16):
+                    chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": content[start:start + 16]}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容的大模型桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.05, help="每个请求的响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动范围（秒）")
+    args = parser.parse_args()
+    mock = MockLLMServer(args.latency, args.jitter, args.host, args.port)
+    print(f"大模型桩服务已启动: {mock.url}，延迟 {args.latency}±{args.jitter} 秒")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,350 @@
+"""性能基准测试
+
+- micro: 各计算引擎在生成题目语料上的耗时、execute_code_safely冷/热缓存、parse_ai_response等解析器
+- e2e: 启动服务进程和本地大模型桩服务，测量 /execute 和 /ai/analyze 的吞吐量与延迟分位数
+
+结果写入JSON；指定基线时，任一指标比基线差超过阈值即以非零状态退出。
+
+    python benchmarks/run_benchmarks.py                       # 运行全部并写入 benchmarks/results/latest.json
+    python benchmarks/run_benchmarks.py --update-baseline     # 把本次结果保存为基线
+    python benchmarks/run_benchmarks.py --suite micro --threshold 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import yaml
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+SERVER_DIR = BENCHMARK_DIR.parent
+CONFIG_PATH = SERVER_DIR.parent / "config" / "app.yaml"
+DEFAULT_OUTPUT = BENCHMARK_DIR / "results" / "latest.json"
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+
+sys.path.insert(0, str(SERVER_DIR))
+sys.path.insert(0, str(BENCHMARK_DIR))
+
+from mock_llm import MockLLMServer, load_recorded_responses  # noqa: E402
+
+Metrics = Dict[str, Dict[str, Any]]
+
+def metric(value: float, unit: str, better: str = "lower") -> Dict[str, Any]:
+    return {"value": round(value, 4), "unit": unit, "better": better}
+
+def write_bench_config(work_dir: Path) -> None:
+    """基准测试用的配置副本：关闭AI分析缓存，确保每个请求都经过上游"""
+    with open(CONFIG_PATH, "r", encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    ai = config.setdefault("ai", {})
+    ai["analysis_cache"] = {"enabled": False}
+    ai["max_retries"] = 0
+    ai.setdefault("routing", {})["providers"] = []
+    (work_dir / "config").mkdir(parents=True, exist_ok=True)
+    with open(work_dir / "config" / "app.yaml", "w", encoding="utf-8") as file:
+        yaml.safe_dump(config, file, allow_unicode=True)
+
+def build_corpus(size: int, seed: int) -> List[str]:
+    """用服务端题目生成器为每种运算类型生成题目，作为计算引擎的语料"""
+    from config_loader import config_loader
+    from question_generator import OPERATIONS, GenerationError, QuestionGenerator
+
+    generator = QuestionGenerator(config_loader.get_math_config())
+    rng = np.random.default_rng(seed)
+    specs = []
+    for operation in OPERATIONS:
+        for difficulty in (2, 5, 8):
+            try:
+                specs.append(generator.make_spec(operation, None, difficulty))
+            except GenerationError:
+                continue
+    per_spec = max(1, size // len(specs))
+    corpus = [str(expression) for spec in specs
+              for expression in generator.generate(spec, per_spec, rng).expressions()]
+    rng.shuffle(corpus)
+    return corpus[:size]
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    """重复执行取最短耗时，减少调度抖动的影响"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def run_micro(corpus: List[str], repeat: int) -> Metrics:
+    import main
+
+    results: Metrics = {}
+    prepared = [main.prepare_expression(expression) for expression in corpus]
+
+    for engine_name, engine in main.ENGINE_FUNCTIONS.items():
+        supported = []
+        for code in prepared:
+            try:
+                engine(code)
+                supported.append(code)
+            except Exception:
+                continue
+
+        def evaluate_all(engine=engine, supported=supported):
+            for code in supported:
+                engine(code)
+
+        elapsed = best_of(repeat, evaluate_all)
+        results[f"engine.{engine_name}.us_per_op"] = metric(elapsed / max(len(supported), 1) * 1e6, "us")
+        results[f"engine.{engine_name}.coverage"] = metric(len(supported) / len(prepared), "ratio", "higher")
+
+    def execute_cold():
+        main.result_cache.clear()
+        for expression in corpus:
+            main.execute_code_safely(expression)
+
+    def execute_warm():
+        for expression in corpus:
+            main.execute_code_safely(expression)
+
+    results["execute_code_safely.cold.us_per_op"] = metric(best_of(repeat, execute_cold) / len(corpus) * 1e6, "us")
+    execute_warm()
+    results["execute_code_safely.warm.us_per_op"] = metric(best_of(repeat, execute_warm) / len(corpus) * 1e6, "us")
+
+    recorded = load_recorded_responses()
+    question = main.MathQuestion(expression="38+47", answer=85)
+    rounds = 200
+
+    def parse_text():
+        for _ in range(rounds):
+            for text in recorded["text"]:
+                main.parse_ai_response(text, question)
+
+    def parse_incremental():
+        for _ in range(rounds):
+            for text in recorded["text"]:
+                parser = main.IncrementalAnalysisParser()
+                for start in range(0, len(text), 16):
+                    parser.feed(text[start:start + 16])
+                parser.close()
+                parser.result()
+
+    def parse_structured():
+        for _ in range(rounds):
+            for text in recorded["json"]:
+                main.parse_structured_response(text)
+
+    results["parse_ai_response.us_per_op"] = metric(
+        best_of(repeat, parse_text) / (rounds * len(recorded["text"])) * 1e6, "us")
+    results["incremental_parser.us_per_op"] = metric(
+        best_of(repeat, parse_incremental) / (rounds * len(recorded["text"])) * 1e6, "us")
+    results["parse_structured_response.us_per_op"] = metric(
+        best_of(repeat, parse_structured) / (rounds * len(recorded["json"])) * 1e6, "us")
+    return results
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(work_dir: Path, llm_url: str) -> Tuple[subprocess.Popen, str]:
+    """在基准配置目录中启动服务进程，上游指向大模型桩服务"""
+    port = free_port()
+    env = dict(os.environ, AI_API_BASE=llm_url, AI_API_KEY="benchmark",
+               PYTHONPATH=os.pathsep.join(filter(None, [str(SERVER_DIR), os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务进程启动失败: {process.stderr.read().decode('utf-8', 'replace')}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("服务进程启动超时")
+
+def summarize_latencies(prefix: str, latencies: List[float], failures: int, elapsed: float) -> Metrics:
+    ordered = sorted(latencies)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+    return {
+        f"{prefix}.throughput_rps": metric(len(latencies) / elapsed if elapsed else 0.0, "req/s", "higher"),
+        f"{prefix}.p50_ms": metric(percentile(0.5) * 1000, "ms"),
+        f"{prefix}.p99_ms": metric(percentile(0.99) * 1000, "ms"),
+        f"{prefix}.mean_ms": metric(statistics.fmean(ordered) * 1000 if ordered else 0.0, "ms"),
+        f"{prefix}.failures": metric(failures, "requests"),
+    }
+
+async def drive(base_url: str, requests: int, concurrency: int,
+                submit: Callable[[httpx.AsyncClient, int], Any]) -> Tuple[List[float], int, float]:
+    """以固定并发发送请求，返回每个请求的端到端延迟、失败数和总耗时"""
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def one(index: int) -> None:
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = await submit(client, index)
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(requests)))
+        return latencies, failures, time.perf_counter() - start
+
+def run_e2e(work_dir: Path, corpus: List[str], requests: int, concurrency: int, ai_requests: int,
+            llm_latency: float, llm_jitter: float) -> Metrics:
+    mock = MockLLMServer(llm_latency, llm_jitter).start()
+    process, base_url = start_server(work_dir, mock.url)
+    try:
+        async def execute(client: httpx.AsyncClient, index: int) -> bool:
+            response = await client.post("/execute", json={"code": corpus[index % len(corpus)]})
+            if response.status_code != 200:
+                return False
+            task_id = response.json()["task_id"]
+            result = await client.get(f"/result/{task_id}", params={"wait": 30})
+            return result.status_code == 200 and result.json()["status"] in ("completed", "failed")
+
+        async def analyze(client: httpx.AsyncClient, index: int) -> bool:
+            # 题目各不相同，避免单飞合并掩盖上游调用
+            question = {"expression": f"{corpus[index % len(corpus)]}+{index}"}
+            response = await client.post("/ai/analyze", json={"question": question, "engine": "llm"})
+            if response.status_code != 200:
+                return False
+            task_id = response.json()["task_id"]
+            result = await client.get(f"/ai/result/{task_id}", params={"wait": 60})
+            return result.status_code == 200 and result.json()["status"] == "completed"
+
+        results: Metrics = {}
+        # 预热：建立连接、加载sympy解析器
+        asyncio.run(drive(base_url, min(50, requests), concurrency, execute))
+        results.update(summarize_latencies("e2e.execute", *asyncio.run(drive(base_url, requests, concurrency, execute))))
+        results.update(summarize_latencies("e2e.ai_analyze",
+                                           *asyncio.run(drive(base_url, ai_requests, concurrency, analyze))))
+        return results
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        mock.stop()
+
+def compare(results: Metrics, baseline: Metrics, threshold: float) -> List[str]:
+    """与基线比较，返回超过阈值的退化指标"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        old, new = previous["value"], current["value"]
+        if current["better"] == "lower":
+            # 失败数等基线为0的指标，出现即算退化
+            worse = new > old * (1 + threshold) if old > 0 else new > 0
+        else:
+            worse = new < old * (1 - threshold)
+        if worse:
+            regressions.append(f"{name}: {old} -> {new} {current['unit']}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MCP服务器性能基准测试")
+    parser.add_argument("--suite", choices=["all", "micro", "e2e"], default="all")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="结果JSON的输出路径")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="用于比较的基线JSON")
+    parser.add_argument("--update-baseline", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的退化比例，默认20%%")
+    parser.add_argument("--corpus-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=20240601)
+    parser.add_argument("--repeat", type=int, default=5, help="微基准的重复次数，取最短耗时")
+    parser.add_argument("--requests", type=int, default=1000, help="/execute 的请求数")
+    parser.add_argument("--ai-requests", type=int, default=200, help="/ai/analyze 的请求数")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="大模型桩服务的响应延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.01)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="mcp-bench-"))
+    original_dir = os.getcwd()
+    try:
+        write_bench_config(work_dir)
+        # 配置按当前目录下的 config/app.yaml 加载
+        os.chdir(work_dir)
+        corpus = build_corpus(args.corpus_size, args.seed)
+        results: Metrics = {}
+        if args.suite in ("all", "micro"):
+            print(f"运行微基准：语料 {len(corpus)} 道题，重复 {args.repeat} 次")
+            results.update(run_micro(corpus, args.repeat))
+        if args.suite in ("all", "e2e"):
+            print(f"运行端到端基准：并发 {args.concurrency}，大模型延迟 {args.llm_latency}±{args.llm_jitter} 秒")
+            results.update(run_e2e(work_dir, corpus, args.requests, args.concurrency, args.ai_requests,
+                                   args.llm_latency, args.llm_jitter))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "parameters": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "metrics": results
+    }
+    for name, value in results.items():
+        print(f"  {name:45s} {value['value']:>12} {value['unit']}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"基线已更新 {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print("未找到基线，跳过退化检查（使用 --update-baseline 生成）")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)["metrics"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"以下指标比基线差超过 {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"与基线相比没有超过 {args.threshold:.0%} 的退化")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
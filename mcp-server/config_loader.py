@@ -1,20 +1,31 @@
-import yaml
+import hashlib
+import marshal
 import os
-from typing import Dict, Any, Optional
+import sys
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+# 解析后配置快照的存放目录，可用环境变量MCP_CONFIG_CACHE_DIR修改（如打包后程序目录只读时）
+SNAPSHOT_DIR = Path(os.getenv("MCP_CONFIG_CACHE_DIR", Path(__file__).parent / "data" / "config_cache"))
+# 快照格式变化时递增；marshal格式与Python版本相关，一并写入快照键
+SNAPSHOT_VERSION = 1
+
 class ConfigLoader:
-    """YAML配置文件加载器"""
+    """YAML配置文件加载器
+
+    解析结果以marshal快照缓存在磁盘上，按文件内容的哈希校验；配置未变化时启动无需导入和运行PyYAML
+    """
     
-    def __init__(self, config_dir: str = "config"):
+    def __init__(self, config_dir: str = "config", snapshot_dir: Optional[Path] = SNAPSHOT_DIR):
         self.config_dir = Path(config_dir)
+        self.snapshot_dir = snapshot_dir
         self._config_cache: Dict[str, Any] = {}
+        # 每个配置的加载耗时和来源（snapshot或yaml），用于启动耗时统计
+        self.load_stats: Dict[str, Dict[str, Any]] = {}
     
-    def load_config(self, config_name: str = "app") -> Dict[str, Any]:
-        """加载指定的配置文件"""
-        if config_name in self._config_cache:
-            return self._config_cache[config_name]
-        
+    def resolve_path(self, config_name: str = "app") -> Path:
+        """配置文件路径：优先当前目录下的config目录，其次项目根目录"""
         config_path = self.config_dir / f"{config_name}.yaml"
         
         if not config_path.exists():
@@ -24,17 +35,99 @@ class ConfigLoader:
                 config_path = root_config_path
             else:
                 raise FileNotFoundError(f"配置文件未找到: {config_path}")
+        return config_path
+    
+    def load_config(self, config_name: str = "app") -> Dict[str, Any]:
+        """加载指定的配置文件"""
+        if config_name in self._config_cache:
+            return self._config_cache[config_name]
+        
+        config = self._load(config_name)
+        self._config_cache[config_name] = config
+        return config
+    
+    def reload(self, config_name: str = "app",
+               prepare: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """重新读取配置文件，prepare处理完成后整体替换缓存中的配置
+
+        读取或解析失败时抛出异常，缓存中仍是原来的配置
+        """
+        config = self._load(config_name)
+        if prepare is not None:
+            prepare(config)
+        self._config_cache[config_name] = config
+        return config
+    
+    def _load(self, config_name: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        config_path = self.resolve_path(config_name)
+        try:
+            raw = config_path.read_bytes()
+        except OSError as e:
+            raise RuntimeError(f"加载配置文件失败: {e}")
+        digest = hashlib.sha256(raw).hexdigest()
+        
+        config = self._read_snapshot(config_name, digest)
+        source = "snapshot"
+        if config is None:
+            config = self._parse_yaml(raw)
+            source = "yaml"
+            self._write_snapshot(config_name, digest, config)
         
+        self.load_stats[config_name] = {
+            "path": str(config_path),
+            "source": source,
+            "sha256": digest,
+            "mtime": config_path.stat().st_mtime,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+        return config
+    
+    @staticmethod
+    def _parse_yaml(raw: bytes) -> Dict[str, Any]:
+        # 只有快照失效时才需要PyYAML，优先使用C实现的解析器
+        import yaml
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
         try:
-            with open(config_path, 'r', encoding='utf-8') as file:
-                config = yaml.safe_load(file)
-                self._config_cache[config_name] = config
-                return config
+            return yaml.load(raw.decode("utf-8"), Loader=loader)
         except yaml.YAMLError as e:
             raise ValueError(f"配置文件格式错误: {e}")
         except Exception as e:
             raise RuntimeError(f"加载配置文件失败: {e}")
     
+    def _snapshot_path(self, config_name: str) -> Optional[Path]:
+        if self.snapshot_dir is None:
+            return None
+        return Path(self.snapshot_dir) / f"{config_name}.marshal"
+    
+    def _snapshot_key(self, digest: str) -> Tuple[int, str, str]:
+        return (SNAPSHOT_VERSION, sys.version, digest)
+    
+    def _read_snapshot(self, config_name: str, digest: str) -> Optional[Dict[str, Any]]:
+        """读取与当前文件内容一致的快照，不存在、已过期或损坏时返回None"""
+        path = self._snapshot_path(config_name)
+        if path is None or not path.exists():
+            return None
+        try:
+            key, config = marshal.loads(path.read_bytes())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return config if key == self._snapshot_key(digest) else None
+    
+    def _write_snapshot(self, config_name: str, digest: str, config: Dict[str, Any]) -> None:
+        """写入快照：先写临时文件再替换；配置中含有marshal不支持的类型（如日期）或目录不可写时跳过"""
+        path = self._snapshot_path(config_name)
+        if path is None:
+            return
+        try:
+            data = marshal.dumps((self._snapshot_key(digest), config))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_suffix(f".{os.getpid()}.tmp")
+            temporary.write_bytes(data)
+            temporary.replace(path)
+        except (OSError, ValueError) as e:
+            print(f"配置快照写入失败，下次启动将重新解析YAML: {e}")
+    
     def get_app_config(self) -> Dict[str, Any]:
         """获取应用配置"""
         return self.load_config("app")
@@ -128,15 +221,17 @@ def get_licenses_info() -> Dict[str, Any]:
     return config_loader.get_licenses_info()
 
 # 环境变量覆盖配置
-def apply_env_overrides() -> None:
-    """应用环境变量覆盖配置"""
+def apply_env_overrides(config: Optional[Dict[str, Any]] = None) -> None:
+    """应用环境变量覆盖配置，config为空时修改当前缓存中的应用配置"""
+    if config is None:
+        config = config_loader.get_app_config()
     # AI API配置
     ai_api_key = os.getenv("AI_API_KEY")
     ai_api_base = os.getenv("AI_API_BASE")
     ai_model = os.getenv("AI_MODEL")
     
     if ai_api_key or ai_api_base or ai_model:
-        ai_config = config_loader.get_ai_config()
+        ai_config = config.get("ai", {})
         default_service = ai_config.get("default_service", "deepseek")
         services = ai_config.get("services", {})
         
@@ -153,7 +248,7 @@ def apply_env_overrides() -> None:
     mcp_port = os.getenv("MCP_PORT")
     
     if mcp_host or mcp_port:
-        mcp_config = config_loader.get_mcp_config()
+        mcp_config = config.get("mcp_server", {})
         if mcp_host:
             mcp_config["host"] = mcp_host
         if mcp_port:
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config_loader import ConfigLoader
+
+# 由配置生成某个接口的响应数据
+PayloadBuilder = Callable[[Dict[str, Any]], Any]
+
+class PreparedResponse:
+    """预先序列化的JSON响应体，附带gzip压缩版本和ETag"""
+
+    __slots__ = ("body", "gzip_body", "etag")
+
+    def __init__(self, payload: Any, gzip_min_size: Optional[int] = 1024):
+        # 与FastAPI的JSONResponse使用相同的序列化方式，响应内容不变
+        self.body = json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                               separators=(",", ":")).encode("utf-8")
+        # gzip与原始内容语义相同，共用一个弱ETag
+        self.etag = f'W/"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.gzip_body: Optional[bytes] = None
+        if gzip_min_size is not None and len(self.body) >= gzip_min_size:
+            self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match是否命中当前ETag（弱比较）"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == self.etag.removeprefix("W/") for tag in tags)
+
+class ConfigSnapshot:
+    """某一版本配置及其全部预先序列化的接口响应，生成后不再修改"""
+
+    def __init__(self, version: int, config: Dict[str, Any], responses: Dict[str, PreparedResponse]):
+        self.version = version
+        self.config = config
+        self.responses = responses
+        self.loaded_at = time.time()
+
+class ConfigWatcher:
+    """轮询配置文件的变化，重新加载后整体替换快照
+
+    请求只读取snapshot属性的引用，替换是一次赋值，不会读到半新半旧的配置
+    """
+
+    def __init__(self, loader: ConfigLoader, builders: Dict[str, PayloadBuilder], config_name: str = "app",
+                 interval: float = 2.0, gzip_min_size: Optional[int] = 1024,
+                 prepare: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.loader = loader
+        self.builders = builders
+        self.config_name = config_name
+        self.interval = interval
+        self.gzip_min_size = gzip_min_size
+        self.prepare = prepare
+        self.reloads = 0
+        self.failures = 0
+        self._signature = self._stat()
+        self._version = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.snapshot = self._build(loader.load_config(config_name))
+
+    def _stat(self) -> Optional[Tuple[str, int, int]]:
+        """配置文件的路径、修改时间和大小，文件暂时不存在时返回None"""
+        try:
+            path = self.loader.resolve_path(self.config_name)
+            stat = path.stat()
+        except (FileNotFoundError, OSError):
+            return None
+        return (str(path), stat.st_mtime_ns, stat.st_size)
+
+    def _build(self, config: Dict[str, Any]) -> ConfigSnapshot:
+        responses = {name: PreparedResponse(builder(config), self.gzip_min_size)
+                     for name, builder in self.builders.items()}
+        self._version += 1
+        return ConfigSnapshot(self._version, config, responses)
+
+    def check(self) -> bool:
+        """配置文件变化时重新加载，返回是否替换了快照"""
+        with self._lock:
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                return False
+            previous = self.loader.load_stats.get(self.config_name, {}).get("sha256")
+            # 无论成功与否都记下这次的文件状态，无效文件再次保存时重试
+            self._signature = signature
+            try:
+                config = self.loader.reload(self.config_name, self.prepare)
+                if self.loader.load_stats.get(self.config_name, {}).get("sha256") == previous:
+                    # 只是修改时间变化，内容相同
+                    return False
+                snapshot = self._build(config)
+            except Exception as e:
+                self.failures += 1
+                print(f"重新加载配置失败，继续使用之前的配置: {e}")
+                return False
+            self.snapshot = snapshot
+            self.reloads += 1
+            print(f"配置已重新加载: {signature[0]}（版本 {snapshot.version}）")
+            return True
+
+    def start(self) -> None:
+        """启动后台轮询线程"""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch_loop, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _watch_loop(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"检查配置文件变化失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version,
+            "loaded_at": snapshot.loaded_at,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "responses": {name: {"bytes": len(response.body),
+                                 "gzip_bytes": len(response.gzip_body) if response.gzip_body else None,
+                                 "etag": response.etag}
+                          for name, response in snapshot.responses.items()}
+        }
@@ -0,0 +1,215 @@
+import ast
+import math
+import threading
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Sequence
+
+from fast_eval import FUNCTIONS
+
+LOG10_2 = math.log10(2)
+
+def bit_size(value: Fraction) -> int:
+    return max(abs(value.numerator), value.denominator).bit_length()
+
+class ExpressionRejected(Exception):
+    """表达式不符合算术语法或预计计算量过大，不交给任何计算引擎"""
+
+class ExpressionCost:
+    """表达式的开销估算
+
+    size为结果（分数的分子或分母）的二进制位数上限，乘方按指数放大，结果位数据此估算
+    """
+
+    __slots__ = ("size", "integral", "value")
+
+    def __init__(self, size: float, integral: bool = True, value: Optional[Fraction] = None):
+        self.size = size
+        self.integral = integral
+        # 常量子表达式的精确值，用于确定乘方的指数；规模较大时不再计算
+        self.value = value
+
+    @property
+    def result_digits(self) -> float:
+        return self.size * LOG10_2
+
+class ExpressionGuard:
+    """单次遍历语法树完成校验和开销估算
+
+    只接受题目中出现的算术语法：数字、+ - * / % **、括号、正负号、sqrt() 和 percent()（√和%规范化后的写法）。
+    结果位数超过max_exact_digits的表达式只交给近似计算的引擎（如sympy的evalf），
+    超过max_approximate_digits（如9**9**9这样的乘方塔）以及指数、数字位数、嵌套深度超出上限的表达式直接拒绝。
+    """
+
+    def __init__(self, max_length: int = 1000, max_depth: int = 50, max_number_digits: int = 100,
+                 max_exponent_digits: int = 12, max_exact_digits: int = 1000,
+                 max_approximate_digits: int = 100000, approximate_engines: Sequence[str] = ("sympy",)):
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self.max_number_digits = max_number_digits
+        self.max_exponent = 10 ** max_exponent_digits
+        self.max_exact_digits = max_exact_digits
+        self.max_approximate_digits = max_approximate_digits
+        self.approximate_engines = tuple(approximate_engines)
+        self.accepted = 0
+        self.approximated = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, clean_code: str) -> ExpressionCost:
+        """校验规范化后的表达式并估算开销，不符合要求时抛出ExpressionRejected"""
+        if not clean_code:
+            raise ExpressionRejected("表达式为空")
+        if len(clean_code) > self.max_length:
+            raise ExpressionRejected(f"表达式过长（超过 {self.max_length} 个字符）")
+        try:
+            tree = ast.parse(clean_code, mode="eval")
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            raise ExpressionRejected("表达式语法错误")
+        return self._visit(tree.body, 1)
+
+    def route(self, clean_code: str, engines: Sequence[str]) -> List[str]:
+        """返回该表达式可以使用的计算引擎（保持engines中的顺序），应当拒绝时抛出ExpressionRejected"""
+        try:
+            cost = self.estimate(clean_code)
+            if cost.result_digits <= self.max_exact_digits:
+                self._count("accepted")
+                return list(engines)
+            # 结果位数连近似计算都没有意义（如9**9**9约3.7亿位），直接拒绝
+            if cost.result_digits > self.max_approximate_digits:
+                raise ExpressionRejected(f"表达式结果过大（约 {cost.result_digits:.0f} 位）")
+            # 精确结果过大，只能近似计算
+            routed = [engine for engine in engines if engine in self.approximate_engines]
+            if not routed:
+                raise ExpressionRejected(f"表达式计算量过大（结果约 {cost.result_digits:.0f} 位）")
+        except ExpressionRejected:
+            self._count("rejected")
+            raise
+        self._count("approximated")
+        return routed
+
+    def _count(self, decision: str) -> None:
+        with self._lock:
+            setattr(self, decision, getattr(self, decision) + 1)
+
+    def _visit(self, node: ast.AST, depth: int) -> ExpressionCost:
+        if depth > self.max_depth:
+            raise ExpressionRejected(f"表达式嵌套过深（超过 {self.max_depth} 层）")
+        if isinstance(node, ast.Constant):
+            cost = self._constant(node.value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            cost = self._unary(node, self._visit(node.operand, depth + 1))
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow)):
+            cost = self._binary(node.op, self._visit(node.left, depth + 1), self._visit(node.right, depth + 1))
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS
+                and len(node.args) == 1 and not node.keywords):
+            cost = self._call(node.func.id, self._visit(node.args[0], depth + 1))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            raise ExpressionRejected(f"表达式包含不支持的函数: {node.func.id}")
+        else:
+            raise ExpressionRejected(f"表达式包含不支持的语法: {type(node).__name__}")
+        return cost
+
+    def _constant(self, value: Any) -> ExpressionCost:
+        if type(value) not in (int, float):
+            raise ExpressionRejected("表达式只能包含数字")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ExpressionRejected("数字超出范围")
+        try:
+            exact = Fraction(value) if isinstance(value, int) else Fraction(Decimal(repr(value)))
+        except (InvalidOperation, ValueError):
+            raise ExpressionRejected("数字格式错误")
+        digits = len(str(abs(exact.numerator)))
+        if digits > self.max_number_digits:
+            raise ExpressionRejected(f"数字位数过多（超过 {self.max_number_digits} 位）")
+        return ExpressionCost(bit_size(exact), exact.denominator == 1, exact)
+
+    @staticmethod
+    def _folded(size: float, integral: bool, value: Optional[Fraction]) -> ExpressionCost:
+        """常量子表达式使用精确值的位数；规模较大的值不再保留，避免估算本身变成大数运算"""
+        if value is None:
+            return ExpressionCost(size, integral)
+        exact_size = bit_size(value)
+        if exact_size > 256:
+            return ExpressionCost(exact_size, value.denominator == 1)
+        return ExpressionCost(exact_size, value.denominator == 1, value)
+
+    def _unary(self, node: ast.UnaryOp, operand: ExpressionCost) -> ExpressionCost:
+        value = operand.value
+        if value is not None and isinstance(node.op, ast.USub):
+            value = -value
+        return ExpressionCost(operand.size, operand.integral, value)
+
+    def _binary(self, op: ast.operator, left: ExpressionCost, right: ExpressionCost) -> ExpressionCost:
+        value: Optional[Fraction] = None
+        if isinstance(op, ast.Pow):
+            # 指数的绝对值：常量直接取值，否则按其位数取上限
+            if right.value is not None:
+                exponent = float(abs(right.value))
+            else:
+                exponent = 2.0 ** right.size if right.size < 1024 else math.inf
+            if exponent > self.max_exponent:
+                raise ExpressionRejected(f"指数过大（超过 {self.max_exponent}）")
+            whole = right.value is not None and right.value.denominator == 1
+            if left.value in (-1, 0, 1) and whole and (left.value != 0 or right.value >= 0):
+                # 0、1、-1的整数次幂仍是0、1或-1，指数再大结果也不会变大
+                parity = 0 if right.value == 0 else 2 - int(right.value) % 2
+                return self._folded(1, True, left.value ** parity)
+            size = left.size * max(exponent, 1.0)
+            integral = left.integral and whole and right.value >= 0
+            if left.value is not None and whole and size <= 256 and (left.value != 0 or right.value >= 0):
+                value = left.value ** int(right.value)
+            return self._folded(size, integral, value)
+        if isinstance(op, (ast.Add, ast.Sub)):
+            # 整数相加位数最多增加1；分数通分后分子分母位数相加
+            size = max(left.size, right.size) + 1 if left.integral and right.integral else left.size + right.size + 1
+            integral = left.integral and right.integral
+            if left.value is not None and right.value is not None:
+                value = left.value + right.value if isinstance(op, ast.Add) else left.value - right.value
+        elif isinstance(op, ast.Mult):
+            size = left.size + right.size
+            integral = left.integral and right.integral
+            if left.value is not None and right.value is not None:
+                value = left.value * right.value
+        elif isinstance(op, ast.Mod):
+            # 余数不超过除数，但被除数需要先算出来，按两者中较大的位数估算
+            size = max(left.size, right.size) if left.integral and right.integral else left.size + right.size
+            integral = left.integral and right.integral
+            if left.value is not None and right.value:
+                value = left.value % right.value
+        else:
+            size = left.size + right.size
+            integral = False
+            if left.value is not None and right.value:
+                value = left.value / right.value
+        return self._folded(size, integral, value)
+
+    def _call(self, name: str, argument: ExpressionCost) -> ExpressionCost:
+        if name == "sqrt":
+            return ExpressionCost(argument.size / 2 + 1, False)
+        # percent(x) = x / 100
+        value = argument.value / 100 if argument.value is not None else None
+        return self._folded(argument.size + 7, False, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "accepted": self.accepted,
+            "approximated": self.approximated,
+            "rejected": self.rejected,
+            "max_exact_digits": self.max_exact_digits,
+            "max_approximate_digits": self.max_approximate_digits,
+            "approximate_engines": list(self.approximate_engines)
+        }
+
+def create_expression_guard(config: Optional[Dict[str, Any]]) -> ExpressionGuard:
+    """根据mcp_server.security配置创建表达式校验器"""
+    config = config or {}
+    return ExpressionGuard(
+        max_length=config.get("max_length", 1000),
+        max_depth=config.get("max_depth", 50),
+        max_number_digits=config.get("max_number_digits", 100),
+        max_exponent_digits=config.get("max_exponent_digits", 12),
+        max_exact_digits=config.get("max_exact_digits", 1000),
+        max_approximate_digits=config.get("max_approximate_digits", 100000),
+        approximate_engines=config.get("approximate_engines", ["sympy"])
+    )
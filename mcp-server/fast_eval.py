@@ -0,0 +1,149 @@
+import ast
+import math
+import re
+import unicodedata
+from decimal import Decimal, localcontext
+from fractions import Fraction
+from typing import Dict
+
+class UnsupportedExpression(Exception):
+    """表达式超出快速引擎支持的语法，需要回退到其他引擎"""
+
+# 上标数字，如 3² 表示 3**2
+SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹", "0123456789")
+SUPERSCRIPT_PATTERN = re.compile(r"([⁰¹²³⁴⁵⁶⁷⁸⁹]+)")
+
+# 运算符统一为Python写法（全角符号由NFKC统一处理）
+OPERATOR_REPLACEMENTS = {
+    "×": "*",
+    "✕": "*",
+    "·": "*",
+    "÷": "/",
+    "−": "-",
+    "—": "-",
+    "^": "**",
+    "（": "(",
+    "）": ")",
+}
+
+NUMBER = r"\d+(?:\.\d+)?"
+SQRT_NUMBER_PATTERN = re.compile(rf"√({NUMBER})")
+# 后面紧跟数字或括号的%是取余运算（如 7%3），不改写为百分数
+PERCENT_PATTERN = re.compile(rf"({NUMBER})%(?!\s*[\d(])")
+
+# 幂运算的上限，防止 9**9**9 之类的表达式耗尽资源
+MAX_EXPONENT = 1000
+MAX_RESULT_BITS = 4096
+
+def normalize_expression(code: str) -> str:
+    """规范化表达式：去除空白和末尾等号，统一全角字符与×÷等运算符"""
+    text = SUPERSCRIPT_PATTERN.sub(lambda m: "**" + m.group(1).translate(SUPERSCRIPTS), code)
+    text = unicodedata.normalize("NFKC", text)
+    for symbol, replacement in OPERATOR_REPLACEMENTS.items():
+        text = text.replace(symbol, replacement)
+    text = "".join(text.split())
+    return text.rstrip("=?")
+
+def to_python_syntax(expression: str) -> str:
+    """将√和%改写为函数调用，便于使用Python的ast解析"""
+    text = SQRT_NUMBER_PATTERN.sub(r"sqrt(\1)", expression)
+    text = text.replace("√(", "sqrt(")
+    return PERCENT_PATTERN.sub(r"percent(\1)", text)
+
+def prepare_expression(code: str) -> str:
+    """规范化并转换为Python语法，供各计算引擎共用"""
+    return to_python_syntax(normalize_expression(code))
+
+def exact_sqrt(value: Fraction) -> Fraction:
+    """精确开平方，只支持完全平方数（含分数）"""
+    if value < 0:
+        raise UnsupportedExpression("负数的平方根")
+    numerator = math.isqrt(value.numerator)
+    denominator = math.isqrt(value.denominator)
+    if numerator * numerator != value.numerator or denominator * denominator != value.denominator:
+        raise UnsupportedExpression("非完全平方数")
+    return Fraction(numerator, denominator)
+
+def exact_power(base: Fraction, exponent: Fraction) -> Fraction:
+    """精确幂运算，只支持整数指数"""
+    if exponent.denominator != 1:
+        raise UnsupportedExpression("非整数指数")
+    if abs(exponent.numerator) > MAX_EXPONENT:
+        raise UnsupportedExpression("指数过大")
+    bits = max(abs(base.numerator), base.denominator).bit_length() * abs(exponent.numerator)
+    if bits > MAX_RESULT_BITS:
+        raise UnsupportedExpression("结果过大")
+    return base ** exponent.numerator
+
+FUNCTIONS = {
+    "sqrt": exact_sqrt,
+    "percent": lambda value: value / 100,
+}
+
+def _evaluate_node(node: ast.AST) -> Fraction:
+    if isinstance(node, ast.Expression):
+        return _evaluate_node(node.body)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        # 浮点字面量通过repr还原为十进制字符串，避免二进制误差
+        return Fraction(Decimal(repr(node.value)))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        operand = _evaluate_node(node.operand)
+        return -operand if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp):
+        left = _evaluate_node(node.left)
+        right = _evaluate_node(node.right)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if isinstance(node.op, ast.Div):
+            if right == 0:
+                raise ZeroDivisionError("除数不能为0")
+            return left / right
+        if isinstance(node.op, ast.Mod):
+            if right == 0:
+                raise ZeroDivisionError("除数不能为0")
+            return left % right
+        if isinstance(node.op, ast.Pow):
+            return exact_power(left, right)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS and len(node.args) == 1 and not node.keywords):
+        return FUNCTIONS[node.func.id](_evaluate_node(node.args[0]))
+    raise UnsupportedExpression(f"不支持的语法: {type(node).__name__}")
+
+def evaluate_exact(code: str) -> Fraction:
+    """使用分数精确计算表达式，无法处理时抛出UnsupportedExpression"""
+    expression = prepare_expression(code)
+    if not expression:
+        raise UnsupportedExpression("空表达式")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise UnsupportedExpression("语法错误")
+    return _evaluate_node(tree)
+
+def format_fraction(value: Fraction) -> str:
+    """格式化精确结果：整数和有限小数按十进制输出，其余输出为分数"""
+    if value.denominator == 1:
+        return str(value.numerator)
+    denominator = value.denominator
+    places = 0
+    for prime in (2, 5):
+        count = 0
+        while denominator % prime == 0:
+            denominator //= prime
+            count += 1
+        places = max(places, count)
+    if denominator == 1:
+        # 分母只含因子2和5时为有限小数，精度足够保证除法精确
+        with localcontext() as context:
+            context.prec = len(str(abs(value.numerator))) + places + 1
+            return format(Decimal(value.numerator) / Decimal(value.denominator), "f")
+    return f"{value.numerator}/{value.denominator}"
+
+def evaluate_fraction_engine(code: str) -> Dict[str, str]:
+    """快速精确计算引擎，返回与execute_code_safely一致的结果格式"""
+    value = evaluate_exact(code)
+    return {"result": format_fraction(value), "exact": str(value)}
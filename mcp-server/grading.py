@@ -0,0 +1,175 @@
+import base64
+import csv
+import importlib
+import importlib.util
+import io
+import math
+import re
+import unicodedata
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fast_eval import format_fraction, normalize_expression
+
+class AnswerSheetError(ValueError):
+    """答题数据格式错误或与题目数量不一致"""
+
+# 学生答案的类型编码
+BLANK, INVALID, DECIMAL, FRACTION, PERCENT = range(5)
+
+# 未指定知识点的题目归入该分组
+UNSPECIFIED_KNOWLEDGE_POINT = "unspecified"
+
+# 带分数，如 2 2/5；规范化会去掉空白，必须在规范化之前识别
+MIXED_NUMBER_PATTERN = re.compile(r"^\s*([+-]?)(\d+)\s+(\d+)\s*/\s*(\d+)\s*$")
+
+def read_answer_csv(text: str) -> Tuple[List[str], List[List[str]]]:
+    """读取CSV答题表：首行为表头，首列为学生，其余各列按题目顺序排列"""
+    rows = list(csv.reader(io.StringIO(text.lstrip("\ufeff"))))
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if len(rows) < 2:
+        raise AnswerSheetError("CSV至少需要表头和一行学生答案")
+    body = rows[1:]
+    return [row[0] for row in body], [row[1:] for row in body]
+
+def read_answer_arrow(data: str) -> Tuple[List[str], List[List[Any]]]:
+    """读取base64编码的Arrow IPC数据：首列为学生，其余各列按题目顺序排列（需要安装pyarrow）"""
+    if importlib.util.find_spec("pyarrow") is None:
+        raise AnswerSheetError("读取Arrow格式需要安装pyarrow")
+    ipc = importlib.import_module("pyarrow.ipc")
+    raw = base64.b64decode(data)
+    try:
+        table = ipc.open_file(raw).read_all()
+    except Exception:
+        table = ipc.open_stream(raw).read_all()
+    columns = [column.to_pylist() for column in table.columns]
+    if len(columns) < 2:
+        raise AnswerSheetError("Arrow数据至少需要学生列和一列答案")
+    students = [str(name) for name in columns[0]]
+    return students, [list(row) for row in zip(*columns[1:])]
+
+def to_answer_matrix(rows: Sequence[Sequence[Any]], question_count: int) -> np.ndarray:
+    """转换为 学生×题目 的字符串矩阵，缺失的单元格视为未作答"""
+    matrix = np.full((len(rows), question_count), "", dtype=object)
+    for row_index, row in enumerate(rows):
+        if len(row) > question_count:
+            raise AnswerSheetError(f"第{row_index + 1}名学生的答案数量多于题目数量 {question_count}")
+        for column_index, cell in enumerate(row):
+            if cell is not None:
+                matrix[row_index, column_index] = str(cell)
+    return matrix
+
+def parse_cell(text: str) -> Tuple[int, float, int, bool]:
+    """解析单个答案，返回 (类型, 数值, 小数位数, 是否最简分数)
+
+    最简分数指分子分母互质且分母不为1（n/1应写成整数n）；带分数还要求分数部分是真分数
+    """
+    mixed = MIXED_NUMBER_PATTERN.match(unicodedata.normalize("NFKC", text))
+    if mixed is not None:
+        sign, whole, numerator, denominator = mixed.groups()
+        whole, numerator, denominator = int(whole), int(numerator), int(denominator)
+        if denominator == 0:
+            return INVALID, 0.0, 0, True
+        value = whole + Fraction(numerator, denominator)
+        simplest = 0 < numerator < denominator and math.gcd(numerator, denominator) == 1
+        return FRACTION, float(-value if sign == "-" else value), 0, simplest
+    text = normalize_expression(text)
+    if not text:
+        return BLANK, 0.0, 0, True
+    try:
+        if text.endswith("%"):
+            return PERCENT, float(Fraction(text[:-1]) / 100), 0, True
+        if "/" in text:
+            numerator, denominator = (int(part) for part in text.split("/"))
+            value = Fraction(numerator, denominator)
+            return FRACTION, float(value), 0, math.gcd(numerator, denominator) == 1 and denominator != 1
+        value = Fraction(text)
+        places = len(text.split(".", 1)[1]) if "." in text else 0
+        return DECIMAL, float(value), places, True
+    except (ValueError, ZeroDivisionError):
+        return INVALID, 0.0, 0, True
+
+def parse_matrix(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """每个不同的答案只解析一次，再按下标展开回整个矩阵"""
+    unique, inverse = np.unique(matrix.astype(str), return_inverse=True)
+    parsed = [parse_cell(text) for text in unique]
+    kinds = np.array([item[0] for item in parsed], dtype=np.int8)[inverse]
+    values = np.array([item[1] for item in parsed], dtype=np.float64)[inverse]
+    places = np.array([item[2] for item in parsed], dtype=np.int64)[inverse]
+    simplest = np.array([item[3] for item in parsed], dtype=bool)[inverse]
+    shape = matrix.shape
+    return kinds.reshape(shape), values.reshape(shape), places.reshape(shape), simplest.reshape(shape)
+
+def is_repeating(value: Fraction) -> bool:
+    """分母含有2和5以外的质因子时为无限循环小数"""
+    denominator = value.denominator
+    for prime in (2, 5):
+        while denominator % prime == 0:
+            denominator //= prime
+    return denominator != 1
+
+def grade_matrix(matrix: np.ndarray, correct: Sequence[Fraction], tolerance: float = 1e-9,
+                 min_decimal_places: int = 2, require_simplest: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """整体比对答案矩阵，返回 (是否正确, 是否作答) 两个矩阵
+
+    - 与正确答案的差不超过tolerance（按答案大小缩放）即为正确，等值的分数、小数和百分数都可以
+    - 正确答案为无限循环小数时，至少保留min_decimal_places位并正确四舍五入的小数也算正确
+    - require_simplest为True时，不是最简分数的分数算错（含未约分、分母为1以及分数部分为假分数的带分数）
+    """
+    kinds, values, places, simplest = parse_matrix(matrix)
+    correct_values = np.array([float(value) for value in correct], dtype=np.float64)
+    repeating = np.array([is_repeating(value) for value in correct], dtype=bool)
+
+    difference = np.abs(values - correct_values)
+    exact = difference <= tolerance * np.maximum(1.0, np.abs(correct_values))
+    rounded = (repeating & (kinds == DECIMAL) & (places >= min_decimal_places)
+               & (difference <= 0.5 * np.power(10.0, -places) + 1e-12))
+    answered = kinds != BLANK
+    ok = (kinds >= DECIMAL) & (exact | rounded)
+    if require_simplest:
+        ok &= (kinds != FRACTION) | simplest
+    return ok, answered
+
+def summarize_grades(ok: np.ndarray, answered: np.ndarray, students: List[str], expressions: List[str],
+                     correct: Sequence[Fraction], knowledge_points: List[Optional[str]]) -> Dict[str, Any]:
+    """汇总每名学生的得分、每道题的正确率和每个知识点的错误率"""
+    student_count, question_count = ok.shape
+    correct_per_student = ok.sum(axis=1)
+    answered_per_student = answered.sum(axis=1)
+    correct_per_question = ok.sum(axis=0)
+    blank_per_question = student_count - answered.sum(axis=0)
+
+    scores = np.round(correct_per_student / max(question_count, 1) * 100, 1)
+    wrong_rows, wrong_columns = np.nonzero(~ok)
+    wrong_lists: List[List[int]] = [[] for _ in range(student_count)]
+    for row, column in zip(wrong_rows.tolist(), wrong_columns.tolist()):
+        wrong_lists[row].append(column)
+
+    point_names = [point or UNSPECIFIED_KNOWLEDGE_POINT for point in knowledge_points]
+    names, group = np.unique(np.array(point_names, dtype=object).astype(str), return_inverse=True)
+    errors_per_question = student_count - correct_per_question
+    point_errors = np.bincount(group, weights=errors_per_question, minlength=len(names))
+    point_questions = np.bincount(group, minlength=len(names))
+
+    return {
+        "students": [
+            {"student": student, "score": score, "correct": correct_count, "answered": answered_count,
+             "total": question_count, "wrong": wrong}
+            for student, score, correct_count, answered_count, wrong in zip(
+                students, scores.tolist(), correct_per_student.tolist(), answered_per_student.tolist(), wrong_lists)
+        ],
+        "questions": [
+            {"index": index, "expression": expression, "correct_answer": format_fraction(value),
+             "correct_rate": round(correct_count / max(student_count, 1), 4), "blank": blank}
+            for index, (expression, value, correct_count, blank) in enumerate(zip(
+                expressions, correct, correct_per_question.tolist(), blank_per_question.tolist()))
+        ],
+        "knowledge_points": {
+            name: {"questions": int(questions), "attempts": int(questions) * student_count,
+                   "errors": int(errors), "error_rate": round(errors / max(int(questions) * student_count, 1), 4)}
+            for name, questions, errors in zip(names.tolist(), point_questions.tolist(), point_errors.tolist())
+        },
+        "average_score": round(float(scores.mean()), 1) if student_count else 0.0
+    }
@@ -0,0 +1,358 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from fast_eval import normalize_expression
+
+# 本地规则引擎覆盖的知识点，其余知识点交给大模型
+LOCAL_KNOWLEDGE_POINTS = {
+    "basic_arithmetic",
+    "carry_addition",
+    "borrow_subtraction",
+    "multiplication_table",
+    "division_concept",
+}
+
+BINARY_PATTERN = re.compile(r"^(\d+)([+\-*/])(\d+)$")
+# 有余数除法的写法，如 17÷5=( )余( )、17÷5=□……□，只有这类题目按“商 余 余数”作答
+REMAINDER_MARKER = re.compile(r"余|…|\.{3}")
+
+CHINESE_DIGITS = "零一二三四五六七八九"
+PLACE_NAMES_ZH = ["个位", "十位", "百位", "千位", "万位", "十万位", "百万位", "千万位"]
+PLACE_NAMES_EN = ["ones", "tens", "hundreds", "thousands", "ten-thousands",
+                  "hundred-thousands", "millions", "ten-millions"]
+
+# 各运算的关键概念、常见错误、解题技巧和其他解法
+OPERATION_NOTES = {
+    "+": {
+        "zh-CN": {
+            "concepts": ["加法的意义：把两个数合并成一个数", "数位对齐", "满十进一"],
+            "mistakes": ["数位没有对齐", "忘记加上进位的1", "进位后又把进位写在本位上"],
+            "tips": ["从个位加起，逐位相加", "进位的1可以用小字记在上一位旁边", "用减法验算：和 - 一个加数 = 另一个加数"],
+            "alternatives": ["凑十法：先把一个加数凑成整十数再加", "拆分法：按十位和个位分别相加后合并"],
+        },
+        "en-US": {
+            "concepts": ["Addition combines two numbers into one total", "Line up digits by place value", "Regroup ten ones as one ten"],
+            "mistakes": ["Misaligned place values", "Forgetting to add the carried 1", "Writing the carry in the current column"],
+            "tips": ["Start adding from the ones place", "Write the carried 1 above the next column", "Check with subtraction: sum - addend = other addend"],
+            "alternatives": ["Make-a-ten: round one addend to a multiple of ten first", "Split by place value and add tens and ones separately"],
+        },
+    },
+    "-": {
+        "zh-CN": {
+            "concepts": ["减法的意义：从一个数里去掉一部分", "数位对齐", "退一当十"],
+            "mistakes": ["不够减时用小数减大数", "借位后忘记在前一位减去1", "连续退位时出错"],
+            "tips": ["从个位减起，不够减就向前一位借1当10", "借位时在被借的数位上点一个小点作标记", "用加法验算：差 + 减数 = 被减数"],
+            "alternatives": ["破十法：先用10减，再加上剩下的数", "想加算减：想一个数加减数等于被减数"],
+        },
+        "en-US": {
+            "concepts": ["Subtraction takes a part away from a whole", "Line up digits by place value", "Regroup one ten as ten ones"],
+            "mistakes": ["Subtracting the smaller digit from the larger when borrowing is needed", "Forgetting to reduce the digit that was borrowed from", "Errors when borrowing across several places"],
+            "tips": ["Start from the ones place and borrow when the top digit is smaller", "Mark the digit you borrowed from", "Check with addition: difference + subtrahend = minuend"],
+            "alternatives": ["Break apart ten: subtract from 10 and add the rest", "Think addition: what number plus the subtrahend gives the minuend?"],
+        },
+    },
+    "*": {
+        "zh-CN": {
+            "concepts": ["乘法的意义：求几个相同加数的和", "乘法口诀", "乘法交换律"],
+            "mistakes": ["口诀记错", "多位数乘法中进位漏加", "部分积没有对齐数位"],
+            "tips": ["熟记九九乘法口诀", "用较小的数作乘数更容易计算", "用除法验算：积 ÷ 一个因数 = 另一个因数"],
+            "alternatives": ["连加法：把乘法看作几个相同的数相加", "拆分法：把一个因数拆成整十数和一位数分别相乘"],
+        },
+        "en-US": {
+            "concepts": ["Multiplication is repeated addition of equal groups", "Times-table facts", "Commutative property"],
+            "mistakes": ["Recalling a times-table fact incorrectly", "Dropping a carry in multi-digit multiplication", "Misaligning partial products"],
+            "tips": ["Memorise the 9×9 times table", "Use the smaller number as the multiplier", "Check with division: product ÷ one factor = other factor"],
+            "alternatives": ["Repeated addition of equal groups", "Split one factor into tens and ones and multiply each part"],
+        },
+    },
+    "/": {
+        "zh-CN": {
+            "concepts": ["除法的意义：平均分", "被除数 = 除数 × 商 + 余数", "余数必须小于除数"],
+            "mistakes": ["商的位置写错", "余数大于或等于除数", "中间某一位不够商1时漏写0"],
+            "tips": ["用乘法口诀试商", "从被除数的最高位开始除", "用乘法验算：商 × 除数 + 余数 = 被除数"],
+            "alternatives": ["想乘算除：想除数乘几等于被除数", "连减法：看被除数里能减去几个除数"],
+        },
+        "en-US": {
+            "concepts": ["Division shares a number into equal groups", "Dividend = divisor × quotient + remainder", "The remainder must be smaller than the divisor"],
+            "mistakes": ["Writing a quotient digit in the wrong place", "Leaving a remainder that is not smaller than the divisor", "Forgetting a 0 in the quotient when a step does not divide"],
+            "tips": ["Use times-table facts to estimate each quotient digit", "Start from the highest place of the dividend", "Check with multiplication: quotient × divisor + remainder = dividend"],
+            "alternatives": ["Think multiplication: divisor times what gives the dividend?", "Repeated subtraction of the divisor"],
+        },
+    },
+}
+
+def chinese_number(value: int) -> str:
+    """100以内的整数转为中文读法，用于乘法口诀"""
+    if value < 10:
+        return CHINESE_DIGITS[value]
+    tens, ones = divmod(value, 10)
+    text = ("" if tens == 1 else CHINESE_DIGITS[tens]) + "十"
+    return text + (CHINESE_DIGITS[ones] if ones else "")
+
+def multiplication_rhyme(a: int, b: int) -> str:
+    """乘法口诀，如 三八二十四、二三得六、二五一十"""
+    small, large = sorted((a, b))
+    product = small * large
+    if product < 10:
+        return f"{CHINESE_DIGITS[small]}{CHINESE_DIGITS[large]}得{CHINESE_DIGITS[product]}"
+    if product == 10:
+        return f"{CHINESE_DIGITS[small]}{CHINESE_DIGITS[large]}一十"
+    return f"{CHINESE_DIGITS[small]}{CHINESE_DIGITS[large]}{chinese_number(product)}"
+
+def place_name(index: int, language: str) -> str:
+    names = PLACE_NAMES_ZH if language == "zh-CN" else PLACE_NAMES_EN
+    return names[index] if index < len(names) else (f"第{index + 1}位" if language == "zh-CN" else f"place {index + 1}")
+
+def make_step(number: int, description: str, calculation: str, result: str, explanation: str = "") -> Dict[str, Any]:
+    return {
+        "step_number": number,
+        "description": description,
+        "calculation": calculation,
+        "result": result,
+        "explanation": explanation,
+    }
+
+def explain_addition(a: int, b: int, zh: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """竖式加法：从个位起逐位相加，满十进一"""
+    steps = []
+    digits_a, digits_b = str(a)[::-1], str(b)[::-1]
+    carry = 0
+    carries = 0
+    for index in range(max(len(digits_a), len(digits_b))):
+        da = int(digits_a[index]) if index < len(digits_a) else 0
+        db = int(digits_b[index]) if index < len(digits_b) else 0
+        total = da + db + carry
+        calculation = f"{da} + {db}" + (f" + {carry}" if carry else "") + f" = {total}"
+        place = place_name(index, "zh-CN" if zh else "en-US")
+        if total >= 10:
+            carries += 1
+            explanation = (f"满十进一：{place}写{total % 10}，向前一位进1" if zh
+                           else f"{total} is ten or more: write {total % 10} in the {place} place and carry 1")
+        else:
+            explanation = f"{place}写{total}" if zh else f"Write {total} in the {place} place"
+        steps.append(make_step(len(steps) + 1, f"{place}相加" if zh else f"Add the {place} digits",
+                               calculation, str(total % 10), explanation))
+        carry = total // 10
+    if carry:
+        steps.append(make_step(len(steps) + 1, "写下最高位的进位" if zh else "Write the final carry",
+                               "", str(carry),
+                               "最高位相加后还有进位，直接写在最前面" if zh else "The last column produced a carry, so write it in front"))
+    return steps, carries
+
+def explain_subtraction(a: int, b: int, zh: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """竖式减法：从个位起逐位相减，不够减向前一位借1当10"""
+    steps = []
+    digits_a, digits_b = str(a)[::-1], str(b)[::-1]
+    borrow = 0
+    borrows = 0
+    for index in range(len(digits_a)):
+        da = int(digits_a[index]) - borrow
+        db = int(digits_b[index]) if index < len(digits_b) else 0
+        place = place_name(index, "zh-CN" if zh else "en-US")
+        prefix = (f"{digits_a[index]} 被借走1后是 {da}；" if zh else f"{digits_a[index]} becomes {da} after lending 1; ") if borrow else ""
+        if da < 0:
+            # 连续退位：这一位是0，先向前一位借1当10，再减去被借走的1
+            borrows += 1
+            difference = 9 - db
+            calculation = f"10 - 1 - {db} = {difference}"
+            explanation = (f"这一位是0，被后一位借走1，需要再向前一位借1当10：10 - 1 = 9，9 - {db} = {difference}" if zh
+                           else f"This digit is 0 and already lent 1, so borrow again: 10 - 1 = 9, 9 - {db} = {difference}")
+            borrow = 1
+        elif da < db:
+            borrows += 1
+            difference = da + 10 - db
+            calculation = f"{da + 10} - {db} = {difference}"
+            explanation = prefix + (f"{da}不够减{db}，向前一位借1当10，{da + 10} - {db} = {difference}" if zh
+                                    else f"{da} is less than {db}, so borrow 1 ten: {da + 10} - {db} = {difference}")
+            borrow = 1
+        else:
+            difference = da - db
+            calculation = f"{da} - {db} = {difference}"
+            explanation = prefix + (f"{place}写{difference}" if zh else f"Write {difference} in the {place} place")
+            borrow = 0
+        # 最高位为0时不写
+        if index == len(digits_a) - 1 and difference == 0 and index > 0:
+            explanation += "，最高位是0不用写" if zh else "; a leading 0 is not written"
+        steps.append(make_step(len(steps) + 1, f"{place}相减" if zh else f"Subtract the {place} digits",
+                               calculation, str(difference), explanation))
+    return steps, borrows
+
+def explain_multiplication(a: int, b: int, zh: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """一位数乘法用口诀；多位数乘法按乘数的每一位求部分积再相加"""
+    steps = []
+    if a < 10 and b < 10:
+        rhyme = multiplication_rhyme(a, b)
+        steps.append(make_step(1, "用乘法口诀" if zh else "Use the times-table fact",
+                               f"{a} × {b} = {a * b}", str(a * b),
+                               f"口诀：{rhyme}" if zh else f"{min(a, b)} times {max(a, b)} is {a * b}"))
+        return steps, 0
+
+    partials = []
+    for index, digit in enumerate(str(b)[::-1]):
+        digit_value = int(digit)
+        partial = a * digit_value * (10 ** index)
+        partials.append(partial)
+        place = place_name(index, "zh-CN" if zh else "en-US")
+        steps.append(make_step(
+            len(steps) + 1,
+            f"用乘数{place}上的{digit_value}去乘{a}" if zh else f"Multiply {a} by the {place} digit {digit_value}",
+            f"{a} × {digit_value * (10 ** index)} = {partial}", str(partial),
+            (f"从个位乘起，满几十就向前一位进几；部分积的末位与{place}对齐" if zh
+             else f"Multiply from the ones place and carry as needed; align the partial product with the {place} place")
+        ))
+    if len(partials) > 1:
+        steps.append(make_step(len(steps) + 1, "把部分积相加" if zh else "Add the partial products",
+                               " + ".join(str(p) for p in partials) + f" = {a * b}", str(a * b)))
+    return steps, 0
+
+def explain_division(a: int, b: int, zh: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """竖式除法：从被除数最高位起，逐位试商、相乘、相减、落位"""
+    steps = []
+    if a < b * 10 and b < 10 and a < 100:
+        quotient, remainder = divmod(a, b)
+        rhyme = multiplication_rhyme(b, quotient) if 0 < quotient < 10 else ""
+        explanation = (f"想：{b} × {quotient} = {b * quotient}" + (f"（{rhyme}）" if rhyme else "") if zh
+                       else f"Think: {b} × {quotient} = {b * quotient}")
+        if remainder:
+            explanation += (f"，{a} - {b * quotient} = {remainder}，余数{remainder}小于除数{b}" if zh
+                            else f"; {a} - {b * quotient} = {remainder}, and the remainder {remainder} is less than {b}")
+        steps.append(make_step(1, "用乘法口诀求商" if zh else "Use a times-table fact to find the quotient",
+                               f"{a} ÷ {b} = {quotient}" + (f" ... {remainder}" if remainder else ""),
+                               str(quotient), explanation))
+        return steps, 0
+
+    remainder = 0
+    started = False
+    for digit in str(a):
+        current = remainder * 10 + int(digit)
+        quotient_digit, remainder = divmod(current, b)
+        if not started and quotient_digit == 0:
+            continue
+        started = True
+        steps.append(make_step(
+            len(steps) + 1,
+            f"用{current}除以{b}" if zh else f"Divide {current} by {b}",
+            f"{current} ÷ {b} = {quotient_digit} ... {remainder}",
+            str(quotient_digit),
+            (f"商{quotient_digit}，{b} × {quotient_digit} = {b * quotient_digit}，{current} - {b * quotient_digit} = {remainder}" if zh
+             else f"Write {quotient_digit}; {b} × {quotient_digit} = {b * quotient_digit}; {current} - {b * quotient_digit} = {remainder}")
+            + ("" if quotient_digit else ("，不够商1时商0" if zh else "; write 0 when the divisor does not fit"))
+        ))
+    if not started:
+        steps.append(make_step(1, "被除数小于除数" if zh else "The dividend is smaller than the divisor",
+                               f"{a} ÷ {b} = 0 ... {a}", "0"))
+    return steps, 0
+
+EXPLAINERS = {
+    "+": explain_addition,
+    "-": explain_subtraction,
+    "*": explain_multiplication,
+    "/": explain_division,
+}
+
+def is_remainder_question(expression: str) -> bool:
+    return REMAINDER_MARKER.search(normalize_expression(expression)) is not None
+
+def parse_binary_expression(expression: str) -> Optional[Tuple[int, str, int]]:
+    """解析形如 a 运算符 b 的整数表达式，有余数除法只取等号之前的部分"""
+    text = normalize_expression(expression)
+    if REMAINDER_MARKER.search(text):
+        text = re.split(r"=|余|…|\.{3}", text)[0]
+    match = BINARY_PATTERN.match(text)
+    if match is None:
+        return None
+    a, operator, b = int(match.group(1)), match.group(2), int(match.group(3))
+    if operator == "-" and a < b:
+        return None
+    if operator == "/" and b == 0:
+        return None
+    return a, operator, b
+
+def integer_result(a: int, operator: str, b: int) -> int:
+    """整数结果；除法为商（有余数时舍去余数）"""
+    if operator == "+":
+        return a + b
+    if operator == "-":
+        return a - b
+    if operator == "*":
+        return a * b
+    return a // b
+
+def format_answer(a: int, operator: str, b: int, zh: bool) -> str:
+    if operator != "/":
+        return str(integer_result(a, operator, b))
+    quotient, remainder = divmod(a, b)
+    if remainder:
+        return f"{quotient} 余 {remainder}" if zh else f"{quotient} remainder {remainder}"
+    return str(quotient)
+
+def explain_locally(question: Dict[str, Any], language: str = "zh-CN",
+                    detail_level: str = "standard") -> Optional[Dict[str, Any]]:
+    """为基础运算类知识点生成完整的AIAnalysis数据，不支持时返回None
+
+    只解答结果为整数的题目：除不尽的除法只有题目明确要求写余数时才按“商 余 余数”作答，
+    否则（如 3/4、12÷5 需要分数或小数结果）交给大模型。题目给出的答案不是整数或与计算结果
+    不一致时同样返回None，不用本地结果覆盖。
+    """
+    if question.get("knowledge_point") not in LOCAL_KNOWLEDGE_POINTS:
+        return None
+    expression = question.get("expression") or ""
+    parsed = parse_binary_expression(expression)
+    if parsed is None:
+        return None
+
+    a, operator, b = parsed
+    if operator == "/" and a % b and not is_remainder_question(expression):
+        return None
+    expected = question.get("answer")
+    if expected is not None and float(expected) != integer_result(a, operator, b):
+        return None
+
+    zh = language == "zh-CN"
+    steps, regroupings = EXPLAINERS[operator](a, b, zh)
+    answer = format_answer(a, operator, b, zh)
+    symbol = {"+": "+", "-": "-", "*": "×", "/": "÷"}[operator]
+    notes = OPERATION_NOTES[operator]["zh-CN" if zh else "en-US"]
+
+    steps.append(make_step(len(steps) + 1, "写出答案" if zh else "Write the answer",
+                           f"{a} {symbol} {b} = {answer}", answer))
+
+    names_zh = {"+": "加法", "-": "减法", "*": "乘法", "/": "除法"}
+    names_en = {"+": "addition", "-": "subtraction", "*": "multiplication", "/": "division"}
+    digits = max(len(str(a)), len(str(b)))
+    if zh:
+        understanding = f"这是一道{names_zh[operator]}题，要求计算 {a} {symbol} {b} 的结果。"
+        approach = {
+            "+": "列竖式，数位对齐，从个位加起，满十进一。",
+            "-": "列竖式，数位对齐，从个位减起，不够减时向前一位借1当10。",
+            "*": "一位数相乘直接用乘法口诀；多位数相乘用乘数的每一位去乘被乘数，再把部分积相加。",
+            "/": "从被除数的最高位除起，用乘法口诀试商，每次求出的余数要比除数小。",
+        }[operator]
+        regroup_text = {"+": f"共进位 {regroupings} 次", "-": f"共退位 {regroupings} 次"}.get(operator, "")
+        difficulty = f"{digits}位数的{names_zh[operator]}" + (f"，{regroup_text}" if regroup_text else "") + "。"
+    else:
+        article = "an" if operator == "+" else "a"
+        understanding = f"This is {article} {names_en[operator]} problem: find {a} {symbol} {b}."
+        approach = {
+            "+": "Write the numbers in columns, add from the ones place and carry when a column reaches ten.",
+            "-": "Write the numbers in columns, subtract from the ones place and borrow a ten when needed.",
+            "*": "Use a times-table fact for single digits; otherwise multiply by each digit and add the partial products.",
+            "/": "Divide from the highest place, estimate each quotient digit with times-table facts and keep each remainder smaller than the divisor.",
+        }[operator]
+        regroup_text = {"+": f"{regroupings} carry(ies)", "-": f"{regroupings} borrow(s)"}.get(operator, "")
+        difficulty = f"{digits}-digit {names_en[operator]}" + (f" with {regroup_text}" if regroup_text else "") + "."
+
+    mistakes, tips, alternatives = notes["mistakes"], notes["tips"], notes["alternatives"]
+    if detail_level == "simple":
+        mistakes, tips, alternatives = mistakes[:1], tips[:1], []
+
+    return {
+        "problem_understanding": understanding,
+        "solution_approach": approach,
+        "solution_steps": steps,
+        "key_concepts": list(notes["concepts"]),
+        "common_mistakes": list(mistakes),
+        "tips": list(tips),
+        "difficulty_analysis": difficulty,
+        "alternative_methods": list(alternatives),
+    }
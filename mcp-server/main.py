@@ -1,18 +1,53 @@
-from fastapi import FastAPI, HTTPException
+import time
+# 进程开始导入main的时间，用于启动耗时统计
+MODULE_LOAD_STARTED = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import asyncio
-import threading
-import time
 import uuid
-from typing import Dict, Any, Optional, List
-import sympy as sp
-from sympy.parsing.sympy_parser import parse_expr
+from typing import Dict, Any, Optional, List, AsyncIterator, Callable, Tuple
+import numpy as np
 import json
+import random
 import os
+import threading
 import httpx
-from datetime import datetime
-from config_loader import config_loader, get_app_info, get_app_version, get_app_name
+from pathlib import Path
+from fractions import Fraction
+from config_loader import apply_env_overrides, config_loader, get_app_info, get_app_version, get_app_name
+from config_watcher import ConfigWatcher
+from scheduler import SchedulerFullError, create_scheduler
+from fast_eval import evaluate_fraction_engine, prepare_expression
+from sympy_engine import evaluate_with_eval, evaluate_with_sympy
+from sandbox import SANDBOX_ENGINES, SandboxError, create_sandbox_pool
+from expression_guard import ExpressionRejected, create_expression_guard
+from lru_cache import LRUCache
+from task_store import create_task_store
+from state_backend import SharedMapping, StateBackendError, create_state_backend
+from task_events import format_sse, stream_task_events, wait_for_task
+from ai_client_pool import create_ai_client_pool
+from analysis_cache import create_analysis_cache, make_analysis_key
+from ai_router import create_ai_router
+from local_explainer import explain_locally
+from question_generator import (STREAM_FORMATS, GenerationError, QuestionGenerator, generate_bank,
+                                iter_question_stream, merge_records, new_seed)
+from question_index import load_question_index, resolve_index_path
+from metrics import EVALUATION_BUCKETS, UPSTREAM_BUCKETS, MetricsRegistry
+from grading import (AnswerSheetError, grade_matrix, read_answer_arrow, read_answer_csv, summarize_grades,
+                     to_answer_matrix)
+
+# 启动各阶段耗时（毫秒），startup_event中输出
+startup_timings: Dict[str, float] = {}
+
+def record_startup_phase(phase: str, started: float) -> float:
+    """记录一个启动阶段的耗时，返回当前时间作为下一阶段的起点"""
+    now = time.perf_counter()
+    startup_timings[phase] = round((now - started) * 1000, 1)
+    return now
+
+module_init_started = record_startup_phase("imports", MODULE_LOAD_STARTED)
 
 # 从YAML配置加载应用信息
 app_info = get_app_info()
@@ -37,9 +72,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 存储任务状态和结果
-tasks: Dict[str, Dict[str, Any]] = {}
-ai_tasks: Dict[str, Dict[str, Any]] = {}  # AI分析任务
+# 有界执行调度器，替代每个请求一个线程
+scheduler = create_scheduler(mcp_config.get("scheduler", {}))
+
+# 服务端题目生成引擎
+question_generator = QuestionGenerator(config_loader.get_math_config())
+
+# 共享状态存储：默认使用进程内存储；多工作进程部署时使用sqlite或redis，任务和自定义AI配置在进程间共享
+try:
+    state_backend = create_state_backend(mcp_config.get("state_backend"), Path(__file__).parent)
+except (StateBackendError, OSError) as e:
+    print(f"共享状态存储不可用，使用进程内存储: {e}")
+    state_backend = None
+
+# 存储任务状态和结果（带TTL和容量上限，后台定期清理）
+task_store_config = mcp_config.get("task_store", {})
+tasks = create_task_store("tasks", task_store_config, state_backend)
+ai_tasks = create_task_store("ai_tasks", task_store_config, state_backend)  # AI分析任务
 
 # 从YAML配置加载AI设置
 ai_config = config_loader.get_ai_config()
@@ -51,13 +100,78 @@ AI_CONFIG = {
     "api_base": os.getenv("AI_API_BASE", ai_services.get(default_service, {}).get("api_base", "https://api.deepseek.com")),
     "api_key": os.getenv("AI_API_KEY", ""),
     "model": os.getenv("AI_MODEL", ai_services.get(default_service, {}).get("model", "deepseek-chat")),
-    "timeout": ai_config.get("timeout", 30)
+    "timeout": ai_config.get("timeout", 30),
+    "json_mode": ai_services.get(default_service, {}).get("json_mode", ai_config.get("structured_output", True))
 }
 
+# AI服务的长连接客户端池，首次请求某个服务时创建客户端，关闭时释放
+ai_client_pool = create_ai_client_pool(ai_config.get("http_pool"))
+
+# 多服务路由：按滚动延迟和错误率选择服务
+ai_routing_config = ai_config.get("routing", {})
+ai_router = create_ai_router(ai_routing_config)
+
+# AI请求重试和批量分析配置
+ai_retry_config = ai_config.get("retry", {})
+ai_batch_config = ai_config.get("batch", {})
+ai_batch_semaphore: Optional[asyncio.Semaphore] = None
+
+# 提示词版本，修改提示词时递增，使旧的分析缓存失效
+PROMPT_VERSION = "2"
+
+# 是否要求AI以JSON格式输出分析结果（服务可用json_mode单独关闭），解析失败时回退到文本解析
+ai_structured_output = ai_config.get("structured_output", True)
+
+# 各详细程度包含的章节、列表条数和token预算，可在ai.detail_levels中覆盖
+DETAIL_LEVELS: Dict[str, Dict[str, Any]] = {
+    "simple": {
+        "max_tokens": 500,
+        "max_steps": 3,
+        "max_items": 1,
+        "sections": ["problem_understanding", "solution_steps", "common_mistakes", "tips"]
+    },
+    "standard": {
+        "max_tokens": 1200,
+        "max_steps": 6,
+        "max_items": 3,
+        "sections": ["problem_understanding", "solution_approach", "solution_steps", "key_concepts",
+                     "common_mistakes", "tips", "difficulty_analysis"]
+    },
+    "detailed": {
+        "max_tokens": 2400,
+        "max_steps": 10,
+        "max_items": 5,
+        "sections": ["problem_understanding", "solution_approach", "solution_steps", "key_concepts",
+                     "common_mistakes", "tips", "difficulty_analysis", "alternative_methods"]
+    }
+}
+for level_name, level_overrides in (ai_config.get("detail_levels") or {}).items():
+    DETAIL_LEVELS.setdefault(level_name, dict(DETAIL_LEVELS["standard"])).update(level_overrides)
+
+# AI分析结果缓存（内存 + SQLite），未启用时为None
+analysis_cache = create_analysis_cache(ai_config.get("analysis_cache"), Path(__file__).parent)
+
+# 运行指标，通过 GET /metrics 以Prometheus文本格式导出
+metrics = MetricsRegistry()
+evaluation_duration = metrics.histogram(
+    "mcp_evaluation_duration_seconds", "表达式计算耗时，按最终给出结果的计算引擎区分，failed为全部引擎失败",
+    ["engine"], EVALUATION_BUCKETS)
+evaluation_fallbacks = metrics.counter(
+    "mcp_evaluation_fallbacks_total", "计算引擎无法处理而回退到下一个引擎的次数", ["engine"])
+ai_upstream_duration = metrics.histogram(
+    "mcp_ai_upstream_duration_seconds", "AI上游请求耗时（流式请求为整个响应的接收时间）",
+    ["provider", "model", "mode"], UPSTREAM_BUCKETS)
+ai_upstream_requests = metrics.counter(
+    "mcp_ai_upstream_requests_total", "AI上游请求数，status为HTTP状态码或timeout/network_error/error",
+    ["provider", "model", "status"])
+ai_tokens = metrics.counter(
+    "mcp_ai_tokens_total", "AI上游返回的token用量", ["provider", "model", "kind"])
+
 # 定义数据模型
 class CodeExecutionRequest(BaseModel):
     code: str
     timeout: Optional[int] = 10
+    priority: Optional[str] = "interactive"  # 调度车道："interactive" 或 "bulk"
 
 class TaskResult(BaseModel):
     task_id: str
@@ -65,6 +179,36 @@ class TaskResult(BaseModel):
     result: Optional[Any] = None
     error: Optional[str] = None
 
+# 批量验证相关数据模型
+class BatchExecutionItem(BaseModel):
+    code: str
+    expected: Optional[str] = None  # 预期答案（可选），用于比对
+
+class BatchExecutionRequest(BaseModel):
+    items: List[BatchExecutionItem]
+    timeout: Optional[int] = 10
+    wait: Optional[bool] = True  # True: 同步返回结果；False: 返回批量任务ID
+    priority: Optional[str] = "bulk"  # 调度车道，批量验证默认走bulk车道
+    tolerance: Optional[float] = 1e-6  # 数值比对容差
+
+class BatchItemResult(BaseModel):
+    index: int
+    code: str
+    result: Optional[str] = None
+    error: Optional[str] = None
+    expected: Optional[str] = None
+    mismatch: Optional[bool] = None  # 与预期答案不一致时为True，未提供预期答案时为None
+
+class BatchExecutionResult(BaseModel):
+    task_id: str
+    status: str
+    total: int
+    completed: int = 0
+    mismatches: int = 0
+    failures: int = 0
+    results: Optional[List[BatchItemResult]] = None
+    error: Optional[str] = None
+
 # AI解答相关数据模型
 class MathQuestion(BaseModel):
     expression: str
@@ -73,10 +217,58 @@ class MathQuestion(BaseModel):
     knowledge_point: Optional[str] = None
     difficulty: Optional[int] = None
 
+class GenerateRequest(BaseModel):
+    operation_types: List[str] = ["addition"]
+    knowledge_point: Optional[str] = None
+    difficulty: int = 3
+    grade: Optional[int] = None
+    count: int = 20
+    seed: Optional[int] = None
+    unique: bool = True
+    carry: Optional[bool] = None  # 加减法是否进位/退位，None表示不限
+
+class GenerateStreamRequest(GenerateRequest):
+    count: int = 10000
+    format: str = "ndjson"  # "ndjson" 或 "csv"
+    offset: int = 0  # 续传：从第offset道题开始输出
+
+class GradeRequest(BaseModel):
+    questions: List[MathQuestion]
+    students: Optional[List[str]] = None
+    answers: Optional[List[List[Any]]] = None  # 学生×题目的答案矩阵
+    answers_csv: Optional[str] = None  # CSV文本：首行表头，首列学生
+    answers_arrow: Optional[str] = None  # base64编码的Arrow IPC数据：首列学生
+    tolerance: float = 1e-9
+    min_decimal_places: int = 2  # 无限循环小数答案至少保留的小数位数
+    require_simplest: bool = False  # 分数是否必须约分
+    include_matrix: bool = False
+
 class AIAnalysisRequest(BaseModel):
     question: MathQuestion
     language: Optional[str] = "zh-CN"
     detail_level: Optional[str] = "standard"  # "simple", "standard", "detailed"
+    engine: Optional[str] = "auto"  # "auto": 基础运算用本地引擎；"llm": 强制大模型；"local": 仅本地引擎
+
+class AIBatchAnalysisRequest(BaseModel):
+    questions: List[MathQuestion]
+    language: Optional[str] = "zh-CN"
+    detail_level: Optional[str] = "standard"
+    engine: Optional[str] = "auto"
+
+class AIBatchItem(BaseModel):
+    index: int
+    task_id: str
+    status: str
+    analysis: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class AIBatchAnalysisResult(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    completed: int = 0
+    failures: int = 0
+    items: Optional[List[AIBatchItem]] = None
 
 class AIAnalysisResult(BaseModel):
     task_id: str
@@ -102,13 +294,23 @@ class AIAnalysis(BaseModel):
     alternative_methods: List[str]  # 其他解法
 
 # 存储用户自定义AI配置
-custom_ai_configs: Dict[str, Dict[str, Any]] = {}
+custom_ai_configs = SharedMapping(state_backend, "custom_ai_configs") if state_backend is not None else {}
+
+async def call_state_backend(fn: Callable[..., Any], *args: Any) -> Any:
+    """共享状态存储的调用会阻塞（等待SQLite锁、Redis往返），在线程池中执行，不阻塞事件循环"""
+    if state_backend is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def read_custom_ai_configs() -> List[Tuple[str, Dict[str, Any]]]:
+    """一次读取全部自定义AI配置，异步代码将结果传给get_effective_ai_config和get_ai_providers"""
+    return await call_state_backend(lambda: list(custom_ai_configs.items()))
 
 # 获取有效的AI配置（优先使用自定义配置）
-def get_effective_ai_config() -> Dict[str, Any]:
-    """获取有效的AI配置，优先使用用户自定义的配置"""
+def get_effective_ai_config(configs: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """获取有效的AI配置，优先使用用户自定义的配置；configs为已读取的自定义配置，未提供时直接读取"""
     # 查找启用的自定义API配置
-    for config_id, config in custom_ai_configs.items():
+    for config_id, config in (custom_ai_configs.items() if configs is None else configs):
         if config.get("enabled", False) and config.get("api_key"):
             return {
                 "api_base": config["api_base"],
@@ -120,370 +322,1345 @@ def get_effective_ai_config() -> Dict[str, Any]:
     # 如果没有自定义配置，使用默认配置
     return AI_CONFIG
 
+def get_ai_providers(configs: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
+    """参与路由的AI服务：启用的自定义配置、默认服务，以及ai.routing.providers中列出的服务"""
+    if configs is None:
+        configs = list(custom_ai_configs.items())
+    if not ai_routing_config.get("enabled", True):
+        effective_config = get_effective_ai_config(configs)
+        return [{"name": "effective", **effective_config}] if effective_config["api_key"] else []
+    
+    providers = []
+    for config_id, config in configs:
+        if config.get("enabled", False) and config.get("api_key"):
+            providers.append({
+                "name": f"custom:{config_id}",
+                "api_base": config["api_base"],
+                "api_key": config["api_key"],
+                "model": config["model"],
+                "timeout": config.get("timeout", 30)
+            })
+    if AI_CONFIG["api_key"]:
+        providers.append({"name": default_service, **AI_CONFIG})
+    
+    names = {provider["name"] for provider in providers}
+    for name in ai_routing_config.get("providers", []):
+        service = ai_services.get(name)
+        if not service or name in names:
+            continue
+        # 服务需已配置api_key，或不需要密钥（如本地Ollama）
+        api_key = service.get("api_key", "")
+        if api_key or not service.get("requires_key", True):
+            providers.append({
+                "name": name,
+                "api_base": service["api_base"],
+                "api_key": api_key,
+                "model": service["model"],
+                "timeout": ai_config.get("timeout", 30),
+                "json_mode": service.get("json_mode", ai_structured_output)
+            })
+    return providers
+
+def build_ai_headers(effective_config: Dict[str, Any]) -> Dict[str, str]:
+    """构造AI API请求头，无需密钥的服务不发送Authorization"""
+    headers = {"Content-Type": "application/json"}
+    if effective_config["api_key"]:
+        headers["Authorization"] = f"Bearer {effective_config['api_key']}"
+    return headers
+
+def get_detail_level(detail_level: Optional[str]) -> Dict[str, Any]:
+    """获取详细程度配置，未知的取值按standard处理"""
+    return DETAIL_LEVELS.get(detail_level or "standard", DETAIL_LEVELS["standard"])
+
+def use_json_mode(effective_config: Dict[str, Any], stream: bool = False) -> bool:
+    """流式分析按章节增量解析文本，不使用JSON输出"""
+    return not stream and effective_config.get("json_mode", ai_structured_output)
+
+def build_chat_payload(question: MathQuestion, language: str, detail_level: str,
+                       effective_config: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+    """构造chat completions请求体，token预算随详细程度变化"""
+    json_mode = use_json_mode(effective_config, stream)
+    level = get_detail_level(detail_level)
+    # 构造提示词
+    if json_mode:
+        prompt = create_structured_analysis_prompt(question, language, detail_level)
+    else:
+        prompt = create_analysis_prompt(question, language, detail_level)
+    system_prompt = "你是一个专业的小学数学老师，擅长解释数学题目和指导学生逐步解题。请用清晰、通俗易懂的语言讲解。"
+    if json_mode:
+        system_prompt += "只输出一个JSON对象，不要输出其他内容。"
+    payload = {
+        "model": effective_config["model"],
+        "messages": [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.3 if json_mode else 0.7,
+        "max_tokens": level["max_tokens"]
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def record_upstream(effective_config: Dict[str, Any], mode: str, started: float, status: str,
+                    usage: Optional[Dict[str, Any]] = None) -> None:
+    """记录一次AI上游请求的耗时、状态和token用量"""
+    provider = effective_config.get("name", "default")
+    model = effective_config["model"]
+    ai_upstream_duration.observe(time.perf_counter() - started, provider=provider, model=model, mode=mode)
+    ai_upstream_requests.inc(provider=provider, model=model, status=status)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(kind):
+            ai_tokens.inc(usage[kind], provider=provider, model=model, kind=kind.split("_")[0])
+
+def upstream_error_status(error: Exception) -> str:
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.NetworkError):
+        return "network_error"
+    return "error"
+
+def is_retryable_status(status_code: int) -> bool:
+    """429和5xx错误可以重试"""
+    return status_code == 429 or status_code >= 500
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After头（秒数）"""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
 # AI分析数学题目
-async def analyze_math_question_with_ai(question: MathQuestion, language: str = "zh-CN", detail_level: str = "standard") -> Dict[str, Any]:
-    """使用AI分析数学题目并生成解答步骤"""
+async def analyze_math_question_with_ai(question: MathQuestion, language: str = "zh-CN", detail_level: str = "standard",
+                                        provider: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """使用AI分析数学题目并生成解答步骤，provider为空时使用有效的AI配置"""
     
     # 获取有效的AI配置
-    effective_config = get_effective_ai_config()
+    effective_config = provider or get_effective_ai_config(await read_custom_ai_configs())
     
-    if not effective_config["api_key"]:
+    if not effective_config["api_key"] and provider is None:
         return {"error": "AI API Key 未配置，请在配置文件或环境变量中设置AI_API_KEY"}
     
-    # 构造提示词
-    prompt = create_analysis_prompt(question, language, detail_level)
-    
     try:
         print(f"正在使用模型 {effective_config['model']} 分析题目: {question.expression}")
-        async with httpx.AsyncClient(timeout=effective_config["timeout"]) as client:
+        client = ai_client_pool.get(effective_config["api_base"])
+        started = time.perf_counter()
+        try:
             response = await client.post(
-                f"{effective_config['api_base']}/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {effective_config['api_key']}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": effective_config["model"],
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "你是一个专业的小学数学老师，擅长解释数学题目和指导学生逐步解题。请用清晰、通俗易懂的语言提供详细的解题步骤和解释。"
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 2000
-                }
+                "/v1/chat/completions",
+                headers=build_ai_headers(effective_config),
+                json=build_chat_payload(question, language, detail_level, effective_config),
+                timeout=effective_config["timeout"]
             )
+        except Exception as e:
+            record_upstream(effective_config, "complete", started, upstream_error_status(e))
+            raise
             
-            if response.status_code != 200:
-                error_text = await response.aread()
-                print(f"AI API请求失败: {response.status_code} - {error_text}")
-                return {"error": f"AI API 请求失败: {response.status_code} - {error_text.decode('utf-8')}"}
+        if response.status_code != 200:
+            record_upstream(effective_config, "complete", started, str(response.status_code))
+            error_text = await response.aread()
+            print(f"AI API请求失败: {response.status_code} - {error_text}")
+            return {
+                "error": f"AI API 请求失败: {response.status_code} - {error_text.decode('utf-8')}",
+                "status_code": response.status_code,
+                "retryable": is_retryable_status(response.status_code),
+                "retry_after": parse_retry_after(response.headers.get("Retry-After"))
+            }
             
-            result = response.json()
-            ai_response = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        result = response.json()
+        record_upstream(effective_config, "complete", started, "200", result.get("usage"))
+        ai_response = result.get("choices", [{}])[0].get("message", {}).get("content", "")
             
-            # 解析AI响应并结构化
+        # 解析AI响应并结构化：优先按JSON解析，失败时回退到文本解析
+        analysis = None
+        if use_json_mode(effective_config):
+            analysis = parse_structured_response(ai_response)
+            if analysis is None:
+                print("AI响应不是有效的JSON，使用文本解析")
+        if analysis is None:
             analysis = parse_ai_response(ai_response, question)
-            print(f"AI分析完成，生成了 {len(analysis.solution_steps)} 个解题步骤")
-            return {"analysis": analysis}
+        print(f"AI分析完成，生成了 {len(analysis.solution_steps)} 个解题步骤")
+        return {"analysis": analysis}
             
     except httpx.TimeoutException:
         error_msg = f"AI API请求超时 ({effective_config['timeout']}秒)，请稍后重试"
         print(error_msg)
-        return {"error": error_msg}
+        return {"error": error_msg, "retryable": True}
     except httpx.NetworkError as e:
         error_msg = f"网络连接错误: {str(e)}"
         print(error_msg)
-        return {"error": error_msg}
+        return {"error": error_msg, "retryable": True}
     except Exception as e:
         error_msg = f"AI分析失败: {str(e)}"
         print(error_msg)
         return {"error": error_msg}
 
-def create_analysis_prompt(question: MathQuestion, language: str, detail_level: str) -> str:
-    """构造AI分析提示词"""
+async def stream_math_question_analysis(question: MathQuestion, language: str = "zh-CN", detail_level: str = "standard") -> AsyncIterator[Dict[str, Any]]:
+    """流式AI分析：边接收token边解析，每完成一个章节或解题步骤就产生一个事件"""
     
-    if language == "zh-CN":
-        prompt = f"""
-请分析以下数学题目并提供详细的解答步骤：
-
-题目：{question.expression}
-"""
-        if question.answer is not None:
-            prompt += f"答案：{question.answer}\n"
-        if question.operation:
-            prompt += f"运算类型：{question.operation}\n"
-        if question.knowledge_point:
-            prompt += f"知识点：{question.knowledge_point}\n"
+    # 流式请求无法对冲，直接使用当前最健康的服务
+    configs = await read_custom_ai_configs()
+    providers = ai_router.rank(get_ai_providers(configs))
+    effective_config = providers[0] if providers else get_effective_ai_config(configs)
+    
+    if not effective_config["api_key"] and not providers:
+        yield {"type": "error", "error": "AI API Key 未配置，请在配置文件或环境变量中设置AI_API_KEY"}
+        return
+    
+    def record_route(success: bool) -> None:
+        # 与call_ai_provider相同，流式请求的延迟和成败也计入路由的健康度排序
+        if providers:
+            ai_router.record(effective_config["name"], time.perf_counter() - started, success)
+    
+    parser = IncrementalAnalysisParser()
+    started = time.perf_counter()
+    try:
+        print(f"正在使用模型 {effective_config['model']} 流式分析题目: {question.expression}")
+        client = ai_client_pool.get(effective_config["api_base"])
+        usage = None
+        async with client.stream(
+            "POST",
+            "/v1/chat/completions",
+            headers=build_ai_headers(effective_config),
+            json=build_chat_payload(question, language, detail_level, effective_config, stream=True),
+            timeout=effective_config["timeout"]
+        ) as response:
+            if response.status_code != 200:
+                record_upstream(effective_config, "stream", started, str(response.status_code))
+                record_route(False)
+                error_text = await response.aread()
+                print(f"AI API请求失败: {response.status_code} - {error_text}")
+                yield {"type": "error", "error": f"AI API 请求失败: {response.status_code} - {error_text.decode('utf-8')}"}
+                return
+                
+            # OpenAI兼容的流式响应：每行 "data: {json}"，以 "data: [DONE]" 结束
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                # 部分服务在最后一个数据块中返回token用量
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    for event in parser.feed(content):
+                        yield event
+        record_upstream(effective_config, "stream", started, "200", usage)
         
-        prompt += f"""
-请按照以下格式提供分析：
-
-1. 题目理解：简述这道题要求解决什么问题
-2. 解题思路：说明解题的基本方法和思路
-3. 解题步骤：逐步详细说明每一步的计算过程
-4. 关键概念：涉及的数学概念
-5. 常见错误：学生容易犯的错误
-6. 解题技巧：有助于解题的技巧和方法
-7. 难度分析：该题的难度等级和原因
-8. 其他解法：如果有的话，提供其他解题方法
-
-请确保解释通俗易懂，适合小学生理解。
-"""
-    else:
-        # 英文提示词
-        prompt = f"""
-Please analyze the following math problem and provide detailed solution steps:
+        for event in parser.close():
+            yield event
+        analysis = parser.result()
+        record_route(True)
+        print(f"AI流式分析完成，生成了 {len(analysis.solution_steps)} 个解题步骤")
+        # 附带实际作答的模型，缓存按该模型写入
+        yield {"type": "complete", "analysis": analysis, "model": effective_config["model"]}
+    
+    except httpx.TimeoutException:
+        record_upstream(effective_config, "stream", started, "timeout")
+        record_route(False)
+        error_msg = f"AI API请求超时 ({effective_config['timeout']}秒)，请稍后重试"
+        print(error_msg)
+        yield {"type": "error", "error": error_msg}
+    except httpx.NetworkError as e:
+        record_upstream(effective_config, "stream", started, "network_error")
+        record_route(False)
+        error_msg = f"网络连接错误: {str(e)}"
+        print(error_msg)
+        yield {"type": "error", "error": error_msg}
+    except Exception as e:
+        record_route(False)
+        error_msg = f"AI分析失败: {str(e)}"
+        print(error_msg)
+        yield {"type": "error", "error": error_msg}
+
+# 各章节的提示说明 (中文, 英文)
+SECTION_PROMPTS = {
+    "problem_understanding": ("题目理解：简述这道题要求解决什么问题",
+                              "Problem Understanding: Briefly describe what this problem asks to solve"),
+    "solution_approach": ("解题思路：说明解题的基本方法和思路",
+                          "Solution Approach: Explain the basic method and approach for solving"),
+    "solution_steps": ("解题步骤：逐步说明每一步的计算过程",
+                       "Solution Steps: Step-by-step explanation of each calculation"),
+    "key_concepts": ("关键概念：涉及的数学概念", "Key Concepts: Mathematical concepts involved"),
+    "common_mistakes": ("常见错误：学生容易犯的错误", "Common Mistakes: Errors students often make"),
+    "tips": ("解题技巧：有助于解题的技巧和方法", "Solving Tips: Helpful techniques and methods for solving"),
+    "difficulty_analysis": ("难度分析：该题的难度等级和原因", "Difficulty Analysis: Difficulty level and reasons"),
+    "alternative_methods": ("其他解法：如果有的话，提供其他解题方法",
+                            "Alternative Methods: Other solving methods if available"),
+}
+
+DETAIL_INTROS = {
+    "simple": ("请简要分析以下数学题目：", "Please briefly analyze the following math problem:"),
+    "standard": ("请分析以下数学题目并提供解答步骤：", "Please analyze the following math problem and provide solution steps:"),
+    "detailed": ("请详细分析以下数学题目并提供完整的解答步骤：",
+                 "Please analyze the following math problem in detail and provide complete solution steps:"),
+}
+
+def describe_question(question: MathQuestion, zh: bool) -> str:
+    """题目信息部分，中英文提示词共用"""
+    labels = ("题目", "答案", "运算类型", "知识点") if zh else ("Problem", "Answer", "Operation Type", "Knowledge Point")
+    separator = "：" if zh else ": "
+    lines = [f"{labels[0]}{separator}{question.expression}"]
+    if question.answer is not None:
+        lines.append(f"{labels[1]}{separator}{question.answer}")
+    if question.operation:
+        lines.append(f"{labels[2]}{separator}{question.operation}")
+    if question.knowledge_point:
+        lines.append(f"{labels[3]}{separator}{question.knowledge_point}")
+    return "\n".join(lines)
 
-Problem: {question.expression}
+def describe_limits(level: Dict[str, Any], zh: bool) -> str:
+    if zh:
+        return f"解题步骤不超过{level['max_steps']}步，每个列表不超过{level['max_items']}条。请确保解释通俗易懂，适合小学生理解。"
+    return (f"Use at most {level['max_steps']} solution steps and at most {level['max_items']} items per list. "
+            "Please ensure explanations are clear and suitable for elementary school students.")
+
+def create_analysis_prompt(question: MathQuestion, language: str, detail_level: str) -> str:
+    """构造AI分析提示词（文本格式），章节和篇幅随详细程度变化"""
+    zh = language == "zh-CN"
+    level = get_detail_level(detail_level)
+    intro = DETAIL_INTROS.get(detail_level, DETAIL_INTROS["standard"])[0 if zh else 1]
+    sections = "\n".join(
+        f"{number}. {SECTION_PROMPTS[section][0 if zh else 1]}"
+        for number, section in enumerate(level["sections"], 1)
+    )
+    header = "请按照以下格式提供分析：" if zh else "Please provide analysis in the following format:"
+    return f"""
+{intro}
+
+{describe_question(question, zh)}
+
+{header}
+
+{sections}
+
+{describe_limits(level, zh)}
 """
-        if question.answer is not None:
-            prompt += f"Answer: {question.answer}\n"
-        if question.operation:
-            prompt += f"Operation Type: {question.operation}\n"
-        if question.knowledge_point:
-            prompt += f"Knowledge Point: {question.knowledge_point}\n"
-        
-        prompt += """
-Please provide analysis in the following format:
-
-1. Problem Understanding: Briefly describe what this problem asks to solve
-2. Solution Approach: Explain the basic method and approach for solving
-3. Solution Steps: Step-by-step detailed explanation of each calculation
-4. Key Concepts: Mathematical concepts involved
-5. Common Mistakes: Errors students often make
-6. Solving Tips: Helpful techniques and methods for solving
-7. Difficulty Analysis: Difficulty level and reasons
-8. Alternative Methods: Other solving methods if available
-
-Please ensure explanations are clear and suitable for elementary school students.
+
+def create_structured_analysis_prompt(question: MathQuestion, language: str, detail_level: str) -> str:
+    """构造要求JSON输出的提示词，字段与AIAnalysis一一对应"""
+    zh = language == "zh-CN"
+    level = get_detail_level(detail_level)
+    intro = DETAIL_INTROS.get(detail_level, DETAIL_INTROS["standard"])[0 if zh else 1]
+    fields = []
+    for section in level["sections"]:
+        description = SECTION_PROMPTS[section][0 if zh else 1].split("：" if zh else ": ", 1)[1]
+        if section == "solution_steps":
+            value = ('[{"step_number": 1, "description": "步骤说明", "calculation": "算式", "result": "结果", '
+                     '"explanation": "解释"}]' if zh else
+                     '[{"step_number": 1, "description": "...", "calculation": "...", "result": "...", '
+                     '"explanation": "..."}]')
+        elif section in LIST_SECTIONS:
+            value = '["..."]'
+        else:
+            value = '"..."'
+        separator = "," if section != level["sections"][-1] else ""
+        fields.append(f'  "{section}": {value}{separator}  // {description}')
+    header = "只输出一个JSON对象，包含以下字段：" if zh else "Output only a JSON object with these fields:"
+    return f"""
+{intro}
+
+{describe_question(question, zh)}
+
+{header}
+{{
+{chr(10).join(fields)}
+}}
+
+{describe_limits(level, zh)}
 """
-    
-    return prompt
 
-def parse_ai_response(ai_response: str, question: MathQuestion) -> AIAnalysis:
-    """解析AI响应并结构化"""
+# 章节标题关键词，按顺序匹配
+SECTION_KEYWORDS = [
+    ('problem_understanding', ['题目理解', 'problem understanding']),
+    ('solution_approach', ['解题思路', 'solution approach']),
+    ('solution_steps', ['解题步骤', 'solution steps']),
+    ('key_concepts', ['关键概念', 'key concepts']),
+    ('common_mistakes', ['常见错误', 'common mistakes']),
+    ('tips', ['解题技巧', 'solving tips']),
+    ('difficulty_analysis', ['难度分析', 'difficulty analysis']),
+    ('alternative_methods', ['其他解法', 'alternative methods']),
+]
+
+TEXT_SECTIONS = ['problem_understanding', 'solution_approach', 'difficulty_analysis']
+LIST_SECTIONS = ['key_concepts', 'common_mistakes', 'tips', 'alternative_methods']
+
+class IncrementalAnalysisParser:
+    """增量解析AI响应：按行处理文本，章节或解题步骤完成时立即产生事件"""
     
-    # 简单的文本解析，实际中可以使用更复杂的NLP技术
-    lines = ai_response.split('\n')
-    
-    analysis_data = {
-        "problem_understanding": "",
-        "solution_approach": "",
-        "solution_steps": [],
-        "key_concepts": [],
-        "common_mistakes": [],
-        "tips": [],
-        "difficulty_analysis": "",
-        "alternative_methods": []
-    }
+    def __init__(self):
+        self.buffer = ""
+        self.analysis_data: Dict[str, Any] = {
+            "problem_understanding": "",
+            "solution_approach": "",
+            "solution_steps": [],
+            "key_concepts": [],
+            "common_mistakes": [],
+            "tips": [],
+            "difficulty_analysis": "",
+            "alternative_methods": []
+        }
+        self.current_section: Optional[str] = None
+        self.step_counter = 1
+    
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """追加文本片段，返回已完成的章节和步骤事件"""
+        self.buffer += chunk
+        events: List[Dict[str, Any]] = []
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            events.extend(self._process_line(line))
+        return events
+    
+    def close(self) -> List[Dict[str, Any]]:
+        """处理剩余文本并结束当前章节"""
+        events = self._process_line(self.buffer)
+        self.buffer = ""
+        events.extend(self._finish_section())
+        return events
+    
+    def result(self) -> AIAnalysis:
+        """获取结构化的解析结果"""
+        data = dict(self.analysis_data)
+        for key in TEXT_SECTIONS:
+            data[key] = data[key].strip()
+        return AIAnalysis(**data)
+    
+    def _finish_section(self) -> List[Dict[str, Any]]:
+        section = self.current_section
+        if section is None:
+            return []
+        if section == 'solution_steps':
+            return self._finish_step()
+        value = self.analysis_data[section]
+        if section in TEXT_SECTIONS:
+            value = value.strip()
+        if not value:
+            return []
+        return [{"type": "section", "section": section, "content": value}]
     
-    current_section = None
-    step_counter = 1
+    def _finish_step(self) -> List[Dict[str, Any]]:
+        steps = self.analysis_data['solution_steps']
+        if not steps:
+            return []
+        return [{"type": "step", "step": steps[-1]}]
     
-    for line in lines:
+    def _process_line(self, line: str) -> List[Dict[str, Any]]:
         line = line.strip()
         if not line:
-            continue
-            
+            return []
+        
         # 检测章节标题
-        if any(keyword in line.lower() for keyword in ['题目理解', 'problem understanding']):
-            current_section = 'problem_understanding'
-            continue
-        elif any(keyword in line.lower() for keyword in ['解题思路', 'solution approach']):
-            current_section = 'solution_approach'
-            continue
-        elif any(keyword in line.lower() for keyword in ['解题步骤', 'solution steps']):
-            current_section = 'solution_steps'
-            continue
-        elif any(keyword in line.lower() for keyword in ['关键概念', 'key concepts']):
-            current_section = 'key_concepts'
-            continue
-        elif any(keyword in line.lower() for keyword in ['常见错误', 'common mistakes']):
-            current_section = 'common_mistakes'
-            continue
-        elif any(keyword in line.lower() for keyword in ['解题技巧', 'solving tips']):
-            current_section = 'tips'
-            continue
-        elif any(keyword in line.lower() for keyword in ['难度分析', 'difficulty analysis']):
-            current_section = 'difficulty_analysis'
-            continue
-        elif any(keyword in line.lower() for keyword in ['其他解法', 'alternative methods']):
-            current_section = 'alternative_methods'
-            continue
+        lowered = line.lower()
+        for section, keywords in SECTION_KEYWORDS:
+            if any(keyword in lowered for keyword in keywords):
+                events = self._finish_section()
+                self.current_section = section
+                return events
         
         # 根据当前章节处理内容
-        if current_section == 'problem_understanding':
-            analysis_data['problem_understanding'] += line + " "
-        elif current_section == 'solution_approach':
-            analysis_data['solution_approach'] += line + " "
+        events: List[Dict[str, Any]] = []
+        current_section = self.current_section
+        if current_section in TEXT_SECTIONS:
+            self.analysis_data[current_section] += line + " "
         elif current_section == 'solution_steps':
-            if line.startswith(('步骤', 'step', str(step_counter))):
-                analysis_data['solution_steps'].append(SolutionStep(
-                    step_number=step_counter,
+            if line.startswith(('步骤', 'step', str(self.step_counter))):
+                events = self._finish_step()
+                self.analysis_data['solution_steps'].append(SolutionStep(
+                    step_number=self.step_counter,
                     description=line,
                     calculation="",
                     result="",
                     explanation=""
                 ))
-                step_counter += 1
-            elif analysis_data['solution_steps']:
+                self.step_counter += 1
+            elif self.analysis_data['solution_steps']:
                 # 添加到最后一步的解释
-                last_step = analysis_data['solution_steps'][-1]
+                last_step = self.analysis_data['solution_steps'][-1]
                 last_step.explanation += line + " "
-        elif current_section in ['key_concepts', 'common_mistakes', 'tips', 'alternative_methods']:
+        elif current_section in LIST_SECTIONS:
             if line.startswith(('-', '*', '•')) or line[0].isdigit():
-                analysis_data[current_section].append(line.lstrip('-*•').strip())
-            elif analysis_data[current_section]:
-                analysis_data[current_section][-1] += " " + line
-        elif current_section == 'difficulty_analysis':
-            analysis_data['difficulty_analysis'] += line + " "
+                self.analysis_data[current_section].append(line.lstrip('-*•').strip())
+            elif self.analysis_data[current_section]:
+                self.analysis_data[current_section][-1] += " " + line
+        return events
+
+def as_text_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [str(value).strip()] if str(value).strip() else []
+
+def parse_structured_response(ai_response: str) -> Optional[AIAnalysis]:
+    """按JSON解析AI响应并映射到AIAnalysis，不是有效JSON时返回None"""
+    text = ai_response.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    
+    steps = []
+    for number, step in enumerate(data.get("solution_steps") or [], 1):
+        if not isinstance(step, dict):
+            step = {"description": str(step)}
+        optional = {key: str(step[key]) for key in ("calculation", "result", "explanation")
+                    if step.get(key) is not None}
+        try:
+            step_number = int(step.get("step_number") or number)
+        except (TypeError, ValueError):
+            step_number = number
+        steps.append(SolutionStep(step_number=step_number, description=str(step.get("description", "")), **optional))
+    
+    return AIAnalysis(
+        problem_understanding=str(data.get("problem_understanding") or ""),
+        solution_approach=str(data.get("solution_approach") or ""),
+        solution_steps=steps,
+        key_concepts=as_text_list(data.get("key_concepts")),
+        common_mistakes=as_text_list(data.get("common_mistakes")),
+        tips=as_text_list(data.get("tips")),
+        difficulty_analysis=str(data.get("difficulty_analysis") or ""),
+        alternative_methods=as_text_list(data.get("alternative_methods"))
+    )
+
+def parse_ai_response(ai_response: str, question: MathQuestion) -> AIAnalysis:
+    """解析AI响应并结构化"""
+    
+    # 简单的文本解析，实际中可以使用更复杂的NLP技术
+    parser = IncrementalAnalysisParser()
+    parser.feed(ai_response)
+    parser.close()
+    return parser.result()
+
+def get_analysis_cache_key(question: MathQuestion, language: str, detail_level: str, model: str) -> str:
+    """AI分析缓存键，包含题目字段、语言、详细程度、模型和提示词版本"""
+    return make_analysis_key(question.dict(), language, detail_level, model, PROMPT_VERSION)
+
+async def get_candidate_models() -> List[str]:
+    """可能作答的模型，按路由顺序排列；没有可用服务时为当前配置的模型"""
+    configs = await read_custom_ai_configs()
+    models: List[str] = []
+    for provider in ai_router.rank(get_ai_providers(configs)):
+        if provider["model"] not in models:
+            models.append(provider["model"])
+    return models or [get_effective_ai_config(configs)["model"]]
+
+def get_cached_analysis(question: MathQuestion, language: str, detail_level: str,
+                        models: List[str]) -> Optional[Dict[str, Any]]:
+    """依次查找各候选模型的缓存，切换或对冲后由其他服务作答并写入的结果也能命中"""
+    if analysis_cache is None:
+        return None
+    for model in models:
+        cached = analysis_cache.get(get_analysis_cache_key(question, language, detail_level, model))
+        if cached is not None:
+            return cached
+    return None
+
+def try_local_analysis(question: MathQuestion, language: str, detail_level: str,
+                       engine: Optional[str]) -> Optional[Dict[str, Any]]:
+    """基础运算类知识点使用本地规则引擎生成解答，不支持或指定使用大模型时返回None"""
+    if engine == "llm":
+        return None
+    data = explain_locally(question.dict(), language, detail_level)
+    return AIAnalysis(**data).dict() if data is not None else None
+
+LOCAL_ENGINE_UNSUPPORTED = "本地解答引擎不支持该题目，请使用大模型分析"
+
+def store_cached_analysis(cache_key: Optional[str], analysis: Dict[str, Any]) -> None:
+    if analysis_cache is not None and cache_key is not None:
+        analysis_cache.set(cache_key, analysis)
+
+# 进行中的AI分析（按缓存键合并相同请求），以及被合并的请求数
+inflight_analyses: Dict[str, "asyncio.Future"] = {}
+coalesced_analyses = 0
+
+async def call_ai_provider(provider: Dict[str, Any], question: MathQuestion, language: str,
+                           detail_level: str) -> Dict[str, Any]:
+    """调用指定服务并记录延迟和成功与否"""
+    started = time.monotonic()
+    result = await analyze_math_question_with_ai(question, language, detail_level, provider)
+    ai_router.record(provider["name"], time.monotonic() - started, "analysis" in result)
+    if "analysis" in result:
+        # 记录实际作答的模型，缓存按该模型写入
+        result["model"] = provider["model"]
+    return result
+
+async def analyze_with_failover(providers: List[Dict[str, Any]], question: MathQuestion, language: str,
+                                detail_level: str, last_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """按顺序尝试各服务，失败时切换到下一个"""
+    for provider in providers:
+        result = await call_ai_provider(provider, question, language, detail_level)
+        if "analysis" in result:
+            return result
+        last_result = result
+    return last_result or {"error": "没有可用的AI服务"}
+
+async def analyze_with_hedging(providers: List[Dict[str, Any]], question: MathQuestion, language: str,
+                               detail_level: str) -> Dict[str, Any]:
+    """对冲请求：首选服务超过其p95延迟仍未返回时，向次选服务再发一个请求，取先成功的结果"""
+    first = asyncio.ensure_future(call_ai_provider(providers[0], question, language, detail_level))
+    delay = ai_router.hedge_delay(providers[0]["name"], ai_routing_config.get("hedge_min_delay", 1.0))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        result = first.result()
+        if "analysis" in result:
+            return result
+        return await analyze_with_failover(providers[1:], question, language, detail_level, result)
+    
+    second = asyncio.ensure_future(call_ai_provider(providers[1], question, language, detail_level))
+    last_result = None
+    try:
+        for next_done in asyncio.as_completed([first, second]):
+            result = await next_done
+            if "analysis" in result:
+                return result
+            last_result = result
+    finally:
+        for future in (first, second):
+            if not future.done():
+                future.cancel()
+    return await analyze_with_failover(providers[2:], question, language, detail_level, last_result)
+
+async def analyze_routed(question: MathQuestion, language: str, detail_level: str) -> Dict[str, Any]:
+    """按健康度选择AI服务，失败时切换，可选对冲请求"""
+    providers = ai_router.rank(get_ai_providers(await read_custom_ai_configs()))
+    if not providers:
+        # 没有可用服务时沿用原有的错误提示
+        return await analyze_math_question_with_ai(question, language, detail_level)
+    if ai_routing_config.get("hedge", False) and len(providers) > 1:
+        return await analyze_with_hedging(providers, question, language, detail_level)
+    return await analyze_with_failover(providers, question, language, detail_level)
+
+async def analyze_with_retry(question: MathQuestion, language: str, detail_level: str) -> Dict[str, Any]:
+    """调用AI分析，遇到429/5xx/超时按指数退避加随机抖动重试，最多重试ai.max_retries次"""
+    max_retries = ai_config.get("max_retries", 3)
+    backoff_base = ai_retry_config.get("backoff_base", 0.5)
+    backoff_max = ai_retry_config.get("backoff_max", 8)
     
-    # 清理空白
-    for key in ['problem_understanding', 'solution_approach', 'difficulty_analysis']:
-        analysis_data[key] = analysis_data[key].strip()
+    attempt = 0
+    while True:
+        result = await analyze_routed(question, language, detail_level)
+        if "analysis" in result or not result.get("retryable") or attempt >= max_retries:
+            return result
+        # 服务端给出Retry-After时优先使用
+        delay = result.get("retry_after") or min(backoff_max, backoff_base * (2 ** attempt))
+        delay += random.uniform(0, delay / 2)
+        attempt += 1
+        print(f"AI分析失败，{delay:.2f}秒后进行第 {attempt} 次重试: {result.get('error')}")
+        await asyncio.sleep(delay)
+
+async def analyze_and_cache(question: MathQuestion, language: str, detail_level: str,
+                            cache_key: Optional[str]) -> Dict[str, Any]:
+    """调用AI分析并写入缓存，分析结果转换为dict"""
+    result = await analyze_with_retry(question, language, detail_level)
+    if "analysis" not in result:
+        return result
+    analysis = result["analysis"].dict()
+    if cache_key is not None and result.get("model"):
+        # 路由可能由其他服务或模型（如自定义配置、本地模型）给出结果，不能写到当前配置模型的缓存键下
+        cache_key = get_analysis_cache_key(question, language, detail_level, result["model"])
+    store_cached_analysis(cache_key, analysis)
+    return {"analysis": analysis}
+
+def get_or_start_analysis(question: MathQuestion, language: str, detail_level: str,
+                          cache_key: str) -> "asyncio.Future":
+    """单飞合并：相同题目/语言/详细程度的并发请求共用一次上游调用"""
+    global coalesced_analyses
+    future = inflight_analyses.get(cache_key)
+    if future is not None:
+        coalesced_analyses += 1
+        return future
     
-    return AIAnalysis(**analysis_data)
+    future = asyncio.ensure_future(analyze_and_cache(question, language, detail_level, cache_key))
+    inflight_analyses[cache_key] = future
+    future.add_done_callback(lambda _: inflight_analyses.pop(cache_key, None))
+    return future
 
 # 异步执行AI分析任务
-async def run_ai_analysis_task(task_id: str, question: MathQuestion, language: str, detail_level: str):
-    ai_tasks[task_id]["status"] = "running"
-    ai_tasks[task_id]["started_at"] = datetime.now().isoformat()
+async def run_ai_analysis_task(task_id: str, question: MathQuestion, language: str, detail_level: str,
+                               cache_key: str):
+    await ai_tasks.aupdate(task_id, status="running", started_at=time.time())
     
     try:
-        result = await analyze_math_question_with_ai(question, language, detail_level)
-        ai_tasks[task_id].update(result)
-        ai_tasks[task_id]["status"] = "completed" if "analysis" in result else "failed"
-        ai_tasks[task_id]["completed_at"] = datetime.now().isoformat()
+        # shield避免单个调用方被取消时影响共享的上游调用
+        result = await asyncio.shield(get_or_start_analysis(question, language, detail_level, cache_key))
+        await ai_tasks.aupdate(
+            task_id,
+            analysis=result.get("analysis"),
+            error=result.get("error"),
+            status="completed" if "analysis" in result else "failed"
+        )
     except Exception as e:
-        ai_tasks[task_id]["error"] = str(e)
-        ai_tasks[task_id]["status"] = "failed"
-        ai_tasks[task_id]["completed_at"] = datetime.now().isoformat()
-
-# 安全检查函数
-def is_code_safe(code: str) -> bool:
-    """检查代码是否安全"""
-    # 禁止的模块和函数
-    forbidden_patterns = [
-        'import os', 'import sys', 'import subprocess', 'import socket',
-        'os.', 'sys.', 'subprocess.', 'socket.',
-        '__', 'exec', 'eval', 'compile', 'open', 'file',
-        'import shutil', 'import pickle', 'import json'
-    ]
-    
-    for pattern in forbidden_patterns:
-        if pattern in code:
-            return False
-    return True
+        await ai_tasks.aupdate(task_id, error=str(e), status="failed")
+
+# 计算引擎
+ENGINE_FUNCTIONS = {
+    "fraction": evaluate_fraction_engine,
+    "sympy": evaluate_with_sympy,
+    "eval": evaluate_with_eval,
+}
+
+def get_engine_order() -> List[str]:
+    """按mcp_server.engines中的优先级返回启用的计算引擎"""
+    engines = mcp_config.get("engines") or [{"name": "sympy", "priority": 1}, {"name": "eval", "priority": 2}]
+    enabled = [engine for engine in engines if engine.get("enabled", True) and engine.get("name") in ENGINE_FUNCTIONS]
+    return [engine["name"] for engine in sorted(enabled, key=lambda engine: engine.get("priority", 0))]
+
+engine_order = get_engine_order()
+
+# 计算沙箱：sympy和eval引擎在带CPU/内存上限的独立进程中计算，超时可以终止
+sandbox_pool = create_sandbox_pool(mcp_config.get("sandbox"))
+
+# 表达式校验：只接受算术语法，计算前估算开销，拒绝或只交给近似计算的引擎
+expression_guard = create_expression_guard(mcp_config.get("security"))
+
+# 规范化表达式的计算结果缓存
+result_cache_config = mcp_config.get("result_cache", {})
+result_cache = LRUCache(result_cache_config.get("max_size", 10000) if result_cache_config.get("enabled", True) else 0)
+
+# 批量批改配置
+grading_config = mcp_config.get("grading", {})
 
 # 执行代码的函数
 def execute_code_safely(code: str, timeout: int = 10) -> Dict[str, Any]:
-    if not is_code_safe(code):
-        return {"error": "代码包含禁止的操作"}
+    # 清理代码，移除可能的等号和空格，统一运算符写法；规范化结果同时作为缓存键
+    clean_code = prepare_expression(code.replace('=', ''))
+    cached = result_cache.get(clean_code)
+    if cached is not None:
+        return dict(cached)
     
     try:
-        # 清理代码，移除可能的等号和空格
-        clean_code = code.replace('=', '').strip()
-        
-        # 尝试使用sympy解析和计算表达式
+        engines = expression_guard.route(clean_code, engine_order)
+    except ExpressionRejected as e:
+        return {"error": str(e)}
+    
+    try:
+        result = evaluate_expression(clean_code, timeout, engines)
+    except SandboxError as e:
+        # 超时和计算进程退出可能与当时的负载有关，不缓存
+        return {"error": str(e)}
+    result_cache.set(clean_code, result)
+    return dict(result)
+
+def evaluate_expression(clean_code: str, timeout: float = 10, engines: Optional[List[str]] = None) -> Dict[str, Any]:
+    """依次尝试各计算引擎计算规范化后的表达式，沙箱超时或计算进程退出时抛出SandboxError"""
+    last_error: Optional[Exception] = None
+    started = time.perf_counter()
+    
+    # 依次尝试各计算引擎，快速引擎无法处理时回退到后续引擎
+    for engine_name in engine_order if engines is None else engines:
         try:
-            # 使用sympy解析表达式
-            expr = parse_expr(clean_code, evaluate=False)
-            # 计算表达式
-            result = expr.evalf()
-            return {"result": str(result)}
-        except Exception as sympy_error:
-            # 如果sympy解析失败，尝试使用eval计算
-            try:
-                result = eval(clean_code, {"__builtins__": {}}, {"sp": sp})
-                return {"result": str(result)}
-            except Exception as eval_error:
-                # 如果eval也失败，返回原始表达式计算
-                try:
-                    # 处理分数运算
-                    if '/' in clean_code and 'Fraction' not in clean_code:
-                        # 简单的分数处理
-                        parts = clean_code.replace(' ', '').replace('+', ' + ').replace('-', ' - ').replace('*', ' * ').replace('/', ' / ').split()
-                        # 这里可以添加更复杂的分数处理逻辑
-                        pass
-                    result = eval(clean_code)
-                    return {"result": str(result)}
-                except Exception as final_error:
-                    return {"error": f"执行错误: {str(final_error)}"}
-    except Exception as e:
-        return {"error": f"执行错误: {str(e)}"}
+            if sandbox_pool is not None and engine_name in SANDBOX_ENGINES:
+                result = sandbox_pool.evaluate(engine_name, clean_code, timeout)
+            else:
+                result = ENGINE_FUNCTIONS[engine_name](clean_code)
+            result["engine"] = engine_name
+            evaluation_duration.observe(time.perf_counter() - started, engine=engine_name)
+            return result
+        except ZeroDivisionError as e:
+            evaluation_duration.observe(time.perf_counter() - started, engine="failed")
+            return {"error": f"执行错误: {str(e)}"}
+        except SandboxError:
+            evaluation_duration.observe(time.perf_counter() - started, engine="failed")
+            raise
+        except Exception as e:
+            evaluation_fallbacks.inc(engine=engine_name)
+            last_error = e
+    
+    evaluation_duration.observe(time.perf_counter() - started, engine="failed")
+    return {"error": f"执行错误: {str(last_error) if last_error else '没有可用的计算引擎'}"}
 
 # 异步执行任务
 def run_task(task_id: str, code: str, timeout: int):
-    tasks[task_id]["status"] = "running"
+    tasks.update(task_id, status="running", started_at=time.time())
     
-    # 在新线程中执行代码
+    # 在调度器工作线程中执行代码
     result = execute_code_safely(code, timeout)
     
-    tasks[task_id].update(result)
-    tasks[task_id]["status"] = "completed" if "result" in result else "failed"
+    # 已被调度器判定超时或已被清理的任务不再覆盖结果
+    record = tasks.get(task_id)
+    if record is None or record.status != "running":
+        return
+    tasks.update(
+        task_id,
+        result=result.get("result"),
+        error=result.get("error"),
+        status="completed" if "result" in result else "failed"
+    )
+
+def mark_task_timeout(task_id: str, timeout: int):
+    """调度器超时回调：将任务标记为失败"""
+    tasks.update(task_id, error=f"执行超时 ({timeout}秒)", status="failed")
+
+def schedule_or_reject(fn, *args, lane: Optional[str] = None, timeout: Optional[float] = None, on_timeout=None):
+    """向调度器提交任务，队列已满时返回429"""
+    try:
+        return scheduler.submit(fn, *args, lane=lane, timeout=timeout, on_timeout=on_timeout)
+    except SchedulerFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="服务器繁忙，执行队列已满，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+# 答案比对
+def parse_answer_value(value: str) -> Optional[Fraction]:
+    """将答案字符串解析为精确数值，支持整数、小数、分数和百分数"""
+    text = value.strip().replace(' ', '')
+    if not text:
+        return None
+    try:
+        if text.endswith('%'):
+            return Fraction(text[:-1]) / 100
+        return Fraction(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def answers_match(result: str, expected: str, tolerance: float = 1e-6) -> bool:
+    """比较计算结果与预期答案是否一致"""
+    result_value = parse_answer_value(result)
+    expected_value = parse_answer_value(expected)
+    if result_value is None or expected_value is None:
+        return result.strip() == expected.strip()
+    return abs(float(result_value - expected_value)) <= tolerance
+
+def evaluate_batch_item(index: int, item: BatchExecutionItem, timeout: int, tolerance: float) -> BatchItemResult:
+    """计算单个批量题目并与预期答案比对"""
+    outcome = execute_code_safely(item.code, timeout)
+    item_result = BatchItemResult(
+        index=index,
+        code=item.code,
+        result=outcome.get("result"),
+        error=outcome.get("error"),
+        expected=item.expected
+    )
+    if item.expected is not None:
+        item_result.mismatch = item_result.result is None or not answers_match(item_result.result, item.expected, tolerance)
+    return item_result
+
+def run_batch(request: BatchExecutionRequest, task_id: Optional[str] = None,
+              cancelled: Optional[threading.Event] = None) -> List[BatchItemResult]:
+    """在一次调用中依次计算整份练习题，task_id不为空时同步更新任务进度；cancelled被设置后不再计算剩余题目"""
+    timeout = request.timeout or 10
+    tolerance = request.tolerance if request.tolerance is not None else 1e-6
+    results: List[BatchItemResult] = []
+    mismatches = failures = 0
+    
+    for index, item in enumerate(request.items):
+        if cancelled is not None and cancelled.is_set():
+            break
+        item_result = evaluate_batch_item(index, item, timeout, tolerance)
+        results.append(item_result)
+        mismatches += 1 if item_result.mismatch else 0
+        failures += 1 if item_result.error else 0
+        if task_id is not None:
+            tasks.update(task_id, completed=len(results), mismatches=mismatches, failures=failures)
+    
+    return results
+
+def run_batch_task(task_id: str, request: BatchExecutionRequest):
+    tasks.update(task_id, status="running", started_at=time.time())
+    try:
+        results = run_batch(request, task_id)
+        tasks.update(task_id, result=[item.dict() for item in results], status="completed")
+    except Exception as e:
+        tasks.update(task_id, error=f"批量执行错误: {str(e)}", status="failed")
+
+def load_answer_sheet(request: GradeRequest) -> Tuple[List[str], Any]:
+    """读取JSON、CSV或Arrow格式的答题数据，返回学生列表和答案矩阵"""
+    sources = [name for name in ("answers", "answers_csv", "answers_arrow") if getattr(request, name) is not None]
+    if len(sources) != 1:
+        raise AnswerSheetError("answers、answers_csv、answers_arrow 需要且只能提供一个")
+    if request.answers_csv is not None:
+        students, rows = read_answer_csv(request.answers_csv)
+    elif request.answers_arrow is not None:
+        students, rows = read_answer_arrow(request.answers_arrow)
+    else:
+        rows = request.answers
+        students = request.students or [str(index + 1) for index in range(len(rows))]
+    if len(students) != len(rows):
+        raise AnswerSheetError(f"学生数量 {len(students)} 与答案行数 {len(rows)} 不一致")
+    if len(rows) * len(request.questions) > grading_config.get("max_cells", 1000000):
+        raise AnswerSheetError(f"答案数量超过上限 {grading_config.get('max_cells', 1000000)}")
+    return students, to_answer_matrix(rows, len(request.questions))
+
+def compute_correct_answer(question: MathQuestion) -> Tuple[Optional[Fraction], Optional[str]]:
+    """计算题目的正确答案，表达式无法计算时使用题目自带的答案"""
+    outcome = execute_code_safely(question.expression)
+    if "error" not in outcome:
+        value = parse_answer_value(outcome.get("exact") or outcome["result"])
+        if value is not None:
+            return value, None
+    if question.answer is not None:
+        return Fraction(str(question.answer)), None
+    return None, outcome.get("error", "无法解析计算结果")
+
+def grade_answer_sheet(request: GradeRequest) -> Dict[str, Any]:
+    """每道题只计算一次正确答案，再整体比对答案矩阵"""
+    start = time.perf_counter()
+    students, matrix = load_answer_sheet(request)
+    
+    correct: List[Fraction] = []
+    graded: List[int] = []
+    failures = []
+    for index, question in enumerate(request.questions):
+        value, error = compute_correct_answer(question)
+        if value is None:
+            failures.append({"index": index, "expression": question.expression, "error": error})
+        else:
+            correct.append(value)
+            graded.append(index)
+    
+    # 无法计算的题目不计分
+    ok, answered = grade_matrix(matrix[:, graded], correct, request.tolerance,
+                                request.min_decimal_places, request.require_simplest)
+    questions = [request.questions[index] for index in graded]
+    summary = summarize_grades(ok, answered, students, [question.expression for question in questions],
+                               correct, [question.knowledge_point for question in questions])
+    # 汇总中的题目序号换回原始序号
+    for item in summary["questions"]:
+        item["index"] = graded[item["index"]]
+    for student in summary["students"]:
+        student["wrong"] = [graded[column] for column in student["wrong"]]
+    
+    summary["failures"] = failures
+    if request.include_matrix:
+        summary["matrix"] = ok.tolist()
+    summary["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return summary
 
 @app.post("/execute", response_model=TaskResult)
 async def submit_code(request: CodeExecutionRequest):
     task_id = str(uuid.uuid4())
     
     # 初始化任务
-    tasks[task_id] = {
-        "status": "submitted",
-        "result": None,
-        "error": None
-    }
+    await tasks.acreate(task_id)
     
-    # 在后台线程中执行任务
-    thread = threading.Thread(target=run_task, args=(task_id, request.code, request.timeout))
-    thread.start()
+    timeout = request.timeout or 10
+    try:
+        schedule_or_reject(
+            run_task, task_id, request.code, timeout,
+            lane=request.priority,
+            timeout=timeout,
+            on_timeout=lambda: mark_task_timeout(task_id, timeout)
+        )
+    except HTTPException:
+        await tasks.adelete(task_id)
+        raise
     
     return TaskResult(task_id=task_id, status="submitted")
 
+@app.post("/execute/batch", response_model=BatchExecutionResult)
+async def submit_batch(request: BatchExecutionRequest):
+    """批量验证整份练习题，wait=True时同步返回，否则返回批量任务ID"""
+    task_id = str(uuid.uuid4())
+    total = len(request.items)
+    
+    if request.wait:
+        # timeout限制每道题的计算时间，整批的等待时间按题目数放大；超时后通知工作线程不再计算剩余题目
+        deadline = (request.timeout or 10) * max(total, 1)
+        cancelled = threading.Event()
+        job = schedule_or_reject(run_batch, request, None, cancelled, lane=request.priority, timeout=deadline,
+                                 on_timeout=cancelled.set)
+        try:
+            results = await asyncio.wait_for(asyncio.wrap_future(job.future), deadline)
+        except (asyncio.TimeoutError, TimeoutError):
+            cancelled.set()
+            return BatchExecutionResult(task_id=task_id, status="timeout", total=total,
+                                        error=f"执行超时 ({deadline}秒)，大批量请使用 wait=false 提交")
+        return BatchExecutionResult(
+            task_id=task_id,
+            status="completed",
+            total=total,
+            completed=total,
+            mismatches=sum(1 for item in results if item.mismatch),
+            failures=sum(1 for item in results if item.error),
+            results=results
+        )
+    
+    await tasks.acreate(task_id, total=total, completed=0, mismatches=0, failures=0)
+    
+    # 整批只占用一个调度器工作线程
+    try:
+        schedule_or_reject(run_batch_task, task_id, request, lane=request.priority)
+    except HTTPException:
+        await tasks.adelete(task_id)
+        raise
+    
+    return BatchExecutionResult(task_id=task_id, status="submitted", total=total)
+
+@app.post("/grade")
+async def grade_answers(request: GradeRequest):
+    """批量批改全班答题卡，返回每名学生的得分和各知识点的错误率"""
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="题目列表不能为空")
+    job = schedule_or_reject(grade_answer_sheet, request, lane="bulk")
+    try:
+        summary = await asyncio.wrap_future(job.future)
+    except AnswerSheetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(summary)
+
+@app.get("/execute/batch/{task_id}", response_model=BatchExecutionResult)
+async def get_batch_result(task_id: str, wait: float = 0):
+    """查询批量验证任务的进度和结果，wait>0时长轮询等待任务结束"""
+    task = await wait_for_task(tasks, task_id, wait)
+    if task is None or task.total is None:
+        raise HTTPException(status_code=404, detail="批量任务不存在")
+    
+    return BatchExecutionResult(
+        task_id=task_id,
+        status=task.status,
+        total=task.total,
+        completed=task.completed,
+        mismatches=task.mismatches,
+        failures=task.failures,
+        results=task.result
+    )
+
 @app.get("/result/{task_id}", response_model=TaskResult)
-async def get_result(task_id: str):
-    if task_id not in tasks:
+async def get_result(task_id: str, wait: float = 0):
+    """查询执行结果，wait>0时长轮询等待任务结束（最长60秒）"""
+    task = await wait_for_task(tasks, task_id, wait)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    task = tasks[task_id]
     return TaskResult(
         task_id=task_id,
-        status=task["status"],
-        result=task.get("result"),
-        error=task.get("error")
+        status=task.status,
+        result=task.result,
+        error=task.error
+    )
+
+@app.get("/events")
+async def subscribe_task_events(task_ids: Optional[str] = None, ai_task_ids: Optional[str] = None):
+    """SSE推送：一个连接订阅多个任务，状态变化时立即推送，全部结束后关闭"""
+    subscriptions = []
+    for store, raw_ids in ((tasks, task_ids), (ai_tasks, ai_task_ids)):
+        ids = [task_id for task_id in (raw_ids or "").split(",") if task_id]
+        if ids:
+            subscriptions.append((store, ids))
+    if not subscriptions:
+        raise HTTPException(status_code=400, detail="请至少指定一个任务ID")
+    
+    return StreamingResponse(
+        stream_task_events(subscriptions),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """获取计算结果缓存和AI分析缓存的命中统计"""
+    return {
+        "result_cache": result_cache.stats(),
+        "analysis_cache": analysis_cache.stats() if analysis_cache is not None else None,
+        "ai_single_flight": {"inflight": len(inflight_analyses), "coalesced": coalesced_analyses}
+    }
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """获取执行调度器的队列深度、等待时间等运行状态"""
+    return scheduler.stats()
+
+@app.get("/sandbox/stats")
+async def get_sandbox_stats():
+    """获取计算沙箱的计算进程数、超时和重建次数"""
+    if sandbox_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **sandbox_pool.stats()}
+
+def collect_scheduler_metric(field: str):
+    return lambda: [({}, scheduler.stats()[field])]
+
+def collect_cache_metric(field: str):
+    """计算结果缓存和AI分析缓存（内存LRU）的统计"""
+    def collect():
+        caches = [("result", result_cache.stats())]
+        if analysis_cache is not None:
+            caches.append(("analysis", analysis_cache.stats()))
+        return [({"cache": name}, stats[field]) for name, stats in caches]
+    return collect
+
+metrics.gauge("mcp_threads", "进程内的线程数", lambda: [({}, threading.active_count())])
+metrics.gauge("mcp_scheduler_workers", "执行调度器的工作线程数", collect_scheduler_metric("max_workers"))
+metrics.gauge("mcp_scheduler_busy_workers", "正在执行任务的工作线程数", collect_scheduler_metric("busy_workers"))
+metrics.gauge("mcp_scheduler_queue_depth", "各车道排队中的任务数",
+              lambda: [({"lane": lane}, depth) for lane, depth in scheduler.stats()["queue_depth_by_lane"].items()],
+              ["lane"])
+for scheduler_field, description in (("submitted", "提交"), ("completed", "完成"), ("rejected", "因队列已满被拒绝"),
+                                     ("timed_out", "超时")):
+    metrics.gauge(f"mcp_scheduler_{scheduler_field}_total", f"调度器累计{description}的任务数",
+                  collect_scheduler_metric(scheduler_field), kind="counter")
+metrics.gauge("mcp_task_store_size", "任务存储中的记录数",
+              lambda: [({"store": "tasks"}, len(tasks)), ({"store": "ai_tasks"}, len(ai_tasks))], ["store"])
+metrics.gauge("mcp_cache_size", "缓存条目数", collect_cache_metric("size"), ["cache"])
+metrics.gauge("mcp_cache_hits_total", "缓存命中次数", collect_cache_metric("hits"), ["cache"], kind="counter")
+metrics.gauge("mcp_cache_misses_total", "缓存未命中次数", collect_cache_metric("misses"), ["cache"], kind="counter")
+metrics.gauge("mcp_cache_hit_ratio", "缓存命中率", collect_cache_metric("hit_ratio"), ["cache"])
+metrics.gauge("mcp_analysis_cache_disk_hits_total", "内存未命中、从SQLite读取的AI分析缓存次数",
+              lambda: [({}, analysis_cache.disk_hits)] if analysis_cache is not None else [], kind="counter")
+metrics.gauge("mcp_ai_inflight_analyses", "进行中的AI分析（单飞合并后）", lambda: [({}, len(inflight_analyses))])
+metrics.gauge("mcp_ai_coalesced_analyses_total", "合并到进行中分析的重复请求数",
+              lambda: [({}, coalesced_analyses)], kind="counter")
+
+metrics.gauge("mcp_ai_provider_tripped", "AI服务是否因连续失败处于降级冷却期",
+              lambda: [({"provider": name}, int(stats["tripped"])) for name, stats in ai_router.stats().items()],
+              ["provider"])
+metrics.gauge("mcp_expression_guard_total", "表达式校验结果：accepted正常计算、approximated只做近似计算、rejected拒绝",
+              lambda: [({"decision": "accepted"}, expression_guard.accepted),
+                       ({"decision": "approximated"}, expression_guard.approximated),
+                       ({"decision": "rejected"}, expression_guard.rejected)],
+              ["decision"], kind="counter")
+metrics.gauge("mcp_sandbox_workers", "计算沙箱的计算进程数",
+              lambda: [({"state": "live"}, sandbox_pool.stats()["workers"]), ({"state": "idle"}, sandbox_pool.stats()["idle"])]
+              if sandbox_pool is not None else [], ["state"])
+metrics.gauge("mcp_sandbox_events_total", "计算沙箱的计算、超时、异常退出和重建次数",
+              lambda: [({"event": name}, value) for name, value in sandbox_pool.counters.items()]
+              if sandbox_pool is not None else [], ["event"], kind="counter")
+metrics.gauge("mcp_config_reloads_total", "配置文件热加载次数",
+              lambda: [({"result": "success"}, config_watcher.reloads), ({"result": "failure"}, config_watcher.failures)],
+              ["result"], kind="counter")
+metrics.gauge("mcp_startup_seconds", "服务启动各阶段耗时",
+              lambda: [({"phase": phase}, round(elapsed / 1000, 4)) for phase, elapsed in startup_timings.items()], ["phase"])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """以Prometheus文本格式导出运行指标"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # AI解答相关端点
 @app.post("/ai/analyze", response_model=AIAnalysisResult)
 async def submit_ai_analysis(request: AIAnalysisRequest):
-    """提交AI分析任务"""
+    """提交AI分析任务，命中缓存时直接返回已完成的结果"""
     task_id = str(uuid.uuid4())
+    language = request.language or "zh-CN"
+    detail_level = request.detail_level or "standard"
+    
+    # 基础运算题由本地引擎直接生成解答
+    local_analysis = try_local_analysis(request.question, language, detail_level, request.engine)
+    if local_analysis is not None:
+        await ai_tasks.acreate(task_id, status="completed", analysis=local_analysis, completed_at=time.time())
+        return AIAnalysisResult(task_id=task_id, status="completed", analysis=local_analysis)
+    if request.engine == "local":
+        await ai_tasks.acreate(task_id, status="failed", error=LOCAL_ENGINE_UNSUPPORTED, completed_at=time.time())
+        return AIAnalysisResult(task_id=task_id, status="failed", error=LOCAL_ENGINE_UNSUPPORTED)
+    
+    # 单飞合并按排名第一的服务将要使用的模型，查找缓存时检查全部候选模型
+    models = await get_candidate_models()
+    cache_key = get_analysis_cache_key(request.question, language, detail_level, models[0])
+    cached = get_cached_analysis(request.question, language, detail_level, models)
+    if cached is not None:
+        await ai_tasks.acreate(task_id, status="completed", analysis=cached, completed_at=time.time())
+        return AIAnalysisResult(task_id=task_id, status="completed", analysis=cached)
     
     # 初始化AI分析任务
-    ai_tasks[task_id] = {
-        "status": "submitted",
-        "analysis": None,
-        "error": None,
-        "submitted_at": datetime.now().isoformat()
-    }
+    await ai_tasks.acreate(task_id)
     
     # 在后台异步执行AI分析
     asyncio.create_task(run_ai_analysis_task(
         task_id, 
         request.question, 
-        request.language or "zh-CN", 
-        request.detail_level or "standard"
+        language, 
+        detail_level,
+        cache_key
     ))
     
     return AIAnalysisResult(task_id=task_id, status="submitted")
 
+async def run_ai_batch_item(batch_id: str, task_id: str, question: MathQuestion, language: str,
+                            detail_level: str, cache_key: str, progress: Dict[str, int]):
+    """在并发上限内执行批量中的单个题目，并更新批量进度"""
+    async with ai_batch_semaphore:
+        await run_ai_analysis_task(task_id, question, language, detail_level, cache_key)
+    
+    task = await ai_tasks.aget(task_id)
+    progress["completed"] += 1
+    if task is None or task.status != "completed":
+        progress["failures"] += 1
+    await ai_tasks.aupdate(batch_id, completed=progress["completed"], failures=progress["failures"])
+
+async def run_ai_batch(batch_id: str, items: List[Any], language: str, detail_level: str):
+    """并发执行批量AI分析，全部结束后将批量任务标记为完成"""
+    await ai_tasks.aupdate(batch_id, status="running", started_at=time.time())
+    progress = {"completed": 0, "failures": 0}
+    
+    # 本地引擎解答或命中缓存的题目直接计入进度
+    pending = []
+    for task_id, question, cache_key in items:
+        task = await ai_tasks.aget(task_id)
+        if task is not None and task.is_terminal:
+            progress["completed"] += 1
+            if task.status != "completed":
+                progress["failures"] += 1
+        else:
+            pending.append(run_ai_batch_item(batch_id, task_id, question, language, detail_level, cache_key, progress))
+    await ai_tasks.aupdate(batch_id, completed=progress["completed"], failures=progress["failures"])
+    
+    await asyncio.gather(*pending, return_exceptions=True)
+    await ai_tasks.aupdate(batch_id, status="completed")
+
+@app.post("/ai/analyze/batch", response_model=AIBatchAnalysisResult)
+async def submit_ai_batch_analysis(request: AIBatchAnalysisRequest):
+    """批量提交整份练习题的AI分析，在并发上限内执行并统一汇报进度"""
+    max_questions = ai_batch_config.get("max_questions", 500)
+    if len(request.questions) > max_questions:
+        raise HTTPException(status_code=400, detail=f"单次批量最多 {max_questions} 道题")
+    
+    batch_id = str(uuid.uuid4())
+    language = request.language or "zh-CN"
+    detail_level = request.detail_level or "standard"
+    
+    # 每道题一个AI任务，可单独查询；批量任务的result保存子任务ID列表
+    items = []
+    models = await get_candidate_models()
+    for question in request.questions:
+        task_id = str(uuid.uuid4())
+        cache_key = get_analysis_cache_key(question, language, detail_level, models[0])
+        ready = try_local_analysis(question, language, detail_level, request.engine)
+        if ready is None and request.engine != "local":
+            ready = get_cached_analysis(question, language, detail_level, models)
+        if ready is not None:
+            await ai_tasks.acreate(task_id, status="completed", analysis=ready, completed_at=time.time())
+        elif request.engine == "local":
+            await ai_tasks.acreate(task_id, status="failed", error=LOCAL_ENGINE_UNSUPPORTED, completed_at=time.time())
+        else:
+            await ai_tasks.acreate(task_id)
+        items.append((task_id, question, cache_key))
+    
+    total = len(items)
+    await ai_tasks.acreate(batch_id, total=total, completed=0, failures=0, result=[task_id for task_id, _, _ in items])
+    asyncio.create_task(run_ai_batch(batch_id, items, language, detail_level))
+    
+    return AIBatchAnalysisResult(batch_id=batch_id, status="submitted", total=total)
+
+@app.get("/ai/analyze/batch/{batch_id}", response_model=AIBatchAnalysisResult)
+async def get_ai_batch_analysis(batch_id: str, include_results: bool = True, wait: float = 0):
+    """查询批量AI分析的进度，include_results=True时返回每道题的结果"""
+    batch = await wait_for_task(ai_tasks, batch_id, wait)
+    if batch is None or batch.total is None:
+        raise HTTPException(status_code=404, detail="批量AI分析任务不存在")
+    
+    items = None
+    if include_results:
+        items = []
+        for index, task_id in enumerate(batch.result or []):
+            task = await ai_tasks.aget(task_id)
+            items.append(AIBatchItem(
+                index=index,
+                task_id=task_id,
+                status=task.status if task is not None else "expired",
+                analysis=task.analysis if task is not None else None,
+                error=task.error if task is not None else None
+            ))
+    
+    return AIBatchAnalysisResult(
+        batch_id=batch_id,
+        status=batch.status,
+        total=batch.total,
+        completed=batch.completed,
+        failures=batch.failures,
+        items=items
+    )
+
+async def run_ai_analysis_stream(task_id: str, request: AIAnalysisRequest) -> AsyncIterator[str]:
+    """将流式分析事件转换为SSE，并同步写入AI任务结果"""
+    language = request.language or "zh-CN"
+    detail_level = request.detail_level or "standard"
+    
+    local_analysis = try_local_analysis(request.question, language, detail_level, request.engine)
+    if local_analysis is not None:
+        await ai_tasks.aupdate(task_id, analysis=local_analysis, status="completed")
+        yield format_sse("task", {"task_id": task_id, "status": "completed"})
+        yield format_sse("complete", {"task_id": task_id, "analysis": local_analysis, "engine": "local"})
+        return
+    if request.engine == "local":
+        await ai_tasks.aupdate(task_id, error=LOCAL_ENGINE_UNSUPPORTED, status="failed")
+        yield format_sse("error", {"task_id": task_id, "error": LOCAL_ENGINE_UNSUPPORTED})
+        return
+    
+    cached = get_cached_analysis(request.question, language, detail_level, await get_candidate_models())
+    if cached is not None:
+        await ai_tasks.aupdate(task_id, analysis=cached, status="completed")
+        yield format_sse("task", {"task_id": task_id, "status": "completed"})
+        yield format_sse("complete", {"task_id": task_id, "analysis": cached, "cached": True})
+        return
+    
+    await ai_tasks.aupdate(task_id, status="running", started_at=time.time())
+    yield format_sse("task", {"task_id": task_id, "status": "running"})
+    
+    try:
+        async for event in stream_math_question_analysis(request.question, language, detail_level):
+            event_type = event["type"]
+            if event_type == "complete":
+                analysis = event["analysis"].dict()
+                await ai_tasks.aupdate(task_id, analysis=analysis, status="completed")
+                # 流式请求发往路由排名第一的服务，按实际作答的模型写入缓存
+                store_cached_analysis(get_analysis_cache_key(request.question, language, detail_level,
+                                                             event["model"]), analysis)
+            elif event_type == "error":
+                await ai_tasks.aupdate(task_id, error=event["error"], status="failed")
+            yield format_sse(event_type, {"task_id": task_id, **{k: v for k, v in event.items() if k != "type"}})
+    finally:
+        # 客户端提前断开时任务标记为失败
+        task = await ai_tasks.aget(task_id)
+        if task is not None and not task.is_terminal:
+            await ai_tasks.aupdate(task_id, error="流式分析已中断", status="failed")
+
+@app.post("/ai/analyze/stream")
+async def stream_ai_analysis(request: AIAnalysisRequest):
+    """流式AI分析：通过SSE逐个推送已完成的章节（section）和解题步骤（step）"""
+    task_id = str(uuid.uuid4())
+    await ai_tasks.acreate(task_id)
+    
+    return StreamingResponse(
+        run_ai_analysis_stream(task_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/ai/result/{task_id}", response_model=AIAnalysisResult)
-async def get_ai_analysis_result(task_id: str):
-    """获取AI分析结果"""
-    if task_id not in ai_tasks:
+async def get_ai_analysis_result(task_id: str, wait: float = 0):
+    """获取AI分析结果，wait>0时长轮询等待任务结束（最长60秒）"""
+    task = await wait_for_task(ai_tasks, task_id, wait)
+    if task is None:
         raise HTTPException(status_code=404, detail="AI分析任务不存在")
     
-    task = ai_tasks[task_id]
     return AIAnalysisResult(
         task_id=task_id,
-        status=task["status"],
-        analysis=task.get("analysis"),
-        error=task.get("error")
+        status=task.status,
+        analysis=task.analysis,
+        error=task.error
     )
 
 @app.get("/ai/config")
 async def get_ai_config():
     """获取AI配置信息（不返回API Key）"""
-    effective_config = get_effective_ai_config()
+    effective_config = get_effective_ai_config(await read_custom_ai_configs())
     return {
         "api_base": effective_config["api_base"],
         "model": effective_config["model"],
@@ -491,6 +1668,14 @@ async def get_ai_config():
         "timeout": effective_config["timeout"]
     }
 
+@app.get("/ai/router/stats")
+async def get_ai_router_stats():
+    """获取各AI服务的滚动延迟、错误率和路由顺序"""
+    return {
+        "order": [provider["name"] for provider in ai_router.rank(get_ai_providers(await read_custom_ai_configs()))],
+        "providers": ai_router.stats()
+    }
+
 @app.post("/ai/config")
 async def update_ai_config(config: dict):
     """更新AI配置"""
@@ -519,14 +1704,14 @@ class CustomAIConfig(BaseModel):
 @app.post("/ai/custom-config")
 async def save_custom_ai_config(config: CustomAIConfig):
     """保存用户自定义AI配置"""
-    custom_ai_configs[config.id] = config.dict()
+    await call_state_backend(custom_ai_configs.__setitem__, config.id, config.dict())
     return {"message": "自定义AI配置已保存", "id": config.id}
 
 @app.get("/ai/custom-configs")
 async def get_custom_ai_configs():
     """获取所有自定义AI配置（不返回API密钥）"""
     safe_configs = {}
-    for config_id, config in custom_ai_configs.items():
+    for config_id, config in await read_custom_ai_configs():
         safe_configs[config_id] = {
             **config,
             "api_key": "***" if config.get("api_key") else "",  # 隐藏API密钥
@@ -537,8 +1722,7 @@ async def get_custom_ai_configs():
 @app.delete("/ai/custom-config/{config_id}")
 async def delete_custom_ai_config(config_id: str):
     """删除自定义AI配置"""
-    if config_id in custom_ai_configs:
-        del custom_ai_configs[config_id]
+    if await call_state_backend(custom_ai_configs.pop, config_id, None) is not None:
         return {"message": "自定义AI配置已删除"}
     else:
         raise HTTPException(status_code=404, detail="配置不存在")
@@ -547,27 +1731,130 @@ async def delete_custom_ai_config(config_id: str):
 async def list_ai_tasks(limit: int = 50):
     """获取AI任务列表"""
     task_list = []
-    for task_id, task_data in list(ai_tasks.items())[-limit:]:
+    for task_id, task_data in await ai_tasks.arecent(limit):
         task_list.append({
             "task_id": task_id,
-            "status": task_data["status"],
-            "submitted_at": task_data.get("submitted_at"),
-            "completed_at": task_data.get("completed_at"),
-            "has_error": "error" in task_data and task_data["error"] is not None
+            "status": task_data.status,
+            "submitted_at": task_data.format_time(task_data.submitted_at),
+            "completed_at": task_data.format_time(task_data.completed_at),
+            "has_error": task_data.error is not None
         })
     
     return {"tasks": task_list}
 
-# 清理过期任务的定时任务
+@app.get("/tasks/stats")
+async def get_task_store_stats():
+    """获取任务存储的容量和清理统计"""
+    return {"tasks": await tasks.astats(), "ai_tasks": await ai_tasks.astats()}
+
 # 配置API端点
+def make_generation_specs(request: GenerateRequest, max_count: int) -> List[Any]:
+    """校验生成请求并为每种运算类型生成约束条件"""
+    if not request.operation_types:
+        raise HTTPException(status_code=400, detail="至少需要一种运算类型")
+    if request.count <= 0 or request.count > max_count:
+        raise HTTPException(status_code=400, detail=f"题目数量需在1到{max_count}之间")
+    try:
+        return [question_generator.make_spec(operation, request.knowledge_point, request.difficulty,
+                                             request.grade, request.carry)
+                for operation in dict.fromkeys(request.operation_types)]
+    except GenerationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def build_question_bank(specs: List[Any], count: int, seed: int, unique: bool) -> Dict[str, Any]:
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    batches = generate_bank(question_generator, specs, count, rng, unique)
+    questions = merge_records(batches, rng)
+    return {
+        "seed": seed,
+        "requested": count,
+        "count": len(questions),
+        "exhausted": [batch.spec.operation for batch in batches if batch.exhausted],
+        "indexed": [batch.spec.operation for batch in batches if batch.source == "index"],
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        "questions": questions
+    }
+
+@app.post("/generate")
+async def generate_questions(request: GenerateRequest):
+    """按配置批量生成题目和答案"""
+    specs = make_generation_specs(request, question_generator.max_count)
+    seed = request.seed if request.seed is not None else new_seed()
+    # 大批量生成在线程中进行，不阻塞事件循环；直接返回JSONResponse跳过逐个对象的序列化校验
+    result = await asyncio.to_thread(build_question_bank, specs, request.count, seed, request.unique)
+    return JSONResponse(result)
+
+@app.post("/generate/stream")
+async def generate_questions_stream(request: GenerateStreamRequest):
+    """流式生成超大题库（NDJSON或CSV），内存占用恒定，支持种子复现和断点续传"""
+    specs = make_generation_specs(request, question_generator.max_stream_count)
+    if request.format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的输出格式: {request.format}")
+    if request.offset < 0 or request.offset >= request.count:
+        raise HTTPException(status_code=400, detail="offset需在0到count-1之间")
+    seed = request.seed if request.seed is not None else new_seed()
+    media_type = STREAM_FORMATS[request.format][0]
+    # 同步生成器由StreamingResponse放到线程池中迭代，逐块生成和发送
+    return StreamingResponse(
+        iter_question_stream(question_generator, specs, request.count, seed,
+                             request.offset, request.unique, request.format),
+        media_type=media_type,
+        headers={"X-Generation-Seed": str(seed), "X-Generation-Offset": str(request.offset)}
+    )
+
+# /api/* 的配置类接口：每个配置版本只生成和序列化一次，配置文件变化时整体替换
+def build_ai_services_payload(config: Dict[str, Any]) -> Dict[str, Any]:
+    """AI服务配置（不返回敏感信息）"""
+    ai_config = config.get("ai", {})
+    services = ai_config.get("services", {})
+    # 移除API密钥等敏感信息
+    safe_services = {}
+    for service_name, service_config in services.items():
+        safe_services[service_name] = {
+            "api_base": service_config.get("api_base", ""),
+            "model": service_config.get("model", ""),
+            "has_api_key": bool(service_config.get("api_key", "")),
+            "description": service_config.get("description", "")
+        }
+    return {
+        "default_service": ai_config.get("default_service", "deepseek"),
+        "timeout": ai_config.get("timeout", 30),
+        "services": safe_services
+    }
+
+CONFIG_PAYLOADS = {
+    "config": lambda config: config,
+    "operation-types": lambda config: {"operation_types": config.get("math_generation", {}).get("operation_types", [])},
+    "knowledge-points": lambda config: {"knowledge_points": config.get("math_generation", {}).get("knowledge_points", [])},
+    "difficulty-levels": lambda config: {"difficulty_levels": config.get("math_generation", {}).get("difficulty_levels", {})},
+    "licenses": lambda config: config.get("licenses", {}),
+    "ai-services": build_ai_services_payload,
+}
+
+config_api_config = mcp_config.get("config_api", {}) or {}
+config_watcher = ConfigWatcher(
+    config_loader, CONFIG_PAYLOADS,
+    interval=config_api_config.get("watch_interval", 2) if config_api_config.get("watch", True) else 0,
+    gzip_min_size=config_api_config.get("gzip_min_size", 1024) if config_api_config.get("gzip", True) else None,
+    prepare=apply_env_overrides
+)
+
+def config_response(request: Request, name: str) -> Response:
+    """返回当前配置快照中预先序列化的响应；If-None-Match命中时返回304，客户端支持时返回gzip"""
+    prepared = config_watcher.snapshot.responses[name]
+    headers = {"ETag": prepared.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if prepared.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if prepared.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(prepared.gzip_body, media_type="application/json", headers=headers)
+    return Response(prepared.body, media_type="application/json", headers=headers)
+
 @app.get("/api/config")
-async def get_config():
+async def get_config(request: Request):
     """获取完整的应用配置"""
-    try:
-        config = config_loader.get_app_config()
-        return config
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取配置失败: {str(e)}")
+    return config_response(request, "config")
 
 @app.get("/api/app-info")
 async def get_app_info_api():
@@ -586,63 +1873,55 @@ async def get_version():
         raise HTTPException(status_code=500, detail=f"获取版本信息失败: {str(e)}")
 
 @app.get("/api/operation-types")
-async def get_operation_types():
+async def get_operation_types(request: Request):
     """获取支持的运算类型"""
-    try:
-        return {"operation_types": config_loader.get_operation_types()}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取运算类型失败: {str(e)}")
+    return config_response(request, "operation-types")
 
 @app.get("/api/knowledge-points")
-async def get_knowledge_points():
+async def get_knowledge_points(request: Request):
     """获取知识点配置"""
-    try:
-        return {"knowledge_points": config_loader.get_knowledge_points()}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取知识点失败: {str(e)}")
+    return config_response(request, "knowledge-points")
 
 @app.get("/api/difficulty-levels")
-async def get_difficulty_levels():
+async def get_difficulty_levels(request: Request):
     """获取难度等级配置"""
-    try:
-        return {"difficulty_levels": config_loader.get_difficulty_levels()}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取难度等级失败: {str(e)}")
+    return config_response(request, "difficulty-levels")
 
 @app.get("/api/licenses")
-async def get_licenses():
+async def get_licenses(request: Request):
     """获取许可证信息"""
-    try:
-        return config_loader.get_licenses_info()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取许可证信息失败: {str(e)}")
+    return config_response(request, "licenses")
 
 @app.get("/api/ai-services")
-async def get_ai_services():
+async def get_ai_services(request: Request):
     """获取AI服务配置（不返回敏感信息）"""
+    return config_response(request, "ai-services")
+
+@app.get("/api/config/stats")
+async def get_config_stats():
+    """获取配置快照的版本、重新加载次数和各接口响应大小"""
+    return config_watcher.stats()
+
+startup_config = mcp_config.get("startup", {}) or {}
+sympy_prewarm_task: Optional[asyncio.Task] = None
+
+async def prewarm_sympy(delay: float) -> None:
+    """等服务开始监听后在后台导入sympy并完成一次计算，避免首个请求承担导入耗时"""
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
     try:
-        ai_config = config_loader.get_ai_config()
-        services = ai_config.get("services", {})
-        # 移除API密钥等敏感信息
-        safe_services = {}
-        for service_name, service_config in services.items():
-            safe_services[service_name] = {
-                "api_base": service_config.get("api_base", ""),
-                "model": service_config.get("model", ""),
-                "has_api_key": bool(service_config.get("api_key", "")),
-                "description": service_config.get("description", "")
-            }
-        return {
-            "default_service": ai_config.get("default_service", "deepseek"),
-            "timeout": ai_config.get("timeout", 30),
-            "services": safe_services
-        }
+        await asyncio.to_thread(evaluate_with_sympy, "sqrt(4) + 1/2")
+        record_startup_phase("sympy_prewarm", started)
+        print(f"sympy预热完成，耗时 {startup_timings['sympy_prewarm']} ms")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取AI服务配置失败: {str(e)}")
+        print(f"sympy预热失败: {e}")
+
+record_startup_phase("module_init", module_init_started)
 
 @app.on_event("startup")
 async def startup_event():
     """应用启动时的初始化"""
+    phase_started = time.perf_counter()
     print("MCP服务器启动，支持AI解答功能和YAML配置")
     print(f"应用名称: {get_app_name()}")
     print(f"应用版本: {get_app_version()}")
@@ -650,12 +1929,66 @@ async def startup_event():
     print(f"API地址: {AI_CONFIG['api_base']}")
     print(f"API Key状态: {'✓ 已配置' if AI_CONFIG['api_key'] else '✗ 未配置'}")
     
+    # 启动执行调度器
+    scheduler.start()
+    print(f"执行调度器已启动: {scheduler.max_workers} 个工作线程，队列上限 {scheduler.max_queue_size}")
+    phase_started = record_startup_phase("scheduler", phase_started)
+    
+    # 批量AI分析的全局并发上限
+    global ai_batch_semaphore, sympy_prewarm_task
+    ai_batch_semaphore = asyncio.Semaphore(ai_batch_config.get("max_concurrency", 4))
+    
+    # 映射预先构建的题目空间索引，窄约束的题目直接按下标抽取
+    question_generator.index = load_question_index(
+        resolve_index_path(config_loader.get_math_config().get("generator", {}) or {}, Path(__file__).parent)
+    )
+    phase_started = record_startup_phase("question_index", phase_started)
+    
+    # 启动过期任务的定时清理
+    tasks.start_sweeper()
+    ai_tasks.start_sweeper()
+    # 监视配置文件变化
+    config_watcher.start()
+    phase_started = record_startup_phase("sweepers", phase_started)
+    
     # 加载配置并检查
     try:
         config = config_loader.get_app_config()
         print(f"配置文件加载成功，包含 {len(config.get('math_generation', {}).get('operation_types', []))} 种运算类型")
     except Exception as e:
         print(f"配置文件加载失败: {e}")
+    
+    # 预先创建计算沙箱的计算进程（后台进行）
+    if sandbox_pool is not None:
+        sandbox_pool.start()
+    
+    # startup事件在端口绑定之前执行，sympy预热延后到后台进行；启用沙箱时服务进程不需要sympy
+    if (sandbox_pool is None and startup_config.get("sympy_prewarm", True)
+            and set(SANDBOX_ENGINES) & set(engine_order)):
+        sympy_prewarm_task = asyncio.create_task(prewarm_sympy(startup_config.get("sympy_prewarm_delay", 0.5)))
+    
+    record_startup_phase("startup_event", phase_started)
+    config_stats = config_loader.load_stats.get("app", {})
+    if config_stats:
+        print(f"配置来源: {config_stats['source']}（{config_stats['path']}），解析耗时 {config_stats['elapsed_ms']} ms")
+    print("启动耗时: " + "，".join(f"{phase} {elapsed} ms" for phase, elapsed in startup_timings.items()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放资源"""
+    if sympy_prewarm_task is not None and not sympy_prewarm_task.done():
+        sympy_prewarm_task.cancel()
+    scheduler.shutdown()
+    if sandbox_pool is not None:
+        sandbox_pool.shutdown()
+    config_watcher.stop()
+    tasks.stop_sweeper()
+    ai_tasks.stop_sweeper()
+    await ai_client_pool.close()
+    if analysis_cache is not None:
+        analysis_cache.close()
+    if state_backend is not None:
+        state_backend.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,474 @@
+import csv
+import io
+import math
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+class GenerationError(ValueError):
+    """生成参数与配置不符（运算类型未启用、年级或知识点不匹配等）"""
+
+# 各难度等级的操作数范围（闭区间），可在 math_generation.generator.difficulty_ranges 中覆盖
+DEFAULT_DIFFICULTY_RANGES = {
+    1: (1, 10),
+    2: (1, 20),
+    3: (1, 50),
+    4: (10, 100),
+    5: (10, 100),
+    6: (10, 500),
+    7: (100, 1000),
+    8: (100, 5000),
+    9: (1000, 10000),
+    10: (1000, 100000),
+}
+
+# 各年级的结果上限，可在 math_generation.generator.grade_max_result 中覆盖
+DEFAULT_GRADE_MAX_RESULT = {1: 100, 2: 1000, 3: 10000, 4: 100000, 5: 1000000, 6: 10000000}
+
+# 未指定年级时的结果上限，同时防止int64溢出
+UNBOUNDED_RESULT = 10 ** 12
+
+# 各运算类型支持的知识点，第一个为默认知识点
+OPERATION_KNOWLEDGE_POINTS = {
+    "addition": ["basic_arithmetic", "carry_addition", "decimal_operation"],
+    "subtraction": ["basic_arithmetic", "borrow_subtraction", "decimal_operation"],
+    "multiplication": ["basic_arithmetic", "multiplication_table"],
+    "division": ["basic_arithmetic", "division_concept"],
+    "mixed_operations": ["mixed_operations_order", "basic_arithmetic"],
+    "percentage": ["percentage_calculation"],
+    "square_root": ["square_root_concept"],
+    "power": ["power_calculation"],
+}
+
+# 混合运算的运算符编码：0加 1减 2乘 3除
+OPERATOR_SYMBOLS = np.array(["+", "-", "×", "÷"])
+SUPERSCRIPT_DIGITS = np.array(list("⁰¹²³⁴⁵⁶⁷⁸⁹"))
+
+# 单轮抽样的候选数量上限（大批量时放宽到题目数量的两倍）
+MAX_BATCH = 1 << 18
+
+# 流式生成的块大小：第k块使用种子(seed, k)，任意偏移量都能直接定位到所在的块
+STREAM_CHUNK_SIZE = 10000
+
+CSV_FIELDS = ["index", "expression", "answer", "operation", "knowledge_point", "difficulty"]
+
+# 每行题目打包为4个int64：[a, b, c, 运算符/指数编码]，便于去重和存储
+ROW_WIDTH = 4
+
+class GenerationSpec:
+    """一次生成的约束条件"""
+
+    __slots__ = ("operation", "knowledge_point", "difficulty", "grade", "low", "high",
+                 "max_result", "carry", "scale")
+
+    def __init__(self, operation: str, knowledge_point: str, difficulty: int, grade: Optional[int],
+                 low: int, high: int, max_result: int, carry: Optional[bool], scale: int):
+        self.operation = operation
+        self.knowledge_point = knowledge_point
+        self.difficulty = difficulty
+        self.grade = grade
+        self.low = low
+        self.high = high
+        self.max_result = max_result
+        self.carry = carry
+        self.scale = scale
+
+class GeneratedQuestions:
+    """一种运算类型的生成结果，题目以打包的操作数数组保存，按需格式化"""
+
+    def __init__(self, spec: GenerationSpec, rows: np.ndarray, answers: np.ndarray, exhausted: bool = False,
+                 source: str = "sampling"):
+        self.spec = spec
+        self.rows = rows
+        self.answers = answers
+        self.exhausted = exhausted
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def expressions(self) -> np.ndarray:
+        return FORMATTERS[self.spec.operation](self.rows, self.spec)
+
+    def answer_values(self) -> List[Any]:
+        if self.spec.scale > 1:
+            return (self.answers / self.spec.scale).round(2).tolist()
+        return self.answers.tolist()
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """转换为与MathQuestion字段一致的字典列表"""
+        spec = self.spec
+        return [
+            {"expression": expression, "answer": answer, "operation": spec.operation,
+             "knowledge_point": spec.knowledge_point, "difficulty": spec.difficulty}
+            for expression, answer in zip(self.expressions().tolist(), self.answer_values())
+        ]
+
+def digit_sum(values: np.ndarray) -> np.ndarray:
+    """逐位求各位数字之和"""
+    values = values.copy()
+    total = np.zeros_like(values)
+    while values.any():
+        total += values % 10
+        values //= 10
+    return total
+
+def has_carry(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a+b是否产生进位：每次进位使各位数字之和减少9"""
+    return digit_sum(a) + digit_sum(b) != digit_sum(a + b)
+
+def pack_rows(*columns: np.ndarray) -> np.ndarray:
+    rows = np.zeros((len(columns[0]), ROW_WIDTH), dtype=np.int64)
+    for index, column in enumerate(columns):
+        rows[:, index] = column
+    return rows
+
+def format_scaled(values: np.ndarray, scale: int) -> np.ndarray:
+    """把按scale放大的整数格式化为小数字符串，去掉多余的0"""
+    if scale == 1:
+        return values.astype(str)
+    places = len(str(scale)) - 1
+    text = np.char.add(np.char.add((values // scale).astype(str), "."),
+                       np.char.zfill((values % scale).astype(str), places))
+    return np.char.rstrip(np.char.rstrip(text, "0"), ".")
+
+def join_columns(*parts: Any) -> np.ndarray:
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.char.add(result, part)
+    return result
+
+# 每种运算类型由两部分组成：domain给出各个随机输入的取值范围（闭区间），build把输入向量化地组装成题目并按约束过滤。
+# 随机抽样和构建索引时的穷举共用同一个build，保证两者生成的题目空间一致。
+Domain = List[Tuple[int, int]]
+Built = Tuple[np.ndarray, np.ndarray]
+
+def addition_domain(spec: GenerationSpec) -> Domain:
+    return [(spec.low, spec.high), (spec.low, spec.high)]
+
+def build_addition(spec: GenerationSpec, a: np.ndarray, b: np.ndarray) -> Built:
+    answers = a + b
+    mask = answers <= spec.max_result
+    if spec.carry is not None:
+        mask &= has_carry(a, b) == spec.carry
+    return pack_rows(a[mask], b[mask]), answers[mask]
+
+def build_subtraction(spec: GenerationSpec, x: np.ndarray, y: np.ndarray) -> Built:
+    a, b = np.maximum(x, y), np.minimum(x, y)
+    answers = a - b
+    mask = answers <= spec.max_result
+    if spec.carry is not None:
+        # a-b的退位次数等于(a-b)+b的进位次数
+        mask &= has_carry(answers, b) == spec.carry
+    return pack_rows(a[mask], b[mask]), answers[mask]
+
+def multiplier_limit(spec: GenerationSpec) -> int:
+    if spec.knowledge_point in ("multiplication_table", "division_concept") or spec.difficulty <= 4:
+        return 9
+    return 99 if spec.difficulty <= 8 else spec.high
+
+def multiplication_domain(spec: GenerationSpec) -> Domain:
+    if spec.knowledge_point == "multiplication_table":
+        return [(1, 9), (1, 9)]
+    return [(spec.low, spec.high), (2, multiplier_limit(spec))]
+
+def build_multiplication(spec: GenerationSpec, a: np.ndarray, b: np.ndarray) -> Built:
+    answers = a * b
+    mask = answers <= spec.max_result
+    return pack_rows(a[mask], b[mask]), answers[mask]
+
+def division_domain(spec: GenerationSpec) -> Domain:
+    quotient = (1, 9) if spec.knowledge_point == "division_concept" else (spec.low, spec.high)
+    return [(2, multiplier_limit(spec)), quotient]
+
+def build_division(spec: GenerationSpec, divisor: np.ndarray, quotient: np.ndarray) -> Built:
+    # 由商和除数反推被除数，保证整除
+    dividend = quotient * divisor
+    mask = dividend <= spec.max_result
+    return pack_rows(dividend[mask], divisor[mask]), quotient[mask]
+
+def apply_operator(op: np.ndarray, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按运算符编码逐行计算，返回结果和是否有效（除法要求整除）"""
+    safe = np.where(y == 0, 1, y)
+    result = np.select([op == 0, op == 1, op == 2], [x + y, x - y, x * y], x // safe)
+    valid = (op != 3) | ((y != 0) & (x % safe == 0))
+    return result, valid
+
+def mixed_operations_domain(spec: GenerationSpec) -> Domain:
+    # 三个操作数连乘增长很快，范围比同难度的单步运算小
+    high = min(spec.high, 100 if spec.difficulty <= 6 else 1000)
+    low = min(spec.low, high // 10)
+    return [(low, high), (low, high), (low, high), (0, 3), (0, 3)]
+
+def build_mixed_operations(spec: GenerationSpec, a: np.ndarray, b: np.ndarray, c: np.ndarray,
+                           op1: np.ndarray, op2: np.ndarray) -> Built:
+    # 先乘除后加减：第二个运算符优先级更高时先算 b op2 c
+    inner_first = (op1 <= 1) & (op2 >= 2)
+    # 除法的被除数由乘积构造，减少整除筛选的浪费
+    a = np.where(op1 == 3, a * b, a)
+    b = np.where(inner_first & (op2 == 3), b * c, b)
+    inner, inner_valid = apply_operator(np.where(inner_first, op2, op1),
+                                        np.where(inner_first, b, a), np.where(inner_first, c, b))
+    answers, outer_valid = apply_operator(np.where(inner_first, op1, op2),
+                                          np.where(inner_first, a, inner), np.where(inner_first, inner, c))
+    mask = inner_valid & outer_valid & (inner >= 0) & (answers >= 0) & (answers <= spec.max_result)
+    if spec.knowledge_point == "mixed_operations_order":
+        # 考查运算顺序时要求同时出现加减和乘除
+        mask &= (op1 <= 1) != (op2 <= 1)
+    return pack_rows(a[mask], b[mask], c[mask], (op1 * 4 + op2)[mask]), answers[mask]
+
+def percentage_domain(spec: GenerationSpec) -> Domain:
+    percent = (1, 20) if spec.difficulty <= 5 else (1, 99)
+    return [percent, (1, max(2, spec.high // 2))]
+
+def build_percentage(spec: GenerationSpec, percent: np.ndarray, multiple: np.ndarray) -> Built:
+    if spec.difficulty <= 5:
+        percent = percent * 5
+    # 底数取 100/gcd(p,100) 的倍数，保证结果为整数
+    base = 100 // np.gcd(percent, 100) * multiple
+    answers = percent * base // 100
+    mask = (base <= max(100, spec.high * 10)) & (answers <= spec.max_result)
+    return pack_rows(percent[mask], base[mask]), answers[mask]
+
+def square_root_domain(spec: GenerationSpec) -> Domain:
+    return [(1, max(2, min(max(10, spec.high), math.isqrt(spec.max_result))))]
+
+def build_square_root(spec: GenerationSpec, roots: np.ndarray) -> Built:
+    return pack_rows(roots * roots), roots
+
+def power_domain(spec: GenerationSpec) -> Domain:
+    max_exponent = 2 if spec.difficulty <= 3 else 3 if spec.difficulty <= 6 else 4
+    return [(2, min(max(5, spec.high), 99)), (2, max_exponent)]
+
+def build_power(spec: GenerationSpec, base: np.ndarray, exponent: np.ndarray) -> Built:
+    # 先用浮点数筛掉超限的结果，避免整数溢出
+    mask = np.power(base.astype(np.float64), exponent) <= spec.max_result
+    base, exponent = base[mask], exponent[mask]
+    return pack_rows(base, 0, 0, exponent), base ** exponent
+
+def format_binary(symbol: str) -> Callable[[np.ndarray, GenerationSpec], np.ndarray]:
+    def formatter(rows: np.ndarray, spec: GenerationSpec) -> np.ndarray:
+        return join_columns(format_scaled(rows[:, 0], spec.scale), symbol, format_scaled(rows[:, 1], spec.scale))
+    return formatter
+
+def format_mixed_operations(rows: np.ndarray, spec: GenerationSpec) -> np.ndarray:
+    return join_columns(rows[:, 0].astype(str), OPERATOR_SYMBOLS[rows[:, 3] // 4],
+                        rows[:, 1].astype(str), OPERATOR_SYMBOLS[rows[:, 3] % 4], rows[:, 2].astype(str))
+
+def format_percentage(rows: np.ndarray, spec: GenerationSpec) -> np.ndarray:
+    return join_columns(rows[:, 0].astype(str), "%×", rows[:, 1].astype(str))
+
+def format_square_root(rows: np.ndarray, spec: GenerationSpec) -> np.ndarray:
+    return np.char.add("√", rows[:, 0].astype(str))
+
+def format_power(rows: np.ndarray, spec: GenerationSpec) -> np.ndarray:
+    return np.char.add(rows[:, 0].astype(str), SUPERSCRIPT_DIGITS[rows[:, 3]])
+
+OPERATIONS: Dict[str, Tuple[Callable[[GenerationSpec], Domain], Callable[..., Built]]] = {
+    "addition": (addition_domain, build_addition),
+    "subtraction": (addition_domain, build_subtraction),
+    "multiplication": (multiplication_domain, build_multiplication),
+    "division": (division_domain, build_division),
+    "mixed_operations": (mixed_operations_domain, build_mixed_operations),
+    "percentage": (percentage_domain, build_percentage),
+    "square_root": (square_root_domain, build_square_root),
+    "power": (power_domain, build_power),
+}
+
+# 与年级结果上限比较的量，构建索引时按它排序，年级限制就变成取前缀
+def grade_measure(operation: str, rows: np.ndarray, answers: np.ndarray) -> np.ndarray:
+    if operation in ("division", "square_root"):
+        return rows[:, 0]
+    return answers
+
+FORMATTERS = {
+    "addition": format_binary("+"),
+    "subtraction": format_binary("-"),
+    "multiplication": format_binary("×"),
+    "division": format_binary("÷"),
+    "mixed_operations": format_mixed_operations,
+    "percentage": format_percentage,
+    "square_root": format_square_root,
+    "power": format_power,
+}
+
+def unique_first(rows: np.ndarray) -> np.ndarray:
+    """返回各不相同的行首次出现的下标（保持原有顺序）"""
+    rows = np.ascontiguousarray(rows)
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return first
+
+class QuestionGenerator:
+    """按 config/app.yaml 中 math_generation 的配置批量生成题目和答案"""
+
+    def __init__(self, math_config: Dict[str, Any]):
+        generator_config = math_config.get("generator", {}) or {}
+        self.operation_types = {item["id"]: item for item in math_config.get("operation_types", [])}
+        self.knowledge_points = {item["id"] for item in math_config.get("knowledge_points", [])}
+        self.difficulty_levels = {int(level) for level in math_config.get("difficulty_levels", {})} \
+            or set(DEFAULT_DIFFICULTY_RANGES)
+        self.difficulty_ranges = dict(DEFAULT_DIFFICULTY_RANGES)
+        for level, bounds in (generator_config.get("difficulty_ranges") or {}).items():
+            self.difficulty_ranges[int(level)] = (int(bounds[0]), int(bounds[1]))
+        self.grade_max_result = dict(DEFAULT_GRADE_MAX_RESULT)
+        for grade, limit in (generator_config.get("grade_max_result") or {}).items():
+            self.grade_max_result[int(grade)] = int(limit)
+        self.max_count = generator_config.get("max_count", 1000000)
+        self.max_stream_count = generator_config.get("max_stream_count", 100000000)
+        self.max_rounds = generator_config.get("max_rounds", 50)
+        # 预先构建的题目空间索引（question_index.QuestionIndex），由服务启动时加载
+        self.index: Optional[Any] = None
+
+    def make_spec(self, operation: str, knowledge_point: Optional[str] = None, difficulty: int = 3,
+                  grade: Optional[int] = None, carry: Optional[bool] = None) -> GenerationSpec:
+        """校验参数并生成约束条件"""
+        operation_type = self.operation_types.get(operation)
+        if operation_type is None or operation not in OPERATIONS:
+            raise GenerationError(f"不支持的运算类型: {operation}")
+        if not operation_type.get("enabled", True):
+            raise GenerationError(f"运算类型未启用: {operation}")
+        if grade is not None and not operation_type.get("min_grade", 1) <= grade <= operation_type.get("max_grade", 6):
+            raise GenerationError(
+                f"{operation_type.get('name_zh', operation)}适用于{operation_type.get('min_grade')}"
+                f"-{operation_type.get('max_grade')}年级"
+            )
+        if difficulty not in self.difficulty_levels or difficulty not in self.difficulty_ranges:
+            raise GenerationError(f"不支持的难度等级: {difficulty}")
+
+        allowed = OPERATION_KNOWLEDGE_POINTS[operation]
+        knowledge_point = knowledge_point or allowed[0]
+        if knowledge_point not in allowed or knowledge_point not in self.knowledge_points:
+            raise GenerationError(f"知识点 {knowledge_point} 不适用于运算类型 {operation}")
+
+        if carry is None and knowledge_point in ("carry_addition", "borrow_subtraction"):
+            carry = True
+        if operation not in ("addition", "subtraction"):
+            carry = None
+
+        low, high = self.difficulty_ranges[difficulty]
+        scale = 1
+        if knowledge_point == "decimal_operation":
+            # 小数运算：操作数按scale放大为整数处理，低难度一位小数，高难度两位小数
+            scale = 10 if difficulty <= 5 else 100
+            high = high * scale // 10
+        max_result = self.grade_max_result.get(grade, UNBOUNDED_RESULT) if grade is not None else UNBOUNDED_RESULT
+        if scale > 1:
+            max_result *= scale
+        return GenerationSpec(operation, knowledge_point, difficulty, grade, low, high,
+                              max_result, carry, scale)
+
+    def sample(self, rng: np.random.Generator, spec: GenerationSpec, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """抽取n个候选并按约束过滤，返回满足条件的题目（可能少于n个）"""
+        domain, build = OPERATIONS[spec.operation]
+        return build(spec, *[rng.integers(low, high + 1, n) for low, high in domain(spec)])
+
+    def generate(self, spec: GenerationSpec, count: int, rng: np.random.Generator,
+                 unique: bool = True) -> GeneratedQuestions:
+        """批量抽样、过滤、去重，直到凑够count道题或题目空间耗尽；索引中有对应条目时直接按下标抽取"""
+        entry = self.index.lookup(spec) if self.index is not None else None
+        if entry is not None:
+            return entry.sample(spec, count, rng, unique)
+        rows = np.empty((0, ROW_WIDTH), dtype=np.int64)
+        answers = np.empty(0, dtype=np.int64)
+        acceptance = 1.0
+        stale_rounds = 0
+        for _ in range(self.max_rounds):
+            missing = count - len(rows)
+            if missing <= 0:
+                break
+            # 按上一轮新增题目的比例放大抽样量
+            batch = min(max(1024, int(missing / acceptance * 1.2)), max(MAX_BATCH, count * 2))
+            new_rows, new_answers = self.sample(rng, spec, batch)
+            previous = len(rows)
+            rows = np.concatenate([rows, new_rows])
+            answers = np.concatenate([answers, new_answers])
+            if unique:
+                first = unique_first(rows)
+                rows, answers = rows[first], answers[first]
+            acceptance = max((len(rows) - previous) / batch, 0.01)
+            # 连续两轮没有新题说明题目空间已经耗尽
+            stale_rounds = stale_rounds + 1 if len(rows) == previous else 0
+            if stale_rounds >= 2:
+                break
+        exhausted = len(rows) < count
+        return GeneratedQuestions(spec, rows[:count], answers[:count], exhausted)
+
+def split_count(count: int, parts: int) -> List[int]:
+    """把题目数量尽量平均地分给各运算类型"""
+    base, extra = divmod(count, parts)
+    return [base + (1 if index < extra else 0) for index in range(parts)]
+
+def new_seed() -> int:
+    """未指定种子时生成随机种子，随结果返回以便复现"""
+    return int(np.random.SeedSequence().entropy % (1 << 63))
+
+def generate_bank(generator: QuestionGenerator, specs: List[GenerationSpec], count: int,
+                  rng: np.random.Generator, unique: bool = True) -> List[GeneratedQuestions]:
+    """按运算类型分配数量分别生成"""
+    return [generator.generate(spec, part, rng, unique)
+            for spec, part in zip(specs, split_count(count, len(specs))) if part > 0]
+
+def merge_records(batches: List[GeneratedQuestions], rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """合并各运算类型的题目，多种运算类型时打乱顺序"""
+    records = [record for batch in batches for record in batch.to_records()]
+    if len(batches) > 1:
+        records = [records[index] for index in rng.permutation(len(records))]
+    return records
+
+def iter_question_chunks(generator: QuestionGenerator, specs: List[GenerationSpec], count: int, seed: int,
+                         offset: int = 0, unique: bool = True) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+    """按块生成题目，内存占用与总数量无关；返回 (起始序号, 题目列表)
+
+    每块只依赖种子和块序号，因此从offset续传时输出与完整生成的对应部分一致。
+    unique为True时题目在块内不重复，某一块的题目空间耗尽时在该块之后结束。
+    """
+    chunk_index = offset // STREAM_CHUNK_SIZE
+    while chunk_index * STREAM_CHUNK_SIZE < count:
+        chunk_start = chunk_index * STREAM_CHUNK_SIZE
+        chunk_size = min(STREAM_CHUNK_SIZE, count - chunk_start)
+        rng = np.random.default_rng([seed, chunk_index])
+        batches = generate_bank(generator, specs, chunk_size, rng, unique)
+        records = merge_records(batches, rng)
+        skip = max(0, offset - chunk_start)
+        if skip < len(records):
+            yield chunk_start + skip, records[skip:]
+        if any(batch.exhausted for batch in batches):
+            return
+        chunk_index += 1
+
+# 生成的表达式和配置ID不含引号、反斜杠等需要转义的字符，可以直接套用模板，输出与json.dumps一致
+NDJSON_TEMPLATE = ('{"index": %d, "expression": "%s", "answer": %r, "operation": "%s", '
+                   '"knowledge_point": "%s", "difficulty": %d}\n')
+
+def format_ndjson(start: int, records: List[Dict[str, Any]]) -> str:
+    return "".join(
+        NDJSON_TEMPLATE % (index, record["expression"], record["answer"], record["operation"],
+                           record["knowledge_point"], record["difficulty"])
+        for index, record in enumerate(records, start)
+    )
+
+def format_csv(start: int, records: List[Dict[str, Any]]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(
+        (index, record["expression"], record["answer"], record["operation"],
+         record["knowledge_point"], record["difficulty"])
+        for index, record in enumerate(records, start)
+    )
+    return buffer.getvalue()
+
+STREAM_FORMATS = {
+    "ndjson": ("application/x-ndjson", format_ndjson),
+    "csv": ("text/csv; charset=utf-8", format_csv),
+}
+
+def iter_question_stream(generator: QuestionGenerator, specs: List[GenerationSpec], count: int, seed: int,
+                         offset: int = 0, unique: bool = True, output_format: str = "ndjson") -> Iterator[str]:
+    """流式输出题目，每行带全局序号index；CSV只在offset为0时输出表头，续传内容可直接追加到已下载的文件"""
+    formatter = STREAM_FORMATS[output_format][1]
+    if output_format == "csv" and offset == 0:
+        yield ",".join(CSV_FIELDS) + "\n"
+    for start, records in iter_question_chunks(generator, specs, count, seed, offset, unique):
+        yield formatter(start, records)
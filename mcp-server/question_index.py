@@ -0,0 +1,251 @@
+import json
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from question_generator import (OPERATION_KNOWLEDGE_POINTS, OPERATIONS, ROW_WIDTH, UNBOUNDED_RESULT,
+                                GeneratedQuestions, GenerationError, GenerationSpec, QuestionGenerator,
+                                grade_measure, unique_first)
+
+# 文件格式：MAGIC + 8字节头部长度 + JSON头部 + 按64字节对齐的数据块（各条目的操作数矩阵和答案数组），
+# 头部记录的偏移量相对于头部之后第一个对齐位置
+MAGIC = b"MQIDX001"
+# 生成规则（domain/build）变化时递增，旧索引自动失效
+INDEX_VERSION = 1
+ALIGNMENT = 64
+
+# 各运算类型实际使用的列，只存储这些列以缩小索引文件
+STORED_COLUMNS = {"square_root": [0], "power": [0, 3], "mixed_operations": [0, 1, 2, 3]}
+DEFAULT_COLUMNS = [0, 1]
+
+# 穷举时每次处理的候选数量，控制构建时的内存占用
+ENUMERATION_CHUNK = 1 << 20
+
+def align(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+def entry_key(operation: str, knowledge_point: str, difficulty: int, carry: Optional[bool]) -> str:
+    carry_name = "any" if carry is None else "carry" if carry else "no_carry"
+    return f"{operation}/{knowledge_point}/{difficulty}/{carry_name}"
+
+def smallest_dtype(values: np.ndarray) -> np.dtype:
+    """能容纳全部取值的最小整数类型"""
+    if values.size == 0:
+        return np.dtype(np.int16)
+    low, high = int(values.min()), int(values.max())
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+class IndexEntry:
+    """一个 (运算类型, 知识点, 难度, 进位) 组合的全部题目，按年级比较量升序排列"""
+
+    __slots__ = ("operation", "low", "high", "scale", "columns", "rows", "answers")
+
+    def __init__(self, operation: str, low: int, high: int, scale: int, columns: List[int],
+                 rows: np.ndarray, answers: np.ndarray):
+        self.operation = operation
+        self.columns = columns
+        self.low = low
+        self.high = high
+        self.scale = scale
+        self.rows = rows
+        self.answers = answers
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def matches(self, spec: GenerationSpec) -> bool:
+        return (self.low, self.high, self.scale) == (spec.low, spec.high, spec.scale)
+
+    def limit(self, max_result: int) -> int:
+        """满足结果上限的题目数量：条目已按比较量排序，二分查找即可"""
+        if max_result >= UNBOUNDED_RESULT:
+            return len(self)
+        # 比较量在第0列或答案中，第0列总是被存储
+        measure = grade_measure(self.operation, self.rows, self.answers)
+        return int(np.searchsorted(measure, max_result, side="right"))
+
+    def sample(self, spec: GenerationSpec, count: int, rng: np.random.Generator,
+               unique: bool = True) -> GeneratedQuestions:
+        """直接按下标抽取，不需要拒绝采样；去重时题目空间不足则全部返回"""
+        size = self.limit(spec.max_result)
+        if size == 0:
+            picks = np.empty(0, dtype=np.int64)
+        elif not unique:
+            picks = rng.integers(0, size, count)
+        elif count >= size:
+            picks = rng.permutation(size)
+        else:
+            picks = rng.choice(size, count, replace=False)
+        rows = np.zeros((len(picks), ROW_WIDTH), dtype=np.int64)
+        rows[:, self.columns] = self.rows[picks]
+        answers = np.asarray(self.answers[picks], dtype=np.int64)
+        return GeneratedQuestions(spec, rows, answers, exhausted=unique and count > size, source="index")
+
+class QuestionIndex:
+    """内存映射的题目空间索引，多个工作进程共享同一份页缓存"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("不是题目索引文件")
+            header_length = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(header_length).decode("utf-8"))
+        data_start = align(len(MAGIC) + 8 + header_length)
+        if header.get("version") != INDEX_VERSION:
+            raise ValueError(f"索引版本 {header.get('version')} 与当前版本 {INDEX_VERSION} 不一致，请重新构建")
+        self.built_at = header.get("built_at")
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self.entries: Dict[str, IndexEntry] = {}
+        for key, meta in header["entries"].items():
+            count = meta["count"]
+            columns = meta["columns"]
+            rows = np.ndarray((count, len(columns)), dtype=meta["rows_dtype"], buffer=self._buffer,
+                              offset=data_start + meta["rows_offset"])
+            answers = np.ndarray((count,), dtype=meta["answers_dtype"], buffer=self._buffer,
+                                 offset=data_start + meta["answers_offset"])
+            self.entries[key] = IndexEntry(meta["operation"], meta["low"], meta["high"], meta["scale"],
+                                           columns, rows, answers)
+
+    def lookup(self, spec: GenerationSpec) -> Optional[IndexEntry]:
+        """查找与约束条件对应的条目，操作数范围与当前配置不一致时视为过期"""
+        entry = self.entries.get(entry_key(spec.operation, spec.knowledge_point, spec.difficulty, spec.carry))
+        if entry is None or not entry.matches(spec):
+            return None
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "built_at": self.built_at,
+            "entries": len(self.entries),
+            "questions": sum(len(entry) for entry in self.entries.values()),
+            "size_bytes": self._buffer.size
+        }
+
+def load_question_index(path: Path) -> Optional[QuestionIndex]:
+    """启动时映射索引文件，文件不存在或无效时返回None，生成时回退到拒绝采样"""
+    if not path.exists():
+        print(f"未找到题目索引 {path}，生成题目时使用随机抽样（可运行 python question_index.py 构建）")
+        return None
+    try:
+        index = QuestionIndex(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"题目索引加载失败，使用随机抽样: {e}")
+        return None
+    print(f"题目索引已映射: {len(index.entries)} 个条目，共 {sum(len(e) for e in index.entries.values())} 道题")
+    return index
+
+def enumerate_space(spec: GenerationSpec, max_candidates: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """穷举约束条件下的全部题目，按年级比较量排序；候选数量超过上限时返回None"""
+    domain, build = OPERATIONS[spec.operation]
+    ranges = domain(spec)
+    sizes = [high - low + 1 for low, high in ranges]
+    total = math.prod(sizes)
+    if total > max_candidates:
+        return None
+    row_parts: List[np.ndarray] = []
+    answer_parts: List[np.ndarray] = []
+    for start in range(0, total, ENUMERATION_CHUNK):
+        flat = np.arange(start, min(total, start + ENUMERATION_CHUNK), dtype=np.int64)
+        coordinates = np.unravel_index(flat, sizes)
+        rows, answers = build(spec, *[coordinate.astype(np.int64) + low
+                                      for coordinate, (low, _) in zip(coordinates, ranges)])
+        row_parts.append(rows)
+        answer_parts.append(answers)
+    rows = np.concatenate(row_parts)
+    answers = np.concatenate(answer_parts)
+    first = unique_first(rows)
+    rows, answers = rows[first], answers[first]
+    order = np.argsort(grade_measure(spec.operation, rows, answers), kind="stable")
+    return rows[order], answers[order]
+
+def iter_index_specs(generator: QuestionGenerator) -> Iterator[GenerationSpec]:
+    """配置中所有 (运算类型, 知识点, 难度, 进位) 组合，不限年级"""
+    seen = set()
+    for operation, knowledge_points in OPERATION_KNOWLEDGE_POINTS.items():
+        carries = (None, True, False) if operation in ("addition", "subtraction") else (None,)
+        for knowledge_point in knowledge_points:
+            for difficulty in sorted(generator.difficulty_levels):
+                for carry in carries:
+                    try:
+                        spec = generator.make_spec(operation, knowledge_point, difficulty, None, carry)
+                    except GenerationError:
+                        continue
+                    key = entry_key(spec.operation, spec.knowledge_point, spec.difficulty, spec.carry)
+                    if key not in seen:
+                        seen.add(key)
+                        yield spec
+
+def build_question_index(generator: QuestionGenerator, output: Path, max_candidates: int) -> Dict[str, Any]:
+    """构建索引文件：先写临时文件再替换，正在运行的服务仍可使用旧的映射"""
+    start = time.perf_counter()
+    entries: Dict[str, Dict[str, Any]] = {}
+    blocks: List[np.ndarray] = []
+    offset = 0
+    skipped = 0
+    for spec in iter_index_specs(generator):
+        space = enumerate_space(spec, max_candidates)
+        if space is None:
+            skipped += 1
+            continue
+        rows, answers = space
+        columns = STORED_COLUMNS.get(spec.operation, DEFAULT_COLUMNS)
+        rows = rows[:, columns]
+        rows = rows.astype(smallest_dtype(rows))
+        answers = answers.astype(smallest_dtype(answers))
+        meta = {"operation": spec.operation, "low": spec.low, "high": spec.high, "scale": spec.scale,
+                "count": len(answers), "columns": columns, "rows_dtype": rows.dtype.str, "answers_dtype": answers.dtype.str}
+        for name, block in (("rows", rows), ("answers", answers)):
+            meta[f"{name}_offset"] = offset
+            blocks.append(block)
+            offset += align(block.nbytes)
+        entries[entry_key(spec.operation, spec.knowledge_point, spec.difficulty, spec.carry)] = meta
+
+    header = {"version": INDEX_VERSION, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"), "entries": entries}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = align(len(MAGIC) + 8 + len(header_bytes))
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    temporary = output.with_suffix(output.suffix + ".tmp")
+    with open(temporary, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        file.write(b"\0" * (data_start - file.tell()))
+        for block in blocks:
+            data = np.ascontiguousarray(block).tobytes()
+            file.write(data)
+            file.write(b"\0" * (-len(data) % ALIGNMENT))
+    temporary.replace(output)
+    return {
+        "entries": len(entries),
+        "skipped": skipped,
+        "questions": sum(meta["count"] for meta in entries.values()),
+        "size_bytes": output.stat().st_size,
+        "elapsed_seconds": round(time.perf_counter() - start, 2)
+    }
+
+def resolve_index_path(generator_config: Dict[str, Any], base_dir: Path) -> Path:
+    path = Path(generator_config.get("index_path", "data/question_index.bin"))
+    return path if path.is_absolute() else base_dir / path
+
+if __name__ == "__main__":
+    from config_loader import config_loader
+
+    math_config = config_loader.get_math_config()
+    generator_config = math_config.get("generator", {}) or {}
+    output = Path(sys.argv[1]) if len(sys.argv) > 1 else resolve_index_path(generator_config, Path(__file__).parent)
+    summary = build_question_index(QuestionGenerator(math_config), output,
+                                   generator_config.get("index_max_candidates", 4000000))
+    print(f"题目索引已写入 {output}: {summary['entries']} 个条目，共 {summary['questions']} 道题，"
+          f"{summary['size_bytes'] / 1024 / 1024:.1f} MB，跳过 {summary['skipped']} 个过大的题目空间，"
+          f"耗时 {summary['elapsed_seconds']} 秒")
@@ -0,0 +1,348 @@
+import argparse
+import marshal
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows没有rlimit，只能在服务进程内计算
+    resource = None
+
+SANDBOX_SCRIPT = Path(__file__).resolve()
+# 在沙箱中执行的计算引擎
+SANDBOX_ENGINES = ("sympy", "eval")
+
+class SandboxError(Exception):
+    """沙箱本身的故障（超时、进程退出），不应回退到其他引擎"""
+
+class SandboxTimeout(SandboxError):
+    """计算超时，计算进程已被终止"""
+
+class SandboxCrashed(SandboxError):
+    """计算进程异常退出，通常是超出了CPU或内存限制"""
+
+class SandboxUnavailable(SandboxError):
+    """模板进程无法启动或无法创建计算进程"""
+
+class EngineError(Exception):
+    """计算引擎无法处理该表达式，可以回退到下一个引擎"""
+
+def is_supported() -> bool:
+    """当前平台是否支持计算沙箱（需要rlimit和fork）"""
+    return resource is not None and hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+# 以下在模板进程和计算进程中运行
+
+def engine_functions() -> Dict[str, Callable[[str], Dict[str, Any]]]:
+    from sympy_engine import evaluate_with_eval, evaluate_with_sympy
+    return {"sympy": evaluate_with_sympy, "eval": evaluate_with_eval}
+
+def apply_limits(cpu_seconds: int, memory_mb: int) -> None:
+    """设置当前进程的CPU时间和地址空间上限，超出CPU上限时内核发送SIGXCPU终止进程"""
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_mb > 0:
+        memory_bytes = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+def cpu_time_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def serve_worker(conn: Connection, engines: Dict[str, Callable[[str], Dict[str, Any]]],
+                 cpu_seconds: int, max_tasks: int) -> None:
+    """计算进程主循环：每次接收 (引擎, 表达式)，返回 (状态, 结果, 是否需要重建)"""
+    handled = 0
+    while True:
+        try:
+            engine, code = marshal.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            return
+        try:
+            response = ("ok", engines[engine](code))
+        except ZeroDivisionError as e:
+            response = ("zero_division", str(e))
+        except MemoryError:
+            response = ("memory", "超出内存限制")
+        except Exception as e:
+            response = ("error", str(e))
+        handled += 1
+        # rlimit的CPU时间是整个进程累计的，用掉一半后重建，保证每个表达式至少有一半的额度
+        recycle = handled >= max_tasks or (cpu_seconds > 0 and cpu_time_used() > cpu_seconds / 2)
+        conn.send_bytes(marshal.dumps(response + (recycle,)))
+        if recycle:
+            return
+
+def run_zygote(control: socket.socket, cpu_seconds: int, memory_mb: int, max_tasks: int) -> None:
+    """模板进程：预先导入sympy，每收到一个socket就fork一个计算进程"""
+    engines = engine_functions()
+    engines["sympy"]("sqrt(4) + 1/2")
+    # 计算进程由模板进程fork，自动回收避免僵尸进程
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    control.send(b"ready")
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(control, 16, 1)
+        except OSError:
+            return
+        if not message or not fds:
+            # 服务进程已关闭控制通道
+            return
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            code = 0
+            try:
+                apply_limits(cpu_seconds, memory_mb)
+                serve_worker(Connection(fds[0]), engines, cpu_seconds, max_tasks)
+            except BaseException:
+                code = 1
+            os._exit(code)
+        os.close(fds[0])
+        control.send(pid.to_bytes(8, "little"))
+
+# 以下在服务进程中运行
+
+class SandboxWorker:
+    __slots__ = ("pid", "conn")
+
+    def __init__(self, pid: int, conn: Connection):
+        self.pid = pid
+        self.conn = conn
+
+    def kill(self) -> None:
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.conn.close()
+
+class SandboxPool:
+    """sympy和eval引擎的计算进程池，每个表达式独占一个计算进程，超时后终止并重建
+
+    服务进程启动一个模板进程（zygote），模板进程预先导入sympy后按需fork出带rlimit的计算进程，
+    服务进程与计算进程之间通过socketpair通信；重建计算进程只需一次fork，不必重新导入sympy
+    """
+
+    def __init__(self, workers: int = 2, cpu_seconds: int = 20, memory_mb: int = 1024, max_tasks: int = 1000,
+                 start_timeout: float = 30):
+        self.size = max(1, workers)
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_tasks = max_tasks
+        self.start_timeout = start_timeout
+        self._idle: "queue.Queue[SandboxWorker]" = queue.Queue()
+        self._live = 0
+        self._lock = threading.Lock()
+        self._control_lock = threading.Lock()
+        self._zygote: Optional[subprocess.Popen] = None
+        self._control: Optional[socket.socket] = None
+        self._closed = False
+        self.counters = {"evaluations": 0, "timeouts": 0, "crashes": 0, "spawned": 0, "recycled": 0}
+
+    def start(self) -> None:
+        """在后台启动模板进程并预先创建计算进程，不阻塞服务启动"""
+        threading.Thread(target=self._prefork, name="sandbox-prefork", daemon=True).start()
+
+    def _prefork(self) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or self._live >= self.size:
+                        break
+                    self._live += 1
+                try:
+                    self._idle.put(self._spawn_worker())
+                except Exception:
+                    with self._lock:
+                        self._live -= 1
+                    raise
+            print(f"计算沙箱已就绪: {self._live} 个计算进程，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            print(f"计算沙箱启动失败，将在请求时重试: {e}")
+
+    def _start_zygote(self) -> None:
+        parent_socket, child_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self._zygote = subprocess.Popen(
+                [sys.executable, str(SANDBOX_SCRIPT), "--zygote", str(child_socket.fileno()),
+                 "--cpu-seconds", str(self.cpu_seconds), "--memory-mb", str(self.memory_mb),
+                 "--max-tasks", str(self.max_tasks)],
+                pass_fds=(child_socket.fileno(),), cwd=str(SANDBOX_SCRIPT.parent), stdin=subprocess.DEVNULL
+            )
+        finally:
+            child_socket.close()
+        parent_socket.settimeout(self.start_timeout)
+        try:
+            ready = parent_socket.recv(16)
+        except OSError as e:
+            ready = b""
+            print(f"等待计算沙箱模板进程失败: {e}")
+        if ready != b"ready":
+            parent_socket.close()
+            self._zygote.kill()
+            self._zygote.wait()
+            raise SandboxUnavailable("计算沙箱模板进程启动失败")
+        parent_socket.settimeout(5)
+        self._control = parent_socket
+
+    def _spawn_worker(self) -> SandboxWorker:
+        """请模板进程fork一个计算进程，模板进程已退出时重新启动"""
+        with self._control_lock:
+            if self._closed:
+                raise SandboxUnavailable("计算沙箱已关闭")
+            if self._zygote is None or self._zygote.poll() is not None:
+                if self._control is not None:
+                    self._control.close()
+                self._start_zygote()
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                socket.send_fds(self._control, [b"fork"], [theirs.fileno()])
+                pid = int.from_bytes(self._control.recv(8), "little")
+            except OSError as e:
+                ours.close()
+                raise SandboxUnavailable(f"创建计算进程失败: {e}")
+            finally:
+                theirs.close()
+        self._count("spawned")
+        return SandboxWorker(pid, Connection(ours.detach()))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def _acquire(self, timeout: float) -> SandboxWorker:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            spawn = self._live < self.size
+            if spawn:
+                self._live += 1
+        if spawn:
+            try:
+                return self._spawn_worker()
+            except Exception:
+                with self._lock:
+                    self._live -= 1
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise SandboxTimeout(f"等待计算进程超时 ({timeout}秒)")
+
+    def _replace(self, worker: SandboxWorker) -> None:
+        """终止计算进程并补充一个新的"""
+        worker.kill()
+        try:
+            self._idle.put(self._spawn_worker())
+        except Exception as e:
+            with self._lock:
+                self._live -= 1
+            print(f"重建计算进程失败: {e}")
+
+    def evaluate(self, engine: str, code: str, timeout: float = 10) -> Dict[str, Any]:
+        """在计算进程中执行引擎，返回结果dict
+
+        引擎无法处理时抛出EngineError，除数为0时抛出ZeroDivisionError，超时或进程退出时抛出SandboxError
+        """
+        worker = self._acquire(timeout)
+        self._count("evaluations")
+        try:
+            worker.conn.send_bytes(marshal.dumps((engine, code)))
+            ready = worker.conn.poll(timeout)
+        except OSError:
+            ready = None
+        if ready is False:
+            # 计算进程内无法中断的计算（如 9**9**9）只能终止进程
+            self._count("timeouts")
+            self._replace(worker)
+            raise SandboxTimeout(f"执行超时 ({timeout}秒)")
+        try:
+            if ready is None:
+                raise EOFError
+            status, payload, recycle = marshal.loads(worker.conn.recv_bytes())
+        except (EOFError, OSError, ValueError):
+            self._count("crashes")
+            self._replace(worker)
+            raise SandboxCrashed("计算进程异常退出，可能超出了CPU或内存限制")
+        if recycle:
+            self._count("recycled")
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if status == "ok":
+            return payload
+        if status == "zero_division":
+            raise ZeroDivisionError(payload)
+        if status == "memory":
+            raise SandboxCrashed(payload)
+        raise EngineError(payload)
+
+    def shutdown(self) -> None:
+        """终止全部计算进程和模板进程"""
+        with self._control_lock:
+            self._closed = True
+            while True:
+                try:
+                    self._idle.get_nowait().kill()
+                except queue.Empty:
+                    break
+            if self._control is not None:
+                self._control.close()
+                self._control = None
+            if self._zygote is not None:
+                self._zygote.terminate()
+                try:
+                    self._zygote.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    self._zygote.kill()
+                self._zygote = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._live,
+            "idle": self._idle.qsize(),
+            "cpu_seconds": self.cpu_seconds,
+            "memory_mb": self.memory_mb,
+            "zygote_pid": self._zygote.pid if self._zygote is not None else None,
+            **self.counters
+        }
+
+def create_sandbox_pool(config: Optional[Dict[str, Any]]) -> Optional[SandboxPool]:
+    """根据mcp_server.sandbox配置创建计算沙箱；未启用或平台不支持时返回None，在服务进程内计算"""
+    config = config or {}
+    if not config.get("enabled", True):
+        return None
+    if not is_supported():
+        print("当前平台不支持计算沙箱（需要rlimit和fork），sympy和eval引擎在服务进程内计算")
+        return None
+    return SandboxPool(
+        workers=config.get("workers", 2),
+        cpu_seconds=config.get("cpu_seconds", 20),
+        memory_mb=config.get("memory_mb", 1024),
+        max_tasks=config.get("max_tasks", 1000)
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="计算沙箱模板进程，由服务进程启动")
+    parser.add_argument("--zygote", type=int, required=True, help="控制通道的文件描述符")
+    parser.add_argument("--cpu-seconds", type=int, default=20)
+    parser.add_argument("--memory-mb", type=int, default=1024)
+    parser.add_argument("--max-tasks", type=int, default=1000)
+    args = parser.parse_args()
+    # 服务进程按Ctrl+C时由服务进程负责关闭沙箱
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_zygote(socket.socket(fileno=args.zygote), args.cpu_seconds, args.memory_mb, args.max_tasks)
@@ -0,0 +1,201 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+class SchedulerFullError(Exception):
+    """任务队列已满，调用方应稍后重试"""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"执行队列已满: {lane}")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class Job:
+    """调度器中的单个任务"""
+
+    __slots__ = ("fn", "args", "lane", "timeout", "on_timeout", "future",
+                 "enqueued_at", "started_at", "deadline", "timed_out")
+
+    def __init__(self, fn: Callable, args: tuple, lane: str, timeout: Optional[float],
+                 on_timeout: Optional[Callable[[], None]]):
+        self.fn = fn
+        self.args = args
+        self.lane = lane
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.timed_out = False
+
+class ExecutionScheduler:
+    """有界工作线程池 + 分优先级队列，队列满时拒绝新任务"""
+
+    def __init__(self, max_workers: int = 4, max_queue_size: int = 256,
+                 lanes: Optional[List[str]] = None, retry_after: int = 1):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.lanes = lanes or ["interactive", "bulk"]
+        self.retry_after = retry_after
+        # 车道在列表中的位置即优先级，越靠前越先执行
+        self._lane_priority = {lane: index for index, lane in enumerate(self.lanes)}
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._queued: Dict[str, int] = {lane: 0 for lane in self.lanes}
+        self._running: Dict[int, Job] = {}
+        self._workers: List[threading.Thread] = []
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        # 统计数据
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_total = 0.0
+        self._wait_count = 0
+        self._wait_max = 0.0
+
+    def start(self) -> None:
+        """启动工作线程和超时监控线程"""
+        with self._lock:
+            if self._workers:
+                return
+            self._stopping.clear()
+            for index in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"exec-worker-{index}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._watchdog = threading.Thread(target=self._watchdog_loop, name="exec-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def shutdown(self) -> None:
+        """停止调度器，未执行的任务将被取消"""
+        self._stopping.set()
+        for _ in self._workers:
+            self._queue.put((len(self.lanes), next(self._sequence), None))
+        for worker in self._workers:
+            worker.join(timeout=1)
+        self._workers = []
+        while True:
+            try:
+                _, _, job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+        with self._lock:
+            self._queued = {lane: 0 for lane in self.lanes}
+
+    def submit(self, fn: Callable, *args: Any, lane: Optional[str] = None,
+               timeout: Optional[float] = None, on_timeout: Optional[Callable[[], None]] = None) -> Job:
+        """提交任务；队列已满时抛出SchedulerFullError"""
+        lane = lane if lane in self._lane_priority else self.lanes[0]
+        if not self._workers:
+            self.start()
+
+        job = Job(fn, args, lane, timeout, on_timeout)
+        with self._lock:
+            if sum(self._queued.values()) >= self.max_queue_size:
+                self._rejected += 1
+                raise SchedulerFullError(lane, self.retry_after)
+            self._queued[lane] += 1
+            self._submitted += 1
+        self._queue.put((self._lane_priority[lane], next(self._sequence), job))
+        return job
+
+    def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            _, _, job = self._queue.get()
+            if job is None:
+                break
+
+            now = time.monotonic()
+            waited = now - job.enqueued_at
+            with self._lock:
+                self._queued[job.lane] -= 1
+                self._wait_total += waited
+                self._wait_count += 1
+                self._wait_max = max(self._wait_max, waited)
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            # 在队列中等待已超过超时时间的任务直接判定超时
+            if job.timeout is not None and waited >= job.timeout:
+                self._expire(job)
+                continue
+
+            job.started_at = now
+            if job.timeout is not None:
+                job.deadline = now + job.timeout - waited
+            ident = threading.get_ident()
+            with self._lock:
+                self._running[ident] = job
+            try:
+                result = job.fn(*job.args)
+                if not job.timed_out:
+                    job.future.set_result(result)
+            except Exception as e:
+                if not job.timed_out:
+                    job.future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running.pop(ident, None)
+                    self._completed += 1
+
+    def _watchdog_loop(self) -> None:
+        """定期检查运行中的任务，超过截止时间的标记为超时"""
+        while not self._stopping.wait(0.1):
+            now = time.monotonic()
+            with self._lock:
+                expired = [job for job in self._running.values()
+                           if job.deadline is not None and not job.timed_out and now >= job.deadline]
+            for job in expired:
+                self._expire(job)
+
+    def _expire(self, job: Job) -> None:
+        # 线程无法被强制终止，超时后任务结果将被丢弃
+        job.timed_out = True
+        with self._lock:
+            self._timed_out += 1
+        if job.on_timeout is not None:
+            try:
+                job.on_timeout()
+            except Exception as e:
+                print(f"超时回调执行失败: {e}")
+        if not job.future.done():
+            job.future.set_exception(TimeoutError(f"任务执行超时 ({job.timeout}秒)"))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取调度器运行状态，用于调优"""
+        now = time.monotonic()
+        with self._lock:
+            oldest_running = max((now - job.started_at for job in self._running.values() if job.started_at), default=0.0)
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "busy_workers": len(self._running),
+                "queue_depth": sum(self._queued.values()),
+                "queue_depth_by_lane": dict(self._queued),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_wait_ms": round(self._wait_total / self._wait_count * 1000, 3) if self._wait_count else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "oldest_running_ms": round(oldest_running * 1000, 3)
+            }
+
+def create_scheduler(config: Dict[str, Any]) -> ExecutionScheduler:
+    """根据mcp_server.scheduler配置创建调度器"""
+    return ExecutionScheduler(
+        max_workers=config.get("max_workers", 4),
+        max_queue_size=config.get("max_queue_size", 256),
+        lanes=config.get("lanes", ["interactive", "bulk"]),
+        retry_after=config.get("retry_after", 1)
+    )
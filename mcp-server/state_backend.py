@@ -0,0 +1,447 @@
+import json
+import random
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+# 记录中保存版本号的字段，每次更新加1，用于跨进程发现变化
+VERSION_FIELD = "_version"
+
+Record = Dict[str, Any]
+
+class StateBackendError(RuntimeError):
+    """共享状态存储不可用"""
+
+class SQLiteStateBackend:
+    """SQLite（WAL模式）共享状态存储，同一台机器上的多个工作进程共用一个数据库文件"""
+
+    kind = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, status TEXT, "
+            "updated_at REAL NOT NULL, version INTEGER NOT NULL DEFAULT 1, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS state_expiry ON state (namespace, status, updated_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程使用自己的连接，WAL模式下读写互不阻塞"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _load(value: str, version: int) -> Record:
+        record = json.loads(value)
+        record[VERSION_FIELD] = version
+        return record
+
+    def create(self, namespace: str, key: str, record: Record) -> None:
+        """写入新记录（已存在时覆盖），插入顺序即创建顺序"""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, status, updated_at, version) VALUES (?, ?, ?, ?, ?, 1)",
+            (namespace, key, json.dumps(record, ensure_ascii=False), record.get("status"),
+             record.get("updated_at") or time.time())
+        )
+
+    def update(self, namespace: str, key: str, fields: Record,
+               defaults: Optional[Record] = None) -> Optional[Record]:
+        """合并字段并返回更新后的记录；defaults中的字段只在记录中没有该字段时写入；记录不存在时返回None"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, version FROM state WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            record = json.loads(row[0])
+            record.update(fields)
+            for name, value in (defaults or {}).items():
+                record.setdefault(name, value)
+            version = row[1] + 1
+            conn.execute(
+                "UPDATE state SET value = ?, status = ?, updated_at = ?, version = ? WHERE namespace = ? AND key = ?",
+                (json.dumps(record, ensure_ascii=False), record.get("status"),
+                 record.get("updated_at") or time.time(), version, namespace, key)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        record[VERSION_FIELD] = version
+        return record
+
+    def get(self, namespace: str, key: str) -> Optional[Record]:
+        row = self._connection().execute("SELECT value, version FROM state WHERE namespace = ? AND key = ?",
+                                         (namespace, key)).fetchone()
+        return self._load(*row) if row is not None else None
+
+    def delete(self, namespace: str, keys: Sequence[str]) -> int:
+        if not keys:
+            return 0
+        cursor = self._connection().executemany("DELETE FROM state WHERE namespace = ? AND key = ?",
+                                                [(namespace, key) for key in keys])
+        return cursor.rowcount
+
+    def recent(self, namespace: str, limit: Optional[int] = None) -> List[Tuple[str, Record]]:
+        """按创建顺序返回最近的limit条记录，limit为None时返回全部"""
+        if limit is None:
+            rows = self._connection().execute(
+                "SELECT key, value, version FROM state WHERE namespace = ? ORDER BY rowid", (namespace,)).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT key, value, version FROM state WHERE namespace = ? ORDER BY rowid DESC LIMIT ?",
+                (namespace, limit)).fetchall()
+            rows.reverse()
+        return [(key, self._load(value, version)) for key, value, version in rows]
+
+    def count(self, namespace: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM state WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def versions(self, namespace: str, keys: Sequence[str]) -> Dict[str, int]:
+        """批量读取记录的版本号，不存在的记录不返回"""
+        result: Dict[str, int] = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT key, version FROM state WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                (namespace, *chunk)).fetchall()
+            result.update(rows)
+        return result
+
+    def expire(self, namespace: str, statuses: Sequence[str], cutoff: float) -> int:
+        """删除指定状态下updated_at早于cutoff的记录"""
+        cursor = self._connection().execute(
+            f"DELETE FROM state WHERE namespace = ? AND status IN ({','.join('?' * len(statuses))}) AND updated_at < ?",
+            (namespace, *statuses, cutoff))
+        return cursor.rowcount
+
+    def trim(self, namespace: str, max_entries: int, statuses: Sequence[str]) -> int:
+        """超出容量时先删除最旧的已结束记录，仍超出时再删除最旧的记录"""
+        conn = self._connection()
+        evicted = 0
+        overflow = self.count(namespace) - max_entries
+        if overflow > 0:
+            evicted += conn.execute(
+                f"DELETE FROM state WHERE rowid IN (SELECT rowid FROM state WHERE namespace = ? "
+                f"AND status IN ({','.join('?' * len(statuses))}) ORDER BY rowid LIMIT ?)",
+                (namespace, *statuses, overflow)).rowcount
+            overflow -= evicted
+        if overflow > 0:
+            evicted += conn.execute(
+                "DELETE FROM state WHERE rowid IN (SELECT rowid FROM state WHERE namespace = ? ORDER BY rowid LIMIT ?)",
+                (namespace, overflow)).rowcount
+        return evicted
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "path": self.path}
+
+class RespError(StateBackendError):
+    """Redis协议返回的错误"""
+
+class RespConnection:
+    """最小的Redis协议（RESP2）客户端连接，不依赖redis包，可连接任何兼容Redis协议的服务"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None, timeout: float = 5.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    @staticmethod
+    def _encode(args: Sequence[Any]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise StateBackendError("Redis连接已关闭")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b"+":
+            return body.decode("utf-8")
+        if prefix == b"-":
+            return RespError(body.decode("utf-8"))
+        if prefix == b":":
+            return int(body)
+        if prefix == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if prefix == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise StateBackendError(f"无法识别的Redis响应: {line!r}")
+
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """一次发送多条命令再依次读取响应，命令错误以RespError对象返回"""
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    def execute(self, *args: Any) -> Any:
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+class RedisStateBackend:
+    """Redis协议的共享状态存储，多台机器上的工作进程可共用
+
+    每条记录是一个哈希（字段值为JSON），另有一个有序集合按创建时间索引记录
+    """
+
+    kind = "redis"
+
+    def __init__(self, url: str = "redis://localhost:6379/0", key_prefix: str = "mcp", timeout: float = 5.0,
+                 update_retries: int = 50):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self.update_retries = update_retries
+        self._local = threading.local()
+        self._connection().execute("PING")
+
+    def _connection(self) -> RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+            except OSError as e:
+                raise StateBackendError(f"无法连接Redis {self.host}:{self.port}: {e}")
+            self._local.conn = conn
+        return conn
+
+    def _pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """连接断开时重连并重试一次"""
+        try:
+            replies = self._connection().pipeline(commands)
+        except (OSError, StateBackendError):
+            self.close()
+            replies = self._connection().pipeline(commands)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.key_prefix}:{namespace}:{key}"
+
+    def _index(self, namespace: str) -> str:
+        return f"{self.key_prefix}:{namespace}:__index__"
+
+    @staticmethod
+    def _flatten(fields: Record) -> List[str]:
+        return [item for name, value in fields.items() for item in (name, json.dumps(value, ensure_ascii=False))]
+
+    @staticmethod
+    def _load(flat: Optional[List[str]]) -> Optional[Record]:
+        if not flat:
+            return None
+        record = {name: json.loads(value) for name, value in zip(flat[::2], flat[1::2])}
+        record[VERSION_FIELD] = int(record.get(VERSION_FIELD) or 0)
+        return record
+
+    def create(self, namespace: str, key: str, record: Record) -> None:
+        redis_key = self._key(namespace, key)
+        self._pipeline([
+            ("MULTI",),
+            ("DEL", redis_key),
+            ("HSET", redis_key, *self._flatten({**record, VERSION_FIELD: 1})),
+            ("ZADD", self._index(namespace), time.time(), key),
+            ("EXEC",),
+        ])
+
+    def update(self, namespace: str, key: str, fields: Record,
+               defaults: Optional[Record] = None) -> Optional[Record]:
+        """WATCH记录并确认存在后在事务中更新；记录在此期间被修改或删除时EXEC不执行，重新检查后重试"""
+        redis_key = self._key(namespace, key)
+        commands: List[Sequence[Any]] = [("MULTI",), ("HSET", redis_key, *self._flatten(fields))]
+        for name, value in (defaults or {}).items():
+            commands.append(("HSETNX", redis_key, name, json.dumps(value, ensure_ascii=False)))
+        commands += [("HINCRBY", redis_key, VERSION_FIELD, 1), ("HGETALL", redis_key), ("EXEC",)]
+        for attempt in range(self.update_retries):
+            if attempt:
+                # 同一记录并发更新时随机退避，避免各连接反复互相使事务失效
+                time.sleep(random.uniform(0, 0.001 * min(attempt, 20)))
+            if not self._pipeline([("WATCH", redis_key), ("EXISTS", redis_key)])[1]:
+                self._pipeline([("UNWATCH",)])
+                return None
+            # WATCH只对当前连接有效，事务不能在断线重连后的新连接上执行，断线时从WATCH起整体重试
+            try:
+                replies = self._connection().pipeline(commands)
+            except (OSError, StateBackendError):
+                self.close()
+                continue
+            for reply in replies:
+                if isinstance(reply, RespError):
+                    raise reply
+            if replies[-1] is not None:
+                return self._load(replies[-1][-1])
+        raise StateBackendError(f"更新记录 {namespace}:{key} 时连续冲突 {self.update_retries} 次")
+
+    def get(self, namespace: str, key: str) -> Optional[Record]:
+        return self._load(self._pipeline([("HGETALL", self._key(namespace, key))])[0])
+
+    def delete(self, namespace: str, keys: Sequence[str]) -> int:
+        if not keys:
+            return 0
+        replies = self._pipeline([("DEL", *[self._key(namespace, key) for key in keys]),
+                                  ("ZREM", self._index(namespace), *keys)])
+        return replies[0]
+
+    def _keys(self, namespace: str, limit: Optional[int] = None) -> List[str]:
+        if limit is None:
+            return self._pipeline([("ZRANGE", self._index(namespace), 0, -1)])[0]
+        keys = self._pipeline([("ZREVRANGE", self._index(namespace), 0, limit - 1)])[0] if limit > 0 else []
+        return list(reversed(keys))
+
+    def recent(self, namespace: str, limit: Optional[int] = None) -> List[Tuple[str, Record]]:
+        keys = self._keys(namespace, limit)
+        if not keys:
+            return []
+        replies = self._pipeline([("HGETALL", self._key(namespace, key)) for key in keys])
+        return [(key, record) for key, record in zip(keys, map(self._load, replies)) if record is not None]
+
+    def count(self, namespace: str) -> int:
+        return self._pipeline([("ZCARD", self._index(namespace))])[0]
+
+    def versions(self, namespace: str, keys: Sequence[str]) -> Dict[str, int]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        replies = self._pipeline([("HGET", self._key(namespace, key), VERSION_FIELD) for key in keys])
+        return {key: int(json.loads(value)) for key, value in zip(keys, replies) if value is not None}
+
+    def _scan(self, namespace: str) -> List[Tuple[str, Optional[str], float]]:
+        """列出全部记录的 (键, 状态, 更新时间)，索引中已不存在的记录状态为None"""
+        keys = self._keys(namespace)
+        if not keys:
+            return []
+        replies = self._pipeline([("HMGET", self._key(namespace, key), "status", "updated_at") for key in keys])
+        return [(key, json.loads(status) if status is not None else None,
+                 json.loads(updated_at) if updated_at is not None else 0.0)
+                for key, (status, updated_at) in zip(keys, replies)]
+
+    def expire(self, namespace: str, statuses: Sequence[str], cutoff: float) -> int:
+        entries = self._scan(namespace)
+        stale = [key for key, status, _ in entries if status is None]
+        if stale:
+            self._pipeline([("ZREM", self._index(namespace), *stale)])
+        expired = [key for key, status, updated_at in entries if status in statuses and updated_at < cutoff]
+        return self.delete(namespace, expired)
+
+    def trim(self, namespace: str, max_entries: int, statuses: Sequence[str]) -> int:
+        entries = self._scan(namespace)
+        overflow = len(entries) - max_entries
+        if overflow <= 0:
+            return 0
+        victims = [key for key, status, _ in entries if status in statuses][:overflow]
+        chosen = set(victims)
+        victims += [key for key, _, _ in entries if key not in chosen][:overflow - len(victims)]
+        return self.delete(namespace, victims)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+            self._local.conn = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "url": f"redis://{self.host}:{self.port}/{self.db}", "key_prefix": self.key_prefix}
+
+class SharedMapping(MutableMapping):
+    """保存在共享状态存储中的dict，各工作进程看到同一份数据（如自定义AI配置）"""
+
+    def __init__(self, backend: Any, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    @staticmethod
+    def _strip(record: Record) -> Record:
+        record.pop(VERSION_FIELD, None)
+        return record
+
+    def __getitem__(self, key: str) -> Any:
+        record = self.backend.get(self.namespace, key)
+        if record is None:
+            raise KeyError(key)
+        return self._strip(record)
+
+    def __setitem__(self, key: str, value: Record) -> None:
+        self.backend.create(self.namespace, key, dict(value))
+
+    def __delitem__(self, key: str) -> None:
+        if not self.backend.delete(self.namespace, [key]):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.backend.get(self.namespace, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([key for key, _ in self.backend.recent(self.namespace)])
+
+    def __len__(self) -> int:
+        return self.backend.count(self.namespace)
+
+    def items(self):
+        """一次读取全部记录，避免逐个键查询"""
+        return [(key, self._strip(record)) for key, record in self.backend.recent(self.namespace)]
+
+def create_state_backend(config: Optional[Dict[str, Any]], base_dir: Path):
+    """根据mcp_server.state_backend配置创建共享状态存储；memory（默认）返回None，使用进程内存储"""
+    config = config or {}
+    kind = config.get("type", "memory")
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        path = Path(config.get("sqlite_path", "data/state.sqlite3"))
+        return SQLiteStateBackend(str(path if path.is_absolute() else base_dir / path),
+                                  busy_timeout=config.get("busy_timeout", 5.0))
+    if kind == "redis":
+        return RedisStateBackend(config.get("redis_url", "redis://localhost:6379/0"),
+                                 key_prefix=config.get("key_prefix", "mcp"), timeout=config.get("timeout", 5.0))
+    raise StateBackendError(f"不支持的状态存储类型: {kind}")
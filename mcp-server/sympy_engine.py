@@ -0,0 +1,35 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# sympy导入约需0.4秒，首次使用时才导入；服务进程中由启动后的后台任务预热，计算沙箱中由模板进程预先导入
+sympy_lock = threading.Lock()
+sympy_modules: Optional[Tuple[Any, Any]] = None
+
+def load_sympy() -> Tuple[Any, Any]:
+    """返回 (sympy模块, parse_expr)，首次调用时导入"""
+    global sympy_modules
+    if sympy_modules is None:
+        with sympy_lock:
+            if sympy_modules is None:
+                import sympy
+                from sympy.parsing.sympy_parser import parse_expr
+                sympy_modules = (sympy, parse_expr)
+    return sympy_modules
+
+def expression_functions() -> Dict[str, Any]:
+    """规范化后的表达式中√和%被改写为sqrt()和percent()"""
+    sp, _ = load_sympy()
+    return {"sqrt": sp.sqrt, "percent": lambda value: value / 100}
+
+def evaluate_with_sympy(clean_code: str) -> Dict[str, Any]:
+    """使用sympy解析和计算表达式"""
+    _, parse_expr = load_sympy()
+    expr = parse_expr(clean_code, local_dict=expression_functions(), evaluate=False)
+    result = expr.evalf()
+    return {"result": str(result)}
+
+def evaluate_with_eval(clean_code: str) -> Dict[str, Any]:
+    """使用eval计算表达式，只提供sqrt()和percent()，不提供任何内置函数；计算失败时异常交给调用方处理"""
+    sp, _ = load_sympy()
+    result = eval(clean_code, {"__builtins__": {}}, {"sp": sp, **expression_functions()})
+    return {"result": str(result)}
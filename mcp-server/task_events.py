@@ -0,0 +1,88 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from task_store import TERMINAL_STATUSES, TaskRecord, TaskStore
+
+# 长轮询的最长等待时间（秒）
+MAX_WAIT_SECONDS = 60
+
+async def wait_for_task(store: TaskStore, task_id: str, wait: float) -> Optional[TaskRecord]:
+    """长轮询：等待任务进入终态或超时，返回最新的任务记录"""
+    record = await store.aget(task_id)
+    if record is None or record.is_terminal or wait <= 0:
+        return record
+
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Event()
+
+    def on_update(store_name: str, updated_id: str, snapshot: Dict[str, Any]) -> None:
+        if snapshot["status"] in TERMINAL_STATUSES:
+            loop.call_soon_threadsafe(finished.set)
+
+    await store.awatch([task_id], on_update)
+    try:
+        # 订阅前任务可能已经结束或被清理
+        current = await store.aget(task_id)
+        if current is not None and not current.is_terminal:
+            try:
+                await asyncio.wait_for(finished.wait(), timeout=min(wait, MAX_WAIT_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        store.unwatch([task_id], on_update)
+    return await store.aget(task_id)
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE消息"""
+    payload = json.dumps(jsonable_encoder(data), ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+async def stream_task_events(subscriptions: List[Tuple[TaskStore, List[str]]],
+                             heartbeat: float = 15) -> AsyncIterator[str]:
+    """通过一个SSE连接推送多个任务的状态变化，所有任务结束后关闭连接"""
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Tuple[str, str, Dict[str, Any]]]" = asyncio.Queue()
+
+    def on_update(store_name: str, task_id: str, snapshot: Dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, (store_name, task_id, snapshot))
+
+    pending = set()
+    stores = {store.name: store for store, _ in subscriptions}
+    try:
+        for store, task_ids in subscriptions:
+            await store.awatch(task_ids, on_update)
+
+        # 先推送当前状态，不存在的任务直接报告
+        for store, task_ids in subscriptions:
+            for task_id in task_ids:
+                record = await store.aget(task_id)
+                if record is None:
+                    yield format_sse("missing", {"store": store.name, "task_id": task_id})
+                    continue
+                yield format_sse("task", {"store": store.name, "task_id": task_id, **record.to_dict()})
+                if not record.is_terminal:
+                    pending.add((store.name, task_id))
+
+        while pending:
+            try:
+                store_name, task_id, snapshot = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # 未结束的任务可能已被TTL或容量上限淘汰，不会再有更新，报告后不再等待
+                for store_name, task_id in sorted(pending):
+                    if await stores[store_name].aget(task_id) is None:
+                        pending.discard((store_name, task_id))
+                        yield format_sse("missing", {"store": store_name, "task_id": task_id, "reason": "expired"})
+                # 心跳注释，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse("task", {"store": store_name, "task_id": task_id, **snapshot})
+            if snapshot["status"] in TERMINAL_STATUSES:
+                pending.discard((store_name, task_id))
+
+        yield format_sse("done", {})
+    finally:
+        for store, task_ids in subscriptions:
+            store.unwatch(task_ids, on_update)
@@ -0,0 +1,392 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# 终态任务才会按TTL过期
+TERMINAL_STATUSES = ("completed", "failed")
+
+# 任务状态变化的回调：(存储名称, 任务ID, 任务快照)
+TaskWatcher = Callable[[str, str, Dict[str, Any]], None]
+
+class TaskRecord:
+    """紧凑的任务记录，使用__slots__代替每个任务一个dict"""
+
+    __slots__ = ("status", "result", "error", "analysis",
+                 "submitted_at", "started_at", "completed_at", "updated_at",
+                 "total", "completed", "mismatches", "failures")
+
+    FIELDS = __slots__
+
+    def __init__(self, status: str = "submitted", **fields: Any):
+        now = time.time()
+        self.status = status
+        self.result = None
+        self.error = None
+        self.analysis = None
+        self.submitted_at = now
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+        self.updated_at = now
+        # 批量任务的进度字段，单个任务保持为None
+        self.total: Optional[int] = None
+        self.completed: Optional[int] = None
+        self.mismatches: Optional[int] = None
+        self.failures: Optional[int] = None
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    @staticmethod
+    def format_time(timestamp: Optional[float]) -> Optional[str]:
+        return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为dict，时间字段格式化为ISO字符串"""
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        for name in ("submitted_at", "started_at", "completed_at", "updated_at"):
+            data[name] = self.format_time(data[name])
+        return data
+
+class TaskStore:
+    """带TTL和容量上限的任务存储，由后台线程定期清理过期任务
+
+    异步代码使用a开头的方法（aget、aupdate等）：进程内存储直接执行，共享存储在线程池中执行
+    """
+
+    # 操作是否会阻塞（等待SQLite锁、Redis往返），进程内存储只需加锁
+    blocking = False
+
+    def __init__(self, name: str, ttl_seconds: float = 3600, max_entries: int = 100000,
+                 sweep_interval: float = 60):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.sweep_interval = sweep_interval
+        self._records: "OrderedDict[str, TaskRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._watchers: Dict[str, Set[TaskWatcher]] = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self, task_id: str, **fields: Any) -> TaskRecord:
+        """创建任务记录，超出容量时立即淘汰最旧的任务"""
+        record = TaskRecord(**fields)
+        with self._lock:
+            self._records[task_id] = record
+            if len(self._records) > self.max_entries:
+                self._evict_overflow()
+        return record
+
+    def update(self, task_id: str, **fields: Any) -> Optional[TaskRecord]:
+        """更新任务字段；任务已被清理时返回None"""
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return None
+            for name, value in fields.items():
+                setattr(record, name, value)
+            record.updated_at = time.time()
+            if record.is_terminal and record.completed_at is None:
+                record.completed_at = record.updated_at
+            watchers = list(self._watchers.get(task_id, ()))
+            snapshot = record.to_dict() if watchers else None
+        # 在锁外通知订阅者，避免回调阻塞其他更新
+        for watcher in watchers:
+            try:
+                watcher(self.name, task_id, snapshot)
+            except Exception as e:
+                print(f"任务状态通知失败 ({self.name}): {e}")
+        return record
+
+    def watch(self, task_ids: Iterable[str], watcher: TaskWatcher) -> None:
+        """订阅任务状态变化，任务每次更新后回调watcher"""
+        with self._lock:
+            for task_id in task_ids:
+                self._watchers.setdefault(task_id, set()).add(watcher)
+
+    def unwatch(self, task_ids: Iterable[str], watcher: TaskWatcher) -> None:
+        """取消订阅"""
+        with self._lock:
+            for task_id in task_ids:
+                watchers = self._watchers.get(task_id)
+                if watchers is None:
+                    continue
+                watchers.discard(watcher)
+                if not watchers:
+                    del self._watchers[task_id]
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self._records.get(task_id)
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._records.pop(task_id, None)
+
+    def recent(self, limit: int) -> List[Tuple[str, TaskRecord]]:
+        """按创建顺序返回最近的limit个任务"""
+        with self._lock:
+            items = list(self._records.items())
+        return items[-limit:] if limit > 0 else []
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    async def _call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def acreate(self, task_id: str, **fields: Any) -> TaskRecord:
+        return await self._call(self.create, task_id, **fields)
+
+    async def aupdate(self, task_id: str, **fields: Any) -> Optional[TaskRecord]:
+        return await self._call(self.update, task_id, **fields)
+
+    async def aget(self, task_id: str) -> Optional[TaskRecord]:
+        return await self._call(self.get, task_id)
+
+    async def adelete(self, task_id: str) -> None:
+        await self._call(self.delete, task_id)
+
+    async def arecent(self, limit: int) -> List[Tuple[str, TaskRecord]]:
+        return await self._call(self.recent, limit)
+
+    async def awatch(self, task_ids: Iterable[str], watcher: TaskWatcher) -> None:
+        await self._call(self.watch, list(task_ids), watcher)
+
+    async def astats(self) -> Dict[str, Any]:
+        return await self._call(self.stats)
+
+    def _evict_overflow(self) -> None:
+        # 优先淘汰已结束的任务，仍超出时再淘汰最旧的任务
+        overflow = len(self._records) - self.max_entries
+        victims = []
+        for task_id, record in self._records.items():
+            if len(victims) >= overflow:
+                break
+            if record.is_terminal:
+                victims.append(task_id)
+        for task_id in victims:
+            del self._records[task_id]
+            self.evicted += 1
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+            self.evicted += 1
+
+    def sweep(self) -> int:
+        """清理超过TTL的已结束任务，返回清理数量"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [task_id for task_id, record in self._records.items()
+                       if record.is_terminal and record.updated_at < cutoff]
+            for task_id in expired:
+                del self._records[task_id]
+            self.expired += len(expired)
+        return len(expired)
+
+    def start_sweeper(self) -> None:
+        """启动后台清理线程"""
+        if self._sweeper is not None:
+            return
+        self._stopping.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name=f"{self.name}-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stopping.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=1)
+            self._sweeper = None
+
+    def _sweep_loop(self) -> None:
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"清理过期任务失败 ({self.name}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取任务存储统计信息"""
+        return {
+            "size": len(self._records),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "watched_tasks": len(self._watchers)
+        }
+
+class SharedTaskStore(TaskStore):
+    """保存在共享状态存储（SQLite/Redis）中的任务，多个工作进程可以查询和等待同一个任务
+
+    本进程内的更新立即通知订阅者；其他进程的更新由轮询线程按版本号发现后通知
+    """
+
+    blocking = True
+
+    def __init__(self, name: str, backend: Any, ttl_seconds: float = 3600, max_entries: int = 100000,
+                 sweep_interval: float = 60, poll_interval: float = 0.05):
+        super().__init__(name, ttl_seconds, max_entries, sweep_interval)
+        self.backend = backend
+        self.poll_interval = poll_interval
+        # 已通知过订阅者的版本号，避免本进程的更新被轮询再次通知
+        self._notified: Dict[str, int] = {}
+        self._poller: Optional[threading.Thread] = None
+        self._watch_changed = threading.Condition(self._lock)
+
+    @staticmethod
+    def _to_record(data: Optional[Dict[str, Any]]) -> Optional[TaskRecord]:
+        if data is None:
+            return None
+        fields = {name: value for name, value in data.items() if name in TaskRecord.FIELDS}
+        return TaskRecord(**fields)
+
+    def create(self, task_id: str, **fields: Any) -> TaskRecord:
+        record = TaskRecord(**fields)
+        # 空字段不写入，update时completed_at等字段才能按“不存在时写入”处理
+        data = {name: getattr(record, name) for name in TaskRecord.FIELDS if getattr(record, name) is not None}
+        self.backend.create(self.name, task_id, data)
+        return record
+
+    def update(self, task_id: str, **fields: Any) -> Optional[TaskRecord]:
+        now = time.time()
+        fields["updated_at"] = now
+        defaults = {"completed_at": now} if fields.get("status") in TERMINAL_STATUSES else None
+        data = self.backend.update(self.name, task_id, fields, defaults)
+        if data is None:
+            return None
+        record = self._to_record(data)
+        version = data.get("_version", 0)
+        with self._lock:
+            watchers = list(self._watchers.get(task_id, ()))
+            # 轮询线程可能已经通知过这个版本
+            if watchers and self._notified.get(task_id, 0) >= version:
+                watchers = []
+            elif watchers:
+                self._notified[task_id] = version
+        self._notify(task_id, watchers, record)
+        return record
+
+    def _notify(self, task_id: str, watchers: List[TaskWatcher], record: TaskRecord) -> None:
+        if not watchers:
+            return
+        snapshot = record.to_dict()
+        for watcher in watchers:
+            try:
+                watcher(self.name, task_id, snapshot)
+            except Exception as e:
+                print(f"任务状态通知失败 ({self.name}): {e}")
+
+    def watch(self, task_ids: Iterable[str], watcher: TaskWatcher) -> None:
+        task_ids = list(task_ids)
+        versions = self.backend.versions(self.name, task_ids)
+        with self._lock:
+            for task_id in task_ids:
+                self._watchers.setdefault(task_id, set()).add(watcher)
+                self._notified.setdefault(task_id, versions.get(task_id, 0))
+            self._watch_changed.notify_all()
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name=f"{self.name}-poller", daemon=True)
+                self._poller.start()
+
+    def unwatch(self, task_ids: Iterable[str], watcher: TaskWatcher) -> None:
+        with self._lock:
+            for task_id in task_ids:
+                watchers = self._watchers.get(task_id)
+                if watchers is None:
+                    continue
+                watchers.discard(watcher)
+                if not watchers:
+                    del self._watchers[task_id]
+                    self._notified.pop(task_id, None)
+
+    def _poll_loop(self) -> None:
+        """有订阅时按poll_interval检查被订阅任务的版本号，发现其他进程的更新后通知订阅者"""
+        while not self._stopping.is_set():
+            with self._lock:
+                while not self._watchers and not self._stopping.is_set():
+                    self._watch_changed.wait(1)
+                notified = dict(self._notified)
+            try:
+                versions = self.backend.versions(self.name, list(notified))
+            except Exception as e:
+                print(f"轮询任务状态失败 ({self.name}): {e}")
+                versions = {}
+            for task_id, version in versions.items():
+                if version <= notified.get(task_id, 0):
+                    continue
+                record = self.get(task_id)
+                with self._lock:
+                    if task_id not in self._watchers or self._notified.get(task_id, 0) >= version:
+                        continue
+                    self._notified[task_id] = version
+                    watchers = list(self._watchers[task_id])
+                if record is not None:
+                    self._notify(task_id, watchers, record)
+            self._stopping.wait(self.poll_interval)
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self._to_record(self.backend.get(self.name, task_id))
+
+    def delete(self, task_id: str) -> None:
+        self.backend.delete(self.name, [task_id])
+
+    def recent(self, limit: int) -> List[Tuple[str, TaskRecord]]:
+        if limit <= 0:
+            return []
+        return [(task_id, self._to_record(data)) for task_id, data in self.backend.recent(self.name, limit)]
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.backend.get(self.name, task_id) is not None
+
+    def __len__(self) -> int:
+        return self.backend.count(self.name)
+
+    def sweep(self) -> int:
+        """清理过期任务，并把超出容量的任务淘汰掉（共享存储在清理时统一淘汰）"""
+        expired = self.backend.expire(self.name, TERMINAL_STATUSES, time.time() - self.ttl_seconds)
+        evicted = self.backend.trim(self.name, self.max_entries, TERMINAL_STATUSES)
+        self.expired += expired
+        self.evicted += evicted
+        return expired
+
+    def stop_sweeper(self) -> None:
+        super().stop_sweeper()
+        with self._lock:
+            self._watch_changed.notify_all()
+        if self._poller is not None:
+            self._poller.join(timeout=1)
+            self._poller = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "watched_tasks": len(self._watchers),
+            "backend": self.backend.describe()
+        }
+
+def create_task_store(name: str, config: Dict[str, Any], backend: Optional[Any] = None) -> TaskStore:
+    """根据mcp_server.task_store配置创建任务存储；指定共享状态存储时任务在各工作进程间共享"""
+    options = dict(
+        ttl_seconds=config.get("ttl_seconds", 3600),
+        max_entries=config.get("max_entries", 100000),
+        sweep_interval=config.get("sweep_interval", 60)
+    )
+    if backend is not None:
+        return SharedTaskStore(name, backend, poll_interval=config.get("poll_interval", 0.05), **options)
+    return TaskStore(name, **options)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 服务模块是mcp-server目录下的平铺模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,56 @@
+"""AI分析缓存：路由到其他模型作答的结果，下一次请求同样命中缓存"""
+import asyncio
+
+import pytest
+
+import main
+from analysis_cache import AnalysisCache
+
+QUESTION = {"expression": "3.5+1.25", "knowledge_point": "decimal_operation"}
+
+@pytest.fixture
+def routed(monkeypatch):
+    calls = []
+
+    async def fake_analyze(question, language="zh-CN", detail_level="standard", provider=None):
+        calls.append(provider["name"])
+        if provider["name"] == "primary":
+            return {"error": "AI API 请求失败: 503", "status_code": 503}
+        return {"analysis": main.AIAnalysis(
+            problem_understanding="小数加法", solution_approach="数位对齐", solution_steps=[],
+            key_concepts=[], common_mistakes=[], tips=[], difficulty_analysis="", alternative_methods=[])}
+
+    providers = [
+        {"name": "primary", "api_base": "http://primary", "api_key": "key", "model": "primary-model", "timeout": 5},
+        {"name": "backup", "api_base": "http://backup", "api_key": "", "model": "backup-model", "timeout": 5},
+    ]
+    monkeypatch.setattr(main, "analysis_cache", AnalysisCache(100))
+    monkeypatch.setattr(main, "analyze_math_question_with_ai", fake_analyze)
+    monkeypatch.setattr(main, "get_ai_providers", lambda configs=None: [dict(provider) for provider in providers])
+    monkeypatch.setattr(main, "ai_router", main.create_ai_router({"failure_threshold": 100}))
+    return calls
+
+def analyze():
+    request = main.AIAnalysisRequest(question=main.MathQuestion(**QUESTION), engine="llm")
+
+    async def run():
+        submitted = await main.submit_ai_analysis(request)
+        if submitted.status == "completed":
+            return submitted
+        return await main.get_ai_analysis_result(submitted.task_id, wait=5)
+
+    return asyncio.run(run())
+
+def test_failover_answer_is_served_from_cache(routed, monkeypatch):
+    first = analyze()
+    assert first.status == "completed"
+    assert routed == ["primary", "backup"]
+
+    # 路由统计清空后primary重新排在第一，backup-model的缓存仍应命中
+    monkeypatch.setattr(main, "ai_router", main.create_ai_router({}))
+    assert asyncio.run(main.get_candidate_models()) == ["primary-model", "backup-model"]
+    second = analyze()
+    assert second.status == "completed"
+    assert second.analysis == first.analysis
+    # 第二次请求直接命中backup-model的缓存，不再调用上游
+    assert routed == ["primary", "backup"]
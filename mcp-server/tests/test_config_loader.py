@@ -0,0 +1,60 @@
+"""配置加载：marshal快照的命中、失效和回退"""
+import pytest
+
+from config_loader import ConfigLoader
+
+@pytest.fixture
+def config_dir(tmp_path):
+    directory = tmp_path / "config"
+    directory.mkdir()
+    (directory / "app.yaml").write_text("app:\n  name: 测试\n  version: 1.0.0\nlimits: [1, 2]\n", encoding="utf-8")
+    return directory
+
+def make_loader(config_dir, tmp_path):
+    return ConfigLoader(str(config_dir), snapshot_dir=tmp_path / "cache")
+
+def test_snapshot_is_reused_until_file_changes(config_dir, tmp_path):
+    loader = make_loader(config_dir, tmp_path)
+    config = loader.load_config("app")
+    assert loader.load_stats["app"]["source"] == "yaml"
+    assert (tmp_path / "cache" / "app.marshal").exists()
+
+    loader = make_loader(config_dir, tmp_path)
+    assert loader.load_config("app") == config == {"app": {"name": "测试", "version": "1.0.0"}, "limits": [1, 2]}
+    assert loader.load_stats["app"]["source"] == "snapshot"
+
+    (config_dir / "app.yaml").write_text("app:\n  name: 新名称\n", encoding="utf-8")
+    loader = make_loader(config_dir, tmp_path)
+    assert loader.get_app_info() == {"name": "新名称"}
+    assert loader.load_stats["app"]["source"] == "yaml"
+
+def test_corrupt_snapshot_falls_back_to_yaml(config_dir, tmp_path):
+    make_loader(config_dir, tmp_path).load_config("app")
+    (tmp_path / "cache" / "app.marshal").write_bytes(b"\x00garbage")
+    loader = make_loader(config_dir, tmp_path)
+    assert loader.get_app_info()["name"] == "测试"
+    assert loader.load_stats["app"]["source"] == "yaml"
+
+def test_values_marshal_cannot_store_skip_the_snapshot(config_dir, tmp_path):
+    (config_dir / "app.yaml").write_text("app:\n  released: 2024-01-01\n", encoding="utf-8")
+    loader = make_loader(config_dir, tmp_path)
+    assert str(loader.get_app_info()["released"]) == "2024-01-01"
+    assert not (tmp_path / "cache" / "app.marshal").exists()
+
+def test_reload_keeps_old_config_on_error(config_dir, tmp_path):
+    loader = make_loader(config_dir, tmp_path)
+    old = loader.load_config("app")
+    (config_dir / "app.yaml").write_text("app: [unclosed\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        loader.reload("app")
+    assert loader.load_config("app") is old
+
+    (config_dir / "app.yaml").write_text("app:\n  name: 新名称\n", encoding="utf-8")
+
+    def reject(config):
+        raise ValueError("配置无效")
+
+    with pytest.raises(ValueError):
+        loader.reload("app", prepare=reject)
+    assert loader.load_config("app") is old
+    assert loader.reload("app")["app"]["name"] == "新名称"
@@ -0,0 +1,81 @@
+"""配置热加载和预先序列化的/api/*响应"""
+import gzip
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from config_loader import ConfigLoader
+from config_watcher import ConfigWatcher, PreparedResponse
+
+BUILDERS = {
+    "operation-types": lambda config: {"operation_types": config["math_generation"]["operation_types"]},
+    "licenses": lambda config: config.get("licenses", {}),
+}
+
+def write_config(path, names, mtime):
+    operation_types = [{"id": name, "name_zh": "运算" * 200} for name in names]
+    path.write_text(json.dumps({"math_generation": {"operation_types": operation_types}}, ensure_ascii=False),
+                    encoding="utf-8")
+    # 显式设置修改时间，连续写入也能被发现
+    os.utime(path, ns=(mtime, mtime))
+
+@pytest.fixture
+def config_path(tmp_path):
+    (tmp_path / "config").mkdir()
+    path = tmp_path / "config" / "app.yaml"
+    write_config(path, ["addition"], 10 ** 18)
+    return path
+
+@pytest.fixture
+def watcher(config_path, tmp_path):
+    loader = ConfigLoader(str(config_path.parent), snapshot_dir=tmp_path / "cache")
+    return ConfigWatcher(loader, BUILDERS, interval=0, gzip_min_size=1024)
+
+def test_reload_replaces_snapshot(watcher, config_path):
+    first = watcher.snapshot
+    assert watcher.check() is False
+    write_config(config_path, ["addition", "subtraction"], 2 * 10 ** 18)
+    assert watcher.check() is True
+    assert watcher.snapshot.version == first.version + 1
+    assert [item["id"] for item in watcher.snapshot.config["math_generation"]["operation_types"]] == \
+        ["addition", "subtraction"]
+    assert watcher.snapshot.responses["operation-types"].etag != first.responses["operation-types"].etag
+    # 旧快照保持不变，正在处理的请求不受影响
+    assert len(json.loads(first.responses["operation-types"].body)["operation_types"]) == 1
+
+def test_same_content_or_invalid_file_keeps_snapshot(watcher, config_path):
+    snapshot = watcher.snapshot
+    write_config(config_path, ["addition"], 3 * 10 ** 18)
+    assert watcher.check() is False and watcher.snapshot is snapshot
+    config_path.write_text("math_generation: [unclosed", encoding="utf-8")
+    assert watcher.check() is False and watcher.snapshot is snapshot
+    assert watcher.stats()["failures"] == 1 and watcher.stats()["reloads"] == 0
+
+def test_prepared_response_etag_and_gzip():
+    large = PreparedResponse({"items": ["题目"] * 1000})
+    assert gzip.decompress(large.gzip_body) == large.body
+    assert PreparedResponse({"items": []}).gzip_body is None
+    assert large.matches(large.etag)
+    assert large.matches(large.etag.removeprefix("W/"))
+    assert large.matches(f'"other", {large.etag}') and large.matches("*")
+    assert not large.matches('"other"') and not large.matches(None)
+
+def test_api_returns_304_for_matching_etag(watcher, config_path, monkeypatch):
+    monkeypatch.setattr(main, "config_watcher", watcher)
+    client = TestClient(main.app)
+    response = client.get("/api/operation-types", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and response.headers["content-encoding"] == "gzip"
+    assert response.json()["operation_types"][0]["id"] == "addition"
+    etag = response.headers["etag"]
+
+    cached = client.get("/api/operation-types", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b"" and cached.headers["etag"] == etag
+
+    write_config(config_path, ["addition", "subtraction"], 4 * 10 ** 18)
+    assert watcher.check()
+    changed = client.get("/api/operation-types", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert len(changed.json()["operation_types"]) == 2
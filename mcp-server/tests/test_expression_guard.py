@@ -0,0 +1,54 @@
+"""表达式校验：语法白名单和开销估算"""
+import pytest
+
+import main
+from expression_guard import ExpressionRejected, create_expression_guard
+from fast_eval import prepare_expression
+from lru_cache import LRUCache
+
+ENGINES = ["fraction", "sympy", "eval"]
+
+@pytest.fixture
+def guard():
+    return create_expression_guard(None)
+
+def route(guard, code):
+    return guard.route(prepare_expression(code), ENGINES)
+
+@pytest.mark.parametrize("code, message", [
+    ("9**9**9", "结果过大"),
+    ("10**200000", "结果过大"),
+    ("9**9**9**9", "指数过大"),
+    ("abs(-3)", "不支持的函数: abs"),
+    ("open(1)", "不支持的函数: open"),
+    ("__import__('os')", "不支持的函数"),
+    ("(1).real", "不支持的语法"),
+    ("'x'*10", "只能包含数字"),
+    ("1" * 101, "数字位数过多"),
+    ("-" * 60 + "1", "嵌套过深"),
+    ("1+", "语法错误"),
+])
+def test_rejected(guard, code, message):
+    with pytest.raises(ExpressionRejected, match=message):
+        route(guard, code)
+
+def test_routing(guard):
+    assert route(guard, "3×4÷6+50%") == ENGINES
+    assert route(guard, "√16+2^10") == ENGINES
+    # 精确结果过大时只做近似计算
+    assert route(guard, "2**5000") == ["sympy"]
+    # 0、1、-1的整数次幂不受指数大小影响
+    assert route(guard, "1**(9**9)") == ENGINES
+    assert route(guard, "(-1)**(9**9)") == ENGINES
+    assert route(guard, "0**(9**9)") == ENGINES
+    assert guard.stats()["approximated"] == 1 and guard.stats()["accepted"] == 5
+
+def test_execute_rejects_power_tower_before_any_engine(monkeypatch):
+    monkeypatch.setattr(main, "result_cache", LRUCache(10))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("不应交给计算引擎")
+
+    monkeypatch.setattr(main, "evaluate_expression", fail)
+    assert "结果过大" in main.execute_code_safely("9**9**9")["error"]
+    assert "不支持的函数" in main.execute_code_safely("abs(-3)")["error"]
@@ -0,0 +1,37 @@
+"""分数快速计算引擎"""
+from fractions import Fraction
+
+import pytest
+
+from fast_eval import UnsupportedExpression, evaluate_exact, evaluate_fraction_engine, format_fraction
+
+def test_percent_and_modulo():
+    assert evaluate_exact("50%") == Fraction(1, 2)
+    assert evaluate_exact("50%+1") == Fraction(3, 2)
+    assert evaluate_exact("200×15%") == 30
+    # 后面跟着数字的%是取余
+    assert evaluate_exact("7%3") == 1
+
+def test_normalized_operators():
+    assert evaluate_exact("3×4÷6=") == 2
+    assert evaluate_exact("2^3+2²") == 12
+    assert evaluate_exact("√16+√(9/4)") == Fraction(11, 2)
+    assert evaluate_exact("0.1+0.2") == Fraction(3, 10)
+
+@pytest.mark.parametrize("code", ["1/0", "1/0.0", "5%0", "1/(2-2)"])
+def test_division_by_zero(code):
+    with pytest.raises(ZeroDivisionError):
+        evaluate_exact(code)
+
+@pytest.mark.parametrize("code", ["√2", "2**0.5", "2**2000", "abs(-3)", "1+"])
+def test_unsupported_expressions_fall_back(code):
+    with pytest.raises(UnsupportedExpression):
+        evaluate_exact(code)
+
+def test_format_fraction():
+    assert format_fraction(Fraction(8)) == "8"
+    assert format_fraction(Fraction(-3, 4)) == "-0.75"
+    assert format_fraction(Fraction(1, 3)) == "1/3"
+    assert format_fraction(Fraction(1, 1024)) == "0.0009765625"
+    assert format_fraction(Fraction(123456789, 1000)) == "123456.789"
+    assert evaluate_fraction_engine("1/3+1/6") == {"result": "0.5", "exact": "1/2"}
@@ -0,0 +1,18 @@
+"""批量批改：答案解析"""
+from grading import DECIMAL, FRACTION, INVALID, parse_cell
+
+def test_mixed_number_is_not_read_as_improper_fraction():
+    assert parse_cell("2 2/5")[:2] == (FRACTION, 2.4)
+    assert parse_cell("-2 2/5")[:2] == (FRACTION, -2.4)
+    assert parse_cell("22/5")[:2] == (FRACTION, 4.4)
+
+def test_simplest_form():
+    assert parse_cell("12/5")[3]
+    assert parse_cell("2 2/5")[3]
+    assert not parse_cell("4/8")[3]
+    assert not parse_cell("4/1")[3]
+    assert not parse_cell("1 7/5")[3]
+
+def test_other_answers():
+    assert parse_cell("2 2/0")[0] == INVALID
+    assert parse_cell("0.75")[:3] == (DECIMAL, 0.75, 2)
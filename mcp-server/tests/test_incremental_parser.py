@@ -0,0 +1,61 @@
+"""AI响应的增量解析：任意位置切分的流式片段"""
+import pytest
+
+from main import IncrementalAnalysisParser, parse_ai_response
+
+RESPONSE = """1. 题目理解
+求两个数的和，
+考查加法。
+2. 解题思路
+把个位和十位分别相加。
+3. 解题步骤
+步骤1：个位相加 3+4=7
+个位不进位。
+步骤2：十位相加 2+1=3
+4. 关键概念
+- 数位
+- 加法
+5. 常见错误
+- 数位没有对齐
+"""
+
+def feed_in_chunks(text, size):
+    parser = IncrementalAnalysisParser()
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    events.extend(parser.close())
+    return parser, events
+
+def describe(events):
+    return [(event["type"], event.get("section") or event["step"].step_number) for event in events]
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64])
+def test_chunk_boundaries_do_not_change_result(size):
+    whole = parse_ai_response(RESPONSE, None)
+    parser, events = feed_in_chunks(RESPONSE, size)
+    assert parser.result() == whole
+    assert describe(events) == [
+        ("section", "problem_understanding"),
+        ("section", "solution_approach"),
+        ("step", 1),
+        ("step", 2),
+        ("section", "key_concepts"),
+        ("section", "common_mistakes"),
+    ]
+
+def test_parsed_fields():
+    analysis = parse_ai_response(RESPONSE, None)
+    assert analysis.problem_understanding == "求两个数的和， 考查加法。"
+    assert [step.description for step in analysis.solution_steps] == ["步骤1：个位相加 3+4=7", "步骤2：十位相加 2+1=3"]
+    assert analysis.solution_steps[0].explanation.strip() == "个位不进位。"
+    assert analysis.key_concepts == ["数位", "加法"]
+    assert analysis.common_mistakes == ["数位没有对齐"]
+
+def test_section_is_emitted_when_next_heading_arrives():
+    parser = IncrementalAnalysisParser()
+    assert parser.feed("题目理解\n求和") == []
+    # 章节标题所在的行未完整时不产生事件
+    assert parser.feed("\n解题") == []
+    assert parser.feed("思路\n") == [{"type": "section", "section": "problem_understanding", "content": "求和"}]
+    assert parser.close() == []
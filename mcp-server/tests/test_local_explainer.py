@@ -0,0 +1,33 @@
+"""本地解答引擎：只解答结果为整数的基础运算题，其余交给大模型"""
+from local_explainer import explain_locally
+
+def final_answer(analysis):
+    return analysis["solution_steps"][-1]["result"]
+
+def test_integer_division_is_explained_locally():
+    analysis = explain_locally({"expression": "12÷4=", "answer": 3, "knowledge_point": "division_concept"})
+    assert final_answer(analysis) == "3"
+
+def test_fraction_division_is_left_to_llm():
+    assert explain_locally({"expression": "3/4", "answer": 0.75, "knowledge_point": "basic_arithmetic"}) is None
+    assert explain_locally({"expression": "3/4", "knowledge_point": "division_concept"}) is None
+
+def test_decimal_division_is_left_to_llm():
+    assert explain_locally({"expression": "12÷5=", "answer": 2.4, "knowledge_point": "division_concept"}) is None
+    assert explain_locally({"expression": "12÷5=", "knowledge_point": "division_concept"}) is None
+
+def test_remainder_question_uses_remainder_form():
+    for expression in ("17÷5=( )余( )", "17÷5=□……□"):
+        analysis = explain_locally({"expression": expression, "knowledge_point": "division_concept"})
+        assert final_answer(analysis) == "3 余 2"
+    analysis = explain_locally({"expression": "17÷5=( )余( )", "knowledge_point": "division_concept"}, "en-US")
+    assert final_answer(analysis) == "3 remainder 2"
+
+def test_missing_knowledge_point_is_left_to_llm():
+    assert explain_locally({"expression": "3+4", "answer": 7}) is None
+
+def test_answer_must_match_local_result():
+    assert explain_locally({"expression": "3+4", "answer": 8, "knowledge_point": "basic_arithmetic"}) is None
+    assert explain_locally({"expression": "3+4", "answer": 7.5, "knowledge_point": "basic_arithmetic"}) is None
+    analysis = explain_locally({"expression": "3+4", "answer": 7.0, "knowledge_point": "basic_arithmetic"})
+    assert final_answer(analysis) == "7"
@@ -0,0 +1,45 @@
+"""批量出题：约束过滤、去重和题目空间耗尽"""
+import numpy as np
+import pytest
+
+from config_loader import config_loader
+from question_generator import GenerationError, QuestionGenerator
+
+@pytest.fixture
+def generator():
+    return QuestionGenerator(config_loader.get_math_config())
+
+def test_exhausted_space_returns_every_unique_question(generator):
+    # 难度1的加数为1-10，只有100道不同的加法题
+    spec = generator.make_spec("addition", difficulty=1)
+    result = generator.generate(spec, 500, np.random.default_rng(1))
+    assert result.exhausted
+    assert len(result) == 100
+    assert len({record["expression"] for record in result.to_records()}) == 100
+
+def test_carry_constraint_shrinks_the_space(generator):
+    spec = generator.make_spec("addition", "carry_addition", difficulty=1)
+    result = generator.generate(spec, 500, np.random.default_rng(1))
+    assert result.exhausted and len(result) == 45
+    for record in result.to_records():
+        a, b = map(int, record["expression"].split("+"))
+        assert a % 10 + b % 10 >= 10 and record["answer"] == a + b
+
+def test_without_unique_count_is_always_reached(generator):
+    spec = generator.make_spec("addition", difficulty=1)
+    result = generator.generate(spec, 500, np.random.default_rng(1), unique=False)
+    assert len(result) == 500 and not result.exhausted
+
+def test_same_seed_same_questions(generator):
+    spec = generator.make_spec("multiplication", difficulty=3)
+    first = generator.generate(spec, 50, np.random.default_rng(7)).to_records()
+    assert first == generator.generate(spec, 50, np.random.default_rng(7)).to_records()
+
+@pytest.mark.parametrize("arguments", [
+    {"operation": "logarithm"},
+    {"operation": "addition", "knowledge_point": "multiplication_table"},
+    {"operation": "addition", "difficulty": 99},
+])
+def test_invalid_spec_is_rejected(generator, arguments):
+    with pytest.raises(GenerationError):
+        generator.make_spec(**arguments)
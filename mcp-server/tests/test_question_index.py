@@ -0,0 +1,51 @@
+"""题目空间索引：构建、映射和按下标抽样"""
+import numpy as np
+import pytest
+
+import question_index
+from config_loader import config_loader
+from question_generator import QuestionGenerator
+from question_index import build_question_index, load_question_index
+
+@pytest.fixture
+def generator():
+    return QuestionGenerator(config_loader.get_math_config())
+
+@pytest.fixture
+def index_path(generator, tmp_path):
+    path = tmp_path / "question_index.bin"
+    # 只收录候选数量较少的题目空间，构建足够快
+    summary = build_question_index(generator, path, 10000)
+    assert summary["entries"] > 0 and summary["skipped"] > 0
+    return path
+
+def test_round_trip_matches_rejection_sampling(generator, index_path):
+    spec = generator.make_spec("addition", "carry_addition", difficulty=1)
+    sampled = generator.generate(spec, 500, np.random.default_rng(1))
+
+    generator.index = load_question_index(index_path)
+    indexed = generator.generate(spec, 500, np.random.default_rng(1))
+    assert indexed.source == "index" and sampled.source == "sampling"
+    assert indexed.exhausted and len(indexed) == len(sampled) == 45
+    assert set(indexed.expressions().tolist()) == set(sampled.expressions().tolist())
+
+def test_grade_limit_uses_sorted_prefix(generator, index_path):
+    generator.index = load_question_index(index_path)
+    spec = generator.make_spec("multiplication", difficulty=3, grade=2)
+    result = generator.generate(spec, 10000, np.random.default_rng(3))
+    assert result.source == "index" and result.exhausted
+    assert max(result.answer_values()) <= spec.max_result
+    assert len(set(result.expressions().tolist())) == len(result)
+
+def test_stale_or_invalid_index_is_ignored(generator, index_path, tmp_path, monkeypatch):
+    index = load_question_index(index_path)
+    # 操作数范围与当前配置不一致的条目视为过期
+    generator.difficulty_ranges[1] = (1, 9)
+    assert index.lookup(generator.make_spec("addition", difficulty=1)) is None
+
+    broken = tmp_path / "broken.bin"
+    broken.write_bytes(b"not an index")
+    assert load_question_index(broken) is None
+    assert load_question_index(tmp_path / "missing.bin") is None
+    monkeypatch.setattr(question_index, "INDEX_VERSION", question_index.INDEX_VERSION + 1)
+    assert load_question_index(index_path) is None
@@ -0,0 +1,45 @@
+"""流式出题：NDJSON/CSV输出和断点续传"""
+import csv
+import io
+import json
+
+import pytest
+
+import question_generator
+from config_loader import config_loader
+from question_generator import QuestionGenerator, iter_question_stream
+
+@pytest.fixture
+def generator(monkeypatch):
+    # 缩小块大小，少量题目也能跨越多个块
+    monkeypatch.setattr(question_generator, "STREAM_CHUNK_SIZE", 30)
+    return QuestionGenerator(config_loader.get_math_config())
+
+def specs(generator):
+    return [generator.make_spec("addition", difficulty=3), generator.make_spec("multiplication", difficulty=3)]
+
+def test_ndjson_lines_match_json_dumps(generator):
+    lines = "".join(iter_question_stream(generator, specs(generator), 100, seed=5)).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [record["index"] for record in records] == list(range(100))
+    assert lines[0] == json.dumps(records[0])
+    assert {record["operation"] for record in records} == {"addition", "multiplication"}
+
+def test_resume_from_offset_matches_full_stream(generator):
+    full = "".join(iter_question_stream(generator, specs(generator), 100, seed=5)).splitlines()
+    resumed = "".join(iter_question_stream(generator, specs(generator), 100, seed=5, offset=45)).splitlines()
+    assert resumed == full[45:]
+
+def test_csv_header_only_at_start(generator):
+    text = "".join(iter_question_stream(generator, specs(generator), 100, seed=5, output_format="csv"))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert len(rows) == 100 and rows[0]["index"] == "0"
+    resumed = "".join(iter_question_stream(generator, specs(generator), 100, seed=5, offset=60, output_format="csv"))
+    assert resumed.splitlines() == text.splitlines()[61:]
+
+def test_stream_stops_when_space_is_exhausted(generator, monkeypatch):
+    monkeypatch.setattr(question_generator, "STREAM_CHUNK_SIZE", 150)
+    # 难度1只有100道不同的加法题，第一块凑不满后不再生成后续的块
+    spec = generator.make_spec("addition", difficulty=1)
+    lines = "".join(iter_question_stream(generator, [spec], 1000, seed=5)).splitlines()
+    assert len(lines) == 100
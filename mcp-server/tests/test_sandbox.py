@@ -0,0 +1,50 @@
+"""计算沙箱：rlimit终止计算进程、超时重建和引擎回退"""
+import pytest
+
+import main
+from sandbox import (SandboxCrashed, SandboxPool, SandboxTimeout, create_sandbox_pool, is_supported)
+
+pytestmark = pytest.mark.skipif(not is_supported(), reason="当前平台不支持计算沙箱")
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(workers=1, cpu_seconds=1, memory_mb=400)
+    yield pool
+    pool.shutdown()
+
+def test_cpu_limit_kills_worker(pool):
+    # 超时时间足够长，由RLIMIT_CPU在1秒后终止计算进程
+    with pytest.raises(SandboxCrashed):
+        pool.evaluate("eval", "9**9**9", timeout=30)
+    assert pool.stats()["crashes"] == 1
+    assert pool.evaluate("eval", "1+1") == {"result": "2"}
+
+def test_memory_limit(pool):
+    with pytest.raises(SandboxCrashed, match="内存"):
+        pool.evaluate("eval", "'x'*(10**9)")
+    assert pool.evaluate("sympy", "sqrt(16)") == {"result": "4.00000000000000"}
+
+def test_timeout_replaces_worker(pool):
+    # 超时时间短于CPU上限，由服务进程终止计算进程
+    with pytest.raises(SandboxTimeout):
+        pool.evaluate("eval", "9**9**9", timeout=0.3)
+    stats = pool.stats()
+    assert stats["timeouts"] == 1 and stats["workers"] == 1 and stats["idle"] == 1
+    assert pool.evaluate("eval", "2+2") == {"result": "4"}
+
+def test_engine_errors_fall_back_but_sandbox_errors_do_not(pool, monkeypatch):
+    monkeypatch.setattr(main, "sandbox_pool", pool)
+    # 分数引擎不支持非整数指数，回退到沙箱中的sympy
+    assert main.evaluate_expression("(2**0.5)**2", 10, ["fraction", "sympy"]) == \
+        {"result": "2.00000000000000", "engine": "sympy"}
+    # 沙箱中的eval无法处理时回退到下一个引擎，错误信息来自最后一个引擎
+    assert "不支持的语法" in main.evaluate_expression("abs(1)", 10, ["eval", "fraction"])["error"]
+    assert main.evaluate_expression("1/0", 10, ["eval", "fraction"])["error"].startswith("执行错误")
+    # 超时说明表达式本身开销过大，不再交给其他引擎
+    with pytest.raises(SandboxTimeout):
+        main.evaluate_expression("9**9**9", 0.3, ["eval", "fraction"])
+
+def test_disabled_sandbox_runs_in_process(monkeypatch):
+    assert create_sandbox_pool({"enabled": False}) is None
+    monkeypatch.setattr(main, "sandbox_pool", None)
+    assert main.evaluate_expression("(2**0.5)**2", 10, ["fraction", "sympy"])["engine"] == "sympy"
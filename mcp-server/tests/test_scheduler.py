@@ -0,0 +1,74 @@
+"""执行调度器：车道优先级、队列满时返回429、超时监控"""
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from scheduler import ExecutionScheduler, SchedulerFullError
+
+def test_interactive_lane_runs_before_bulk():
+    scheduler = ExecutionScheduler(max_workers=1, max_queue_size=10)
+    gate = threading.Event()
+    order = []
+    try:
+        blocker = scheduler.submit(gate.wait, 5)
+        bulk = [scheduler.submit(order.append, f"bulk-{i}", lane="bulk") for i in range(3)]
+        interactive = scheduler.submit(order.append, "interactive", lane="interactive")
+        gate.set()
+        for job in [blocker, interactive] + bulk:
+            job.future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+    assert order == ["interactive", "bulk-0", "bulk-1", "bulk-2"]
+
+def test_full_queue_is_rejected_with_retry_after(monkeypatch):
+    scheduler = ExecutionScheduler(max_workers=1, max_queue_size=1, retry_after=3)
+    monkeypatch.setattr(main, "scheduler", scheduler)
+    gate = threading.Event()
+    try:
+        scheduler.submit(gate.wait, 5)
+        # 唯一的工作线程被占用后，第一个任务在队列中等待，第二个任务被拒绝
+        time.sleep(0.1)
+        scheduler.submit(gate.wait, 5)
+        with pytest.raises(SchedulerFullError) as raised:
+            scheduler.submit(gate.wait, 5)
+        assert raised.value.retry_after == 3
+        with pytest.raises(HTTPException) as rejected:
+            main.schedule_or_reject(gate.wait, 5, lane="bulk")
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers == {"Retry-After": "3"}
+        assert scheduler.stats()["rejected"] == 2
+    finally:
+        gate.set()
+        scheduler.shutdown()
+
+def test_watchdog_expires_running_job():
+    scheduler = ExecutionScheduler(max_workers=1)
+    gate = threading.Event()
+    expired = threading.Event()
+    try:
+        job = scheduler.submit(gate.wait, 5, timeout=0.2, on_timeout=expired.set)
+        with pytest.raises(TimeoutError):
+            job.future.result(timeout=5)
+        assert expired.is_set()
+        assert scheduler.stats()["timed_out"] == 1
+    finally:
+        gate.set()
+        scheduler.shutdown()
+
+def test_job_expires_while_waiting_in_queue():
+    scheduler = ExecutionScheduler(max_workers=1)
+    gate = threading.Event()
+    try:
+        scheduler.submit(gate.wait, 5)
+        job = scheduler.submit(lambda: "never", timeout=0.1)
+        time.sleep(0.3)
+        gate.set()
+        # 排队时间已超过超时时间，任务不再执行
+        with pytest.raises(TimeoutError):
+            job.future.result(timeout=5)
+    finally:
+        gate.set()
+        scheduler.shutdown()
@@ -0,0 +1,257 @@
+"""共享状态存储：SQLite后端和Redis协议后端的WATCH/MULTI重试"""
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from state_backend import (VERSION_FIELD, RedisStateBackend, SharedMapping, SQLiteStateBackend, StateBackendError,
+                           create_state_backend)
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """测试用的Redis协议服务，只实现后端用到的命令；interfere>0时在EXEC前模拟其他客户端修改被WATCH的键"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.revisions = {}
+        self.interfere = 0
+        self.aborted = 0
+
+    def touch(self, key):
+        self.revisions[key] = self.revisions.get(key, 0) + 1
+
+    def run(self, command, args):
+        data = self.data
+        if command == "PING":
+            return "PONG"
+        if command == "EXISTS":
+            return sum(key in data for key in args)
+        if command == "DEL":
+            removed = 0
+            for key in args:
+                if data.pop(key, None) is not None:
+                    removed += 1
+                    self.touch(key)
+            return removed
+        if command in ("HSET", "HSETNX"):
+            record = data.setdefault(args[0], {})
+            pairs = list(zip(args[1::2], args[2::2]))
+            if command == "HSETNX" and pairs[0][0] in record:
+                return 0
+            record.update(pairs)
+            self.touch(args[0])
+            return len(pairs)
+        if command == "HINCRBY":
+            record = data.setdefault(args[0], {})
+            record[args[1]] = str(int(record.get(args[1], 0)) + int(args[2]))
+            self.touch(args[0])
+            return int(record[args[1]])
+        if command == "HGETALL":
+            return [item for pair in data.get(args[0], {}).items() for item in pair]
+        if command == "HGET":
+            return data.get(args[0], {}).get(args[1])
+        if command == "HMGET":
+            record = data.get(args[0], {})
+            return [record.get(name) for name in args[1:]]
+        if command == "ZADD":
+            data.setdefault(args[0], {})[args[2]] = float(args[1])
+            return 1
+        if command == "ZREM":
+            index = data.get(args[0], {})
+            return sum(index.pop(member, None) is not None for member in args[1:])
+        if command == "ZCARD":
+            return len(data.get(args[0], {}))
+        if command in ("ZRANGE", "ZREVRANGE"):
+            members = sorted(data.get(args[0], {}).items(), key=lambda item: item[1])
+            members = [member for member, _ in members]
+            if command == "ZREVRANGE":
+                members.reverse()
+            stop = int(args[2])
+            return members[int(args[1]):None if stop == -1 else stop + 1]
+        raise ValueError(f"ERR unknown command {command}")
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # 与客户端一样关闭Nagle算法，避免流水线请求等待延迟确认
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def encode(self, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return b"-%s\r\n" % str(reply).encode("utf-8")
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self.encode(item) for item in reply)
+        if reply in ("OK", "QUEUED", "PONG"):
+            return b"+%s\r\n" % reply.encode("utf-8")
+        data = reply.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def handle(self):
+        server = self.server
+        watched = {}
+        queued = None
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command, args = args[0].upper(), args[1:]
+            with server.lock:
+                if command == "WATCH":
+                    watched.update((key, server.revisions.get(key, 0)) for key in args)
+                    reply = "OK"
+                elif command == "UNWATCH":
+                    watched.clear()
+                    reply = "OK"
+                elif command == "MULTI":
+                    queued = []
+                    reply = "OK"
+                elif command == "EXEC":
+                    if watched and server.interfere > 0:
+                        server.interfere -= 1
+                        for key in watched:
+                            server.run("HSET", [key, "note", '"other"'])
+                    if any(server.revisions.get(key, 0) != revision for key, revision in watched.items()):
+                        server.aborted += 1
+                        self.wfile.write(b"*-1\r\n")
+                    else:
+                        replies = []
+                        for name, queued_args in queued:
+                            try:
+                                replies.append(server.run(name, queued_args))
+                            except ValueError as e:
+                                replies.append(e)
+                        self.wfile.write(self.encode(replies))
+                    watched.clear()
+                    queued = None
+                    continue
+                elif queued is not None:
+                    queued.append((command, args))
+                    reply = "QUEUED"
+                else:
+                    try:
+                        reply = server.run(command, args)
+                    except ValueError as e:
+                        reply = e
+            self.wfile.write(self.encode(reply))
+
+@pytest.fixture
+def redis_server():
+    server = FakeRedisServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def redis_backend(redis_server):
+    backend = RedisStateBackend(f"redis://127.0.0.1:{redis_server.server_address[1]}/0", update_retries=5)
+    yield backend
+    backend.close()
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite3"))
+    yield backend
+    backend.close()
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request):
+    return request.getfixturevalue(f"{request.param}_backend")
+
+def test_create_update_and_versions(backend):
+    backend.create("tasks", "t1", {"status": "submitted", "updated_at": 1.0})
+    record = backend.update("tasks", "t1", {"status": "running"}, defaults={"started_at": 2.0})
+    assert record["status"] == "running" and record["started_at"] == 2.0 and record[VERSION_FIELD] == 2
+    # defaults只在字段不存在时写入
+    record = backend.update("tasks", "t1", {"status": "completed"}, defaults={"started_at": 3.0})
+    assert record["started_at"] == 2.0 and record[VERSION_FIELD] == 3
+    assert backend.get("tasks", "t1")["status"] == "completed"
+    assert backend.versions("tasks", ["t1", "missing"]) == {"t1": 3}
+    assert backend.update("tasks", "missing", {"status": "running"}) is None
+    assert backend.get("tasks", "missing") is None
+
+def test_recent_expire_and_trim(backend):
+    for number, status in enumerate(["completed", "running", "completed", "running"]):
+        backend.create("tasks", f"t{number}", {"status": status, "updated_at": number + 1.0})
+    assert [key for key, _ in backend.recent("tasks", 2)] == ["t2", "t3"]
+    assert backend.expire("tasks", ["completed"], 2.5) == 1
+    assert [key for key, _ in backend.recent("tasks")] == ["t1", "t2", "t3"]
+    # 超出容量时先淘汰已结束的记录，仍超出时再淘汰最旧的记录
+    assert backend.trim("tasks", 1, ["completed"]) == 2
+    assert [key for key, _ in backend.recent("tasks")] == ["t3"]
+    assert backend.count("tasks") == 1 and backend.count("other") == 0
+
+def test_shared_mapping(backend):
+    configs = SharedMapping(backend, "custom_ai_configs")
+    configs["a"] = {"model": "m1"}
+    configs["b"] = {"model": "m2"}
+    assert configs["a"] == {"model": "m1"}
+    assert "b" in configs and "c" not in configs
+    assert dict(configs.items()) == {"a": {"model": "m1"}, "b": {"model": "m2"}}
+    assert configs.pop("a") == {"model": "m1"}
+    assert list(configs) == ["b"] and len(configs) == 1
+
+def test_sqlite_updates_from_several_connections(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    backends = [SQLiteStateBackend(path) for _ in range(2)]
+    backends[0].create("tasks", "t1", {"status": "running"})
+
+    def worker(backend, name):
+        for step in range(25):
+            backend.update("tasks", "t1", {name: step})
+
+    threads = [threading.Thread(target=worker, args=(backends[number % 2], f"field{number}")) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    record = backends[1].get("tasks", "t1")
+    assert record[VERSION_FIELD] == 101
+    assert all(record[f"field{number}"] == 24 for number in range(4))
+
+def test_redis_update_retries_after_concurrent_change(redis_server, redis_backend):
+    redis_backend.create("tasks", "t1", {"status": "running"})
+    redis_server.interfere = 2
+    record = redis_backend.update("tasks", "t1", {"status": "completed"})
+    assert redis_server.aborted == 2
+    # 重试的事务基于其他客户端修改后的记录，两边的字段都保留
+    assert record["status"] == "completed" and record["note"] == "other"
+
+    redis_server.interfere = 10
+    with pytest.raises(StateBackendError):
+        redis_backend.update("tasks", "t1", {"status": "failed"})
+    assert redis_backend.get("tasks", "t1")["status"] == "completed"
+
+def test_redis_update_of_deleted_record(redis_backend):
+    redis_backend.create("tasks", "t1", {"status": "running"})
+    redis_backend.delete("tasks", ["t1"])
+    assert redis_backend.update("tasks", "t1", {"status": "completed"}) is None
+    assert redis_backend.get("tasks", "t1") is None
+
+def test_create_state_backend(tmp_path):
+    assert create_state_backend(None, tmp_path) is None
+    backend = create_state_backend({"type": "sqlite", "sqlite_path": "state.sqlite3"}, tmp_path)
+    assert backend.describe()["type"] == "sqlite" and (tmp_path / "state.sqlite3").exists()
+    backend.close()
+    with pytest.raises(StateBackendError):
+        create_state_backend({"type": "etcd"}, tmp_path)
@@ -0,0 +1,45 @@
+"""JSON格式的AI响应解析"""
+import json
+
+import pytest
+
+from main import MathQuestion, build_chat_payload, parse_structured_response, use_json_mode
+
+def test_fenced_json_is_mapped_to_analysis():
+    body = {
+        "problem_understanding": "求两个数的和",
+        "solution_steps": [
+            {"step_number": 1, "description": "个位相加", "calculation": "3+4", "result": 7},
+            "十位相加",
+        ],
+        "key_concepts": ["数位", " ", "加法"],
+        "tips": "先算个位",
+    }
+    analysis = parse_structured_response("```json\n" + json.dumps(body, ensure_ascii=False) + "\n```")
+    assert analysis.problem_understanding == "求两个数的和"
+    assert [(step.step_number, step.description) for step in analysis.solution_steps] == [(1, "个位相加"), (2, "十位相加")]
+    assert analysis.solution_steps[0].result == "7"
+    assert analysis.key_concepts == ["数位", "加法"]
+    assert analysis.tips == ["先算个位"]
+    assert analysis.common_mistakes == [] and analysis.difficulty_analysis == ""
+
+def test_invalid_step_number_falls_back_to_position():
+    analysis = parse_structured_response('{"solution_steps": [{"step_number": "一", "description": "审题"}]}')
+    assert analysis.solution_steps[0].step_number == 1
+
+@pytest.mark.parametrize("text", ["1. 题目理解\n求和", "{不是JSON}", "[1, 2]", ""])
+def test_non_json_returns_none(text):
+    assert parse_structured_response(text) is None
+
+def test_json_mode_only_for_non_stream_requests():
+    config = {"model": "test-model", "json_mode": True}
+    assert use_json_mode(config)
+    assert not use_json_mode(config, stream=True)
+    assert not use_json_mode({"model": "test-model", "json_mode": False})
+
+    question = MathQuestion(expression="3+4", answer=7)
+    payload = build_chat_payload(question, "zh-CN", "standard", config)
+    assert payload["response_format"] == {"type": "json_object"}
+    assert "stream" not in payload
+    stream_payload = build_chat_payload(question, "zh-CN", "standard", config, stream=True)
+    assert "response_format" not in stream_payload and stream_payload["stream"]
@@ -0,0 +1,84 @@
+"""任务状态推送：SSE和长轮询"""
+import asyncio
+import json
+
+from task_events import stream_task_events, wait_for_task
+from task_store import TaskStore
+
+def parse_events(chunks):
+    """解析SSE消息，心跳注释返回("keep-alive", None)"""
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            events.append(("keep-alive", None))
+            continue
+        event, data = chunk.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+def test_stream_reports_updates_until_done():
+    store = TaskStore("tasks")
+    store.create("t1", status="running")
+    store.create("t2", status="completed", result="3")
+
+    async def scenario():
+        consumer = asyncio.create_task(collect(stream_task_events([(store, ["t1", "t2", "t3"])], heartbeat=5)))
+        await asyncio.sleep(0.05)
+        store.update("t1", status="completed", result="42")
+        return await asyncio.wait_for(consumer, 5)
+
+    events = parse_events(asyncio.run(scenario()))
+    assert [(event, data.get("task_id"), data.get("status")) for event, data in events] == [
+        ("task", "t1", "running"),
+        ("task", "t2", "completed"),
+        ("missing", "t3", None),
+        ("task", "t1", "completed"),
+        ("done", None, None),
+    ]
+    assert events[3][1]["result"] == "42"
+
+def test_stream_reports_expired_task_instead_of_hanging():
+    store = TaskStore("tasks")
+    store.create("t1", status="running")
+
+    async def scenario():
+        consumer = asyncio.create_task(collect(stream_task_events([(store, ["t1"])], heartbeat=0.1)))
+        await asyncio.sleep(0.05)
+        # 任务被TTL或容量上限淘汰后不会再有更新
+        store.delete("t1")
+        return await asyncio.wait_for(consumer, 5)
+
+    events = parse_events(asyncio.run(scenario()))
+    assert events[0][0] == "task"
+    assert events[1] == ("missing", {"store": "tasks", "task_id": "t1", "reason": "expired"})
+    assert events[-1] == ("done", {})
+    assert store.stats()["watched_tasks"] == 0
+
+def test_long_poll_returns_when_task_finishes():
+    store = TaskStore("tasks")
+    store.create("t1", status="running")
+
+    async def scenario():
+        waiter = asyncio.create_task(wait_for_task(store, "t1", 5))
+        await asyncio.sleep(0.05)
+        store.update("t1", status="completed")
+        return await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(scenario()).status == "completed"
+    assert store.stats()["watched_tasks"] == 0
+
+def test_long_poll_returns_none_for_expired_task():
+    store = TaskStore("tasks")
+    store.create("t1", status="running")
+
+    async def scenario():
+        waiter = asyncio.create_task(wait_for_task(store, "t1", 0.2))
+        await asyncio.sleep(0.05)
+        store.delete("t1")
+        return await asyncio.wait_for(waiter, 5)
+
+    assert asyncio.run(scenario()) is None
+    assert asyncio.run(wait_for_task(store, "missing", 5)) is None
@@ -0,0 +1,52 @@
+"""任务存储：TTL过期、容量淘汰和状态通知"""
+import asyncio
+import time
+
+from task_store import TaskStore, create_task_store
+
+def test_sweep_removes_only_expired_terminal_tasks():
+    store = TaskStore("tasks", ttl_seconds=60)
+    store.create("done", status="completed")
+    store.create("running", status="running")
+    store.create("fresh", status="completed")
+    # 将两个任务的最后更新时间拨回TTL之前
+    store.get("done").updated_at = time.time() - 120
+    store.get("running").updated_at = time.time() - 120
+    assert store.sweep() == 1
+    assert "done" not in store
+    assert "running" in store and "fresh" in store
+    assert store.stats()["expired"] == 1
+
+def test_overflow_evicts_finished_tasks_first():
+    store = TaskStore("tasks", max_entries=2)
+    store.create("a", status="running")
+    store.create("b", status="completed")
+    store.create("c", status="running")
+    assert "b" not in store
+    assert [task_id for task_id, _ in store.recent(10)] == ["a", "c"]
+    store.create("d", status="running")
+    assert [task_id for task_id, _ in store.recent(10)] == ["c", "d"]
+    assert store.stats()["evicted"] == 2
+
+def test_update_sets_completion_time_and_notifies_watchers():
+    store = TaskStore("tasks")
+    store.create("t1")
+    events = []
+    store.watch(["t1"], lambda name, task_id, snapshot: events.append((name, task_id, snapshot["status"])))
+    store.update("t1", status="running")
+    record = store.update("t1", status="completed", result="42")
+    assert record.completed_at == record.updated_at
+    assert events == [("tasks", "t1", "running"), ("tasks", "t1", "completed")]
+    assert store.update("missing", status="completed") is None
+
+def test_async_methods_use_the_same_records():
+    store = create_task_store("tasks", {"ttl_seconds": 10})
+
+    async def scenario():
+        await store.acreate("t1", status="running")
+        await store.aupdate("t1", status="completed")
+        record = await store.aget("t1")
+        await store.adelete("t1")
+        return record.status, await store.aget("t1"), (await store.astats())["ttl_seconds"]
+
+    assert asyncio.run(scenario()) == ("completed", None, 10)